@@ -1,164 +1,210 @@
-import json
-import os
+import queue
 import re
-from datetime import datetime
+import sys
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from datetime import datetime, timedelta
 from tkinter import *
-from tkinter import messagebox, simpledialog, ttk
-from typing import Optional, List
+from tkinter import font, messagebox, simpledialog, ttk
+from typing import List
 
-DATA_FILE = 'bank_gui_data.json'
-ADMIN_PIN = "admin123"  # Simple admin access (in real app, use proper authentication)
+import smartbank_core
+from smartbank_core import *
 
-class Transaction:
-    def __init__(self, txn_type: str, amount: float, date: Optional[str] = None, description: str = ""):
-        self.txn_type = txn_type
-        self.amount = amount
-        self.date = date or datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.description = description
+LIST_PAGE_SIZE = 100  # rows a list window fetches at a time
+LIST_PAGE_CACHE = 50  # fetched pages a list window keeps
+TASK_POLL_MS = 50  # how often the GUI picks up finished background work
+METRICS_REFRESH_MS = 1000  # how often the metrics window redraws
+ACCOUNT_ROW_HEADER = (
+    f"{'Account':<12} {'Name':<20} {'Type':<8} {'Balance':>13}  {'Created':<10}  Last Access"
+)
 
-    def to_dict(self):
-        return {
-            'txn_type': self.txn_type,
-            'amount': self.amount,
-            'date': self.date,
-            'description': self.description
-        }
-
-    @staticmethod
-    def from_dict(data):
-        return Transaction(
-            data['txn_type'],
-            data['amount'],
-            data['date'],
-            data.get('description', "")
-        )
-
-class BankAccount:
-    def __init__(self, name, account_number, pin, account_type, balance=0.0, transactions=None):
-        self.name = name
-        self.account_number = account_number
-        self.pin = pin
-        self.account_type = account_type
-        self.balance = balance
-        self.transactions = transactions or []
-        self.creation_date = datetime.now().strftime('%Y-%m-%d')
-        self.last_accessed = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    def deposit(self, amount: float, description: str = ""):
-        if amount <= 0:
-            raise ValueError("Deposit amount must be positive")
-        self.balance += amount
-        self.transactions.append(Transaction("deposit", amount, description=description))
-        self.last_accessed = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    def withdraw(self, amount: float, description: str = ""):
-        if amount <= 0:
-            raise ValueError("Withdrawal amount must be positive")
-        if amount > self.balance:
-            raise ValueError("Insufficient balance")
-        self.balance -= amount
-        self.transactions.append(Transaction("withdraw", amount, description=description))
-        self.last_accessed = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    def apply_interest(self, rate: float = 0.04):
-        if self.account_type.lower() == "savings":
-            interest = self.balance * rate
-            self.balance += interest
-            self.transactions.append(
-                Transaction("interest", interest, description=f"Interest @ {rate*100}%")
-            )
-            self.last_accessed = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-            return interest
-        return 0
-
-    def transfer(self, target_account, amount: float, description: str = ""):
-        if amount <= 0:
-            raise ValueError("Transfer amount must be positive")
-        if self.account_number == target_account.account_number:
-            raise ValueError("Cannot transfer to the same account")
-        self.withdraw(amount, description=f"Transfer to {target_account.account_number}: {description}")
-        target_account.deposit(amount, description=f"Transfer from {self.account_number}: {description}")
-        self.last_accessed = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        target_account.last_accessed = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    def get_summary(self):
-        return (
-            f"Account Holder: {self.name}\n"
-            f"Account Number: {self.account_number}\n"
-            f"Account Type: {self.account_type.capitalize()}\n"
-            f"Creation Date: {self.creation_date}\n"
-            f"Last Accessed: {self.last_accessed}\n"
-            f"Current Balance: ₹{self.balance:.2f}\n"
-            f"Transaction Count: {len(self.transactions)}"
-        )
-
-    def get_transactions(self, limit=None, txn_type=None):
-        transactions = self.transactions.copy()
-        if txn_type:
-            transactions = [t for t in transactions if t.txn_type == txn_type]
-        if limit:
-            transactions = transactions[-limit:]
-        return transactions
-
-    def get_balance_history(self):
-        balance = 0
-        history = []
-        for txn in self.transactions:
-            if txn.txn_type in ["deposit", "interest", "transfer_from"]:
-                balance += txn.amount
-            else:
-                balance -= txn.amount
-            history.append((txn.date, balance))
-        return history
-
-    def change_pin(self, new_pin):
-        if not re.match(r'^\d{4}$', new_pin):
-            raise ValueError("PIN must be 4 digits")
-        self.pin = new_pin
-        self.last_accessed = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-
-    def to_dict(self):
-        return {
-            'name': self.name,
-            'account_number': self.account_number,
-            'pin': self.pin,
-            'account_type': self.account_type,
-            'balance': self.balance,
-            'transactions': [t.to_dict() for t in self.transactions],
-            'creation_date': self.creation_date,
-            'last_accessed': self.last_accessed
-        }
-
-    @staticmethod
-    def from_dict(data):
-        account = BankAccount(
-            data['name'],
-            data['account_number'],
-            data['pin'],
-            data['account_type'],
-            data['balance'],
-            [Transaction.from_dict(t) for t in data.get('transactions', [])]
-        )
-        account.creation_date = data.get('creation_date', datetime.now().strftime('%Y-%m-%d'))
-        account.last_accessed = data.get('last_accessed', datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-        return account
+storage = None  # set to the bank's store and accounts when the window opens
+accounts = None
+current_user = None  # Global variable declaration
 
-def load_accounts():
-    if os.path.exists(DATA_FILE):
-        with open(DATA_FILE, 'r') as f:
+# Background work
+class TaskRunner:
+    # Runs slow work off the Tk event thread. Changes and persistence go through
+    # a single writer thread, so they reach storage in the order they were
+    # submitted; queries get their own thread and do not queue behind a
+    # checkpoint. Tk must only be touched from the event thread, so finished
+    # work is handed back through a queue that poll() drains with root.after.
+    def __init__(self, root, on_busy):
+        self.root = root
+        self.on_busy = on_busy  # called with the label of the oldest running task, or None
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='smartbank-writer')
+        self.reader = ThreadPoolExecutor(max_workers=1, thread_name_prefix='smartbank-reader')
+        self.finished = queue.SimpleQueue()
+        self.running = []
+        self.root.after(TASK_POLL_MS, self.poll)
+    
+    def write(self, label, work, on_done=None, on_error=None):
+        self._submit(self.writer, label, work, on_done, on_error)
+    
+    def query(self, label, work, on_done=None, on_error=None):
+        self._submit(self.reader, label, work, on_done, on_error)
+    
+    def _submit(self, executor, label, work, on_done, on_error):
+        task = [label]
+        self.running.append(task)
+        self.on_busy(self.running[0][0])
+        
+        def run():
             try:
-                raw = json.load(f)
-                return {k: BankAccount.from_dict(v) for k, v in raw.items()}
-            except json.JSONDecodeError:
-                return {}
-    return {}
-
-def save_accounts(accounts):
-    with open(DATA_FILE, 'w') as f:
-        json.dump({k: acc.to_dict() for k, acc in accounts.items()}, f, indent=4)
+                if metrics.enabled:
+                    result = metrics.call(f"task.{label}", work, (), {})
+                else:
+                    result = work()
+                self.finished.put((task, on_done, result, None))
+            except Exception as e:
+                self.finished.put((task, on_error, None, e))
+        
+        executor.submit(run)
+    
+    def poll(self):
+        while True:
+            try:
+                task, callback, result, error = self.finished.get_nowait()
+            except queue.Empty:
+                break
+            self.running.remove(task)
+            self.on_busy(self.running[0][0] if self.running else None)
+            try:
+                if error is None:
+                    if callback:
+                        callback(result)
+                elif callback:
+                    callback(error)
+                else:
+                    messagebox.showerror("Error", str(error))
+            except Exception as e:
+                messagebox.showerror("Error", str(e))
+        self.root.after(TASK_POLL_MS, self.poll)
+    
+    def shutdown(self):
+        self.writer.shutdown()
+        self.reader.shutdown()
 
-accounts = load_accounts()
-current_user = None  # Global variable declaration
+# Widgets
+class VirtualList(ttk.Frame):
+    # Scrolling list of any number of one-line rows that only draws the rows in
+    # view. The model is a row count and fetch(start, count), which returns the
+    # text of rows start.. (fewer at the end); rows are fetched a page at a time
+    # and the most recently used pages are kept. Given load(work, on_done), e.g.
+    # a TaskRunner query, pages are fetched through it off the event thread and
+    # their rows are drawn blank until they arrive.
+    def __init__(self, parent, font_spec=('Consolas', 10)):
+        super().__init__(parent)
+        self.header = ttk.Label(self, font=font_spec, justify=LEFT)
+        self.header.pack(fill=X)
+        self.text = Text(self, wrap=NONE, font=font_spec, state=DISABLED)
+        self.scrollbar = ttk.Scrollbar(self, orient=VERTICAL, command=self.on_scroll)
+        self.text.pack(side=LEFT, fill=BOTH, expand=True)
+        self.scrollbar.pack(side=RIGHT, fill=Y)
+        self.line_height = font.Font(font=font_spec).metrics('linespace')
+        self.count = 0
+        self.fetch = None
+        self.load = None
+        self.loading = set()  # pages asked of load that have not arrived
+        self.model = 0  # bumped by set_model, so pages of an old model are dropped
+        self.empty_text = ""
+        self.first = 0
+        self.pages = OrderedDict()
+        
+        self.text.bind('<Configure>', lambda event: self.render())
+        self.text.bind('<MouseWheel>', lambda event: self.scroll_by(-3 if event.delta > 0 else 3))
+        self.text.bind('<Button-4>', lambda event: self.scroll_by(-3))
+        self.text.bind('<Button-5>', lambda event: self.scroll_by(3))
+        self.text.bind('<Up>', lambda event: self.scroll_by(-1))
+        self.text.bind('<Down>', lambda event: self.scroll_by(1))
+        self.text.bind('<Prior>', lambda event: self.scroll_by(-self.visible_rows()))
+        self.text.bind('<Next>', lambda event: self.scroll_by(self.visible_rows()))
+        self.text.bind('<Home>', lambda event: self.scroll_to(0))
+        self.text.bind('<End>', lambda event: self.scroll_to(self.count))
+    
+    def set_model(self, count, fetch, header="", empty_text="Nothing to show", load=None):
+        self.count = count
+        self.fetch = fetch
+        self.load = load
+        self.loading.clear()
+        self.model += 1
+        self.empty_text = empty_text
+        self.header.config(text=header)
+        self.pages.clear()
+        self.first = 0
+        self.render()
+    
+    def show_lines(self, lines, header=""):
+        # A short fixed list, e.g. a report
+        lines = list(lines)
+        self.set_model(len(lines), lambda start, count: lines[start:start + count], header)
+    
+    def visible_rows(self):
+        return max(1, self.text.winfo_height() // self.line_height)
+    
+    def row(self, i):
+        page_no, offset = divmod(i, LIST_PAGE_SIZE)
+        page = self.pages.get(page_no)
+        if page is None:
+            if self.load is not None:
+                self.load_page(page_no)
+                return ""
+            page = self.keep_page(page_no, self.fetch(page_no * LIST_PAGE_SIZE, LIST_PAGE_SIZE))
+        else:
+            self.pages.move_to_end(page_no)
+        return page[offset] if offset < len(page) else ""
+    
+    def keep_page(self, page_no, page):
+        self.pages[page_no] = page
+        while len(self.pages) > LIST_PAGE_CACHE:
+            self.pages.popitem(last=False)
+        return page
+    
+    def load_page(self, page_no):
+        if page_no in self.loading:
+            return
+        self.loading.add(page_no)
+        model, fetch = self.model, self.fetch
+        
+        def loaded(page):
+            if model == self.model:
+                self.loading.discard(page_no)
+                self.keep_page(page_no, page)
+                self.render()
+        
+        self.load(lambda: fetch(page_no * LIST_PAGE_SIZE, LIST_PAGE_SIZE), loaded)
+    
+    def scroll_to(self, first):
+        self.first = max(0, min(first, self.count - self.visible_rows()))
+        self.render()
+    
+    def scroll_by(self, rows):
+        self.scroll_to(self.first + rows)
+        return "break"
+    
+    def on_scroll(self, action, amount, unit=None):
+        if action == MOVETO:
+            self.scroll_to(int(float(amount) * self.count))
+        elif unit == PAGES:
+            self.scroll_by(int(amount) * self.visible_rows())
+        else:
+            self.scroll_by(int(amount))
+    
+    def render(self):
+        self.text.config(state=NORMAL)
+        self.text.delete(1.0, END)
+        if not self.count:
+            self.text.insert(END, self.empty_text)
+            self.scrollbar.set(0, 1)
+        else:
+            shown = self.visible_rows()
+            self.first = max(0, min(self.first, self.count - shown))
+            last = min(self.count, self.first + shown)
+            self.text.insert(END, "\n".join(self.row(i) for i in range(self.first, last)))
+            self.scrollbar.set(self.first / self.count, last / self.count)
+        self.text.config(state=DISABLED)
 
 # Main Application
 class SmartBankApp:
@@ -174,6 +220,9 @@ class SmartBankApp:
         
         self.create_widgets()
         self.update_welcome_message()
+        self.tasks = TaskRunner(self.root, self.set_busy)
+        self.closing = False
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
         
     def configure_styles(self):
         self.style.configure('TFrame', background='#f0f2f5')
@@ -259,6 +308,67 @@ class SmartBankApp:
             foreground='#7f8c8d'
         )
         self.footer.pack(side=BOTTOM, pady=5)
+        
+        # Status bar, busy while background work runs
+        self.status_frame = ttk.Frame(self.root)
+        self.status_frame.pack(side=BOTTOM, fill=X, padx=10)
+        
+        self.status_label = ttk.Label(self.status_frame, text="", font=('Segoe UI', 9))
+        self.status_label.pack(side=LEFT)
+        
+        self.progress = ttk.Progressbar(self.status_frame, mode='indeterminate', length=150)
+        self.progress.pack(side=RIGHT)
+    
+    def set_busy(self, label):
+        if label:
+            self.status_label.config(text=f"{label}...")
+            self.progress.start(10)
+        else:
+            self.status_label.config(text="")
+            self.progress.stop()
+    
+    def on_close(self):
+        if self.closing:
+            return
+        self.closing = True
+        
+        def close_storage():
+            # Fold the journal into a fresh snapshot so the next start replays nothing
+            with store_lock:
+                storage.checkpoint(force=True)
+                storage.close()
+        
+        def closed(error=None):
+            if error is not None:
+                messagebox.showerror("Error", f"Could not save on exit: {error}")
+            self.tasks.shutdown()
+            self.root.destroy()
+        
+        # Queued behind any change still being written
+        self.tasks.write("Saving", close_storage, lambda _: closed(), closed)
+    
+    def run_change(self, label, change, on_done, dialog=None):
+        # Apply change on the writer thread, then fold the journal if it is due.
+        # The dialog is hidden meanwhile, so it cannot be submitted twice, and
+        # comes back if the change fails.
+        def work():
+            result = change()
+            checkpoint_if_needed(accounts)
+            return result
+        
+        def done(result):
+            if dialog is not None:
+                dialog.destroy()
+            on_done(result)
+        
+        def failed(error):
+            if dialog is not None:
+                dialog.deiconify()
+            messagebox.showerror("Error", str(error))
+        
+        if dialog is not None:
+            dialog.withdraw()
+        self.tasks.write(label, work, done, failed)
     
     def update_welcome_message(self):
         global current_user
@@ -324,13 +434,18 @@ class SmartBankApp:
                 if acc_type not in ['savings', 'current']:
                     raise ValueError("Account type must be 'savings' or 'current'")
                 
-                if acc_no in accounts:
-                    raise ValueError("Account number already exists")
+                def create():
+                    # Checked on the writer thread, in order with other openings
+                    if acc_no in accounts:
+                        raise ValueError("Account number already exists")
+                    open_account(accounts, BankAccount(name, acc_no, pin, acc_type))
                 
-                accounts[acc_no] = BankAccount(name, acc_no, pin, acc_type)
-                save_accounts(accounts)
-                messagebox.showinfo("Success", f"Thank you {name}, your account has been created!")
-                top.destroy()
+                self.run_change(
+                    "Creating account",
+                    create,
+                    lambda _: messagebox.showinfo("Success", f"Thank you {name}, your account has been created!"),
+                    top
+                )
                 
             except Exception as e:
                 messagebox.showerror("Error", str(e))
@@ -369,17 +484,20 @@ class SmartBankApp:
                     top.destroy()
                     return
                 
-                user = accounts.get(acc_no)
-                if not user:
-                    raise ValueError("Account not found")
-                
-                if user.pin != pin:
-                    raise ValueError("Invalid PIN")
+                def logged_in(user):
+                    global current_user
+                    if not user:
+                        raise ValueError("Account not found")
+                    
+                    if user.pin != pin:
+                        raise ValueError("Invalid PIN")
+                    
+                    current_user = user
+                    self.update_welcome_message()
+                    self.show_output(f"Login successful!\n\n{user.get_summary()}")
+                    top.destroy()
                 
-                current_user = user
-                self.update_welcome_message()
-                self.show_output(f"Login successful!\n\n{user.get_summary()}")
-                top.destroy()
+                self.tasks.query("Loading account", lambda: accounts.get(acc_no), logged_in)
                 
             except Exception as e:
                 messagebox.showerror("Error", str(e))
@@ -424,16 +542,18 @@ class SmartBankApp:
                 if amount <= 0:
                     raise ValueError("Amount must be positive")
                 
-                current_user.deposit(amount, description)
-                save_accounts(accounts)
-                
-                self.show_output(
-                    f"Deposit successful!\n"
-                    f"Amount: ₹{amount:.2f}\n"
-                    f"New Balance: ₹{current_user.balance:.2f}\n\n"
-                    f"{current_user.get_summary()}"
+                user = current_user
+                self.run_change(
+                    "Saving deposit",
+                    lambda: user.deposit(amount, description),
+                    lambda _: self.show_output(
+                        f"Deposit successful!\n"
+                        f"Amount: ₹{amount:.2f}\n"
+                        f"New Balance: ₹{user.balance:.2f}\n\n"
+                        f"{user.get_summary()}"
+                    ),
+                    top
                 )
-                top.destroy()
                 
             except ValueError as e:
                 messagebox.showerror("Error", str(e))
@@ -471,16 +591,18 @@ class SmartBankApp:
                 if amount <= 0:
                     raise ValueError("Amount must be positive")
                 
-                current_user.withdraw(amount, description)
-                save_accounts(accounts)
-                
-                self.show_output(
-                    f"Withdrawal successful!\n"
-                    f"Amount: ₹{amount:.2f}\n"
-                    f"New Balance: ₹{current_user.balance:.2f}\n\n"
-                    f"{current_user.get_summary()}"
+                user = current_user
+                self.run_change(
+                    "Saving withdrawal",
+                    lambda: user.withdraw(amount, description),
+                    lambda _: self.show_output(
+                        f"Withdrawal successful!\n"
+                        f"Amount: ₹{amount:.2f}\n"
+                        f"New Balance: ₹{user.balance:.2f}\n\n"
+                        f"{user.get_summary()}"
+                    ),
+                    top
                 )
-                top.destroy()
                 
             except ValueError as e:
                 messagebox.showerror("Error", str(e))
@@ -529,21 +651,27 @@ class SmartBankApp:
                 if recipient == current_user.account_number:
                     raise ValueError("Cannot transfer to your own account")
                 
-                target_account = accounts.get(recipient)
-                if not target_account:
-                    raise ValueError("Recipient account not found")
+                user = current_user
                 
-                current_user.transfer(target_account, amount, description)
-                save_accounts(accounts)
+                def transfer():
+                    target_account = accounts.get(recipient)
+                    if not target_account:
+                        raise ValueError("Recipient account not found")
+                    user.transfer(target_account, amount, description)
+                    return target_account
                 
-                self.show_output(
-                    f"Transfer successful!\n"
-                    f"Amount: ₹{amount:.2f}\n"
-                    f"To: {target_account.name} ({target_account.account_number})\n"
-                    f"New Balance: ₹{current_user.balance:.2f}\n\n"
-                    f"{current_user.get_summary()}"
+                self.run_change(
+                    "Saving transfer",
+                    transfer,
+                    lambda target_account: self.show_output(
+                        f"Transfer successful!\n"
+                        f"Amount: ₹{amount:.2f}\n"
+                        f"To: {target_account.name} ({target_account.account_number})\n"
+                        f"New Balance: ₹{user.balance:.2f}\n\n"
+                        f"{user.get_summary()}"
+                    ),
+                    top
                 )
-                top.destroy()
                 
             except ValueError as e:
                 messagebox.showerror("Error", str(e))
@@ -564,25 +692,35 @@ class SmartBankApp:
             messagebox.showerror("Error", "Interest only applies to savings accounts")
             return
             
-        try:
-            interest = current_user.apply_interest()
-            save_accounts(accounts)
-            
-            self.show_output(
+        user = current_user
+        self.run_change(
+            "Applying interest",
+            user.apply_interest,
+            lambda interest: self.show_output(
                 f"Interest applied successfully!\n"
                 f"Interest Amount: ₹{interest:.2f}\n"
-                f"New Balance: ₹{current_user.balance:.2f}\n\n"
-                f"{current_user.get_summary()}"
+                f"New Balance: ₹{user.balance:.2f}\n\n"
+                f"{user.get_summary()}"
             )
-        except Exception as e:
-            messagebox.showerror("Error", str(e))
+        )
     
     def summary_gui(self):
         if not current_user:
             messagebox.showerror("Error", "Please login first")
             return
             
-        self.show_output(current_user.get_summary())
+        user = current_user
+        
+        def summarize():
+            # Building the monthly rollup can take a while on a long history
+            lines = [user.get_summary(), "", f"{'Month':<7}   {'Money In':>13}  {'Money Out':>13}  {'Closing':>13}"]
+            for key, totals, closing in user.rollup('month')[-6:]:
+                money_in = sum(paise for txn_type, (_, paise) in totals.items() if txn_type in CREDIT_TYPES)
+                money_out = sum(paise for txn_type, (_, paise) in totals.items() if txn_type not in CREDIT_TYPES)
+                lines.append(f"{key}   ₹{money_in / 100:>12.2f}  ₹{money_out / 100:>12.2f}  ₹{closing / 100:>12.2f}")
+            return "\n".join(lines)
+        
+        self.tasks.query("Summarizing", summarize, self.show_output)
     
     def transactions_gui(self):
         if not current_user:
@@ -636,28 +774,40 @@ class SmartBankApp:
             "10", "20", "50", "100", "All"
         ).pack(side=LEFT, padx=5)
         
+        search_frame = ttk.Frame(top)
+        search_frame.pack(fill=X)
+        
+        ttk.Label(search_frame, text="Description contains:").pack(side=LEFT, padx=5)
+        search_entry = ttk.Entry(search_frame)
+        search_entry.pack(side=LEFT, padx=5, expand=True, fill=X)
+        
         def update_transactions():
             try:
                 txn_type = None if filter_var.get() == "all" else filter_var.get()
-                limit = None if limit_var.get() == "All" else int(limit_var.get())
-                
-                transactions = current_user.get_transactions(limit, txn_type)
-                
-                text_area.config(state=NORMAL)
-                text_area.delete(1.0, END)
-                
-                if not transactions:
-                    text_area.insert(END, "No transactions found")
-                    return
+                rows = current_user.transaction_rows(
+                    txn_type=txn_type,
+                    text=search_entry.get().strip() or None
+                )
+                count = len(rows) if limit_var.get() == "All" else min(len(rows), int(limit_var.get()))
+                ledger = current_user.transactions
                 
-                text_area.insert(END, f"Transaction History ({len(transactions)} records)\n\n")
-                for txn in transactions:
-                    text_area.insert(END, f"{txn.date} - {txn.txn_type.upper()} ₹{txn.amount:.2f}")
-                    if txn.description:
-                        text_area.insert(END, f" - {txn.description}")
-                    text_area.insert(END, "\n")
+                def fetch(start, count_wanted):
+                    # Row 0 is the newest transaction
+                    lines = []
+                    for k in range(start, min(start + count_wanted, count)):
+                        txn = ledger[rows[len(rows) - 1 - k]]
+                        line = f"{txn.date} - {txn.txn_type.upper()} ₹{txn.amount:.2f}"
+                        if txn.description:
+                            line += f" - {txn.description}"
+                        lines.append(line)
+                    return lines
                 
-                text_area.config(state=DISABLED)
+                view.set_model(
+                    count,
+                    fetch,
+                    f"Transaction History ({count} of {len(rows)} records, newest first)",
+                    "No transactions found"
+                )
             except Exception as e:
                 messagebox.showerror("Error", str(e))
         
@@ -669,19 +819,8 @@ class SmartBankApp:
         )
         update_btn.pack(side=RIGHT, padx=5)
         
-        text_frame = ttk.Frame(top)
-        text_frame.pack(fill=BOTH, expand=True, padx=10, pady=5)
-        
-        text_area = Text(
-            text_frame,
-            wrap=WORD,
-            font=('Consolas', 10)
-        )
-        scrollbar = ttk.Scrollbar(text_frame, orient=VERTICAL, command=text_area.yview)
-        text_area.config(yscrollcommand=scrollbar.set)
-        
-        text_area.pack(side=LEFT, fill=BOTH, expand=True)
-        scrollbar.pack(side=RIGHT, fill=Y)
+        view = VirtualList(top)
+        view.pack(fill=BOTH, expand=True, padx=10, pady=5)
         
         update_transactions()
     
@@ -719,11 +858,13 @@ class SmartBankApp:
                 if new_pin != confirm_pin:
                     raise ValueError("New PINs do not match")
                 
-                current_user.change_pin(new_pin)
-                save_accounts(accounts)
-                
-                messagebox.showinfo("Success", "PIN changed successfully!")
-                top.destroy()
+                user = current_user
+                self.run_change(
+                    "Changing PIN",
+                    lambda: user.change_pin(new_pin),
+                    lambda _: messagebox.showinfo("Success", "PIN changed successfully!"),
+                    top
+                )
                 
             except ValueError as e:
                 messagebox.showerror("Error", str(e))
@@ -744,41 +885,59 @@ class SmartBankApp:
             messagebox.showinfo("Info", "No transaction history available")
             return
             
-        history = current_user.get_balance_history()
-        if not history:
-            return
-            
         top = Toplevel(self.root)
         top.title("Balance History")
         top.geometry("600x500")
         
-        text_frame = ttk.Frame(top)
-        text_frame.pack(fill=BOTH, expand=True, padx=10, pady=10)
-        
-        text_area = Text(
-            text_frame,
-            wrap=WORD,
-            font=('Consolas', 10)
-        )
-        scrollbar = ttk.Scrollbar(text_frame, orient=VERTICAL, command=text_area.yview)
-        text_area.config(yscrollcommand=scrollbar.set)
+        filter_frame = ttk.Frame(top)
+        filter_frame.pack(pady=10, fill=X)
         
-        text_area.pack(side=LEFT, fill=BOTH, expand=True)
-        scrollbar.pack(side=RIGHT, fill=Y)
+        ttk.Label(filter_frame, text="From (YYYY-MM-DD):").pack(side=LEFT, padx=5)
+        from_entry = ttk.Entry(filter_frame, width=12)
+        from_entry.pack(side=LEFT, padx=5)
         
-        text_area.config(state=NORMAL)
-        text_area.delete(1.0, END)
+        ttk.Label(filter_frame, text="To:").pack(side=LEFT, padx=5)
+        to_entry = ttk.Entry(filter_frame, width=12)
+        to_entry.pack(side=LEFT, padx=5)
         
-        text_area.insert(END, f"Balance History for Account {current_user.account_number}\n")
-        text_area.insert(END, f"Current Balance: ₹{current_user.balance:.2f}\n\n")
+        def update_history():
+            try:
+                start = from_entry.get().strip() or None
+                end = to_entry.get().strip() or None
+                lo, hi = current_user._time_range(start, end)
+                as_of = current_user.balance_as_of(end) if end else None
+            except ValueError:
+                messagebox.showerror("Error", "Dates must be in YYYY-MM-DD format")
+                return
+            
+            ledger = current_user.transactions
+            header = (
+                f"Balance History for Account {current_user.account_number}\n"
+                f"Current Balance: ₹{current_user.balance:.2f}\n"
+            )
+            if as_of is not None:
+                header += f"Balance as of {end}: ₹{as_of:.2f}\n"
+            header += "\nDate/Time                Balance\n--------------------------------"
+            
+            def fetch(start_row, count):
+                return [
+                    f"{epoch_to_date(ledger.timestamps[i])}  ₹{ledger.balance_after(i) / 100:.2f}"
+                    for i in range(lo + start_row, min(lo + start_row + count, hi))
+                ]
+            
+            view.set_model(hi - lo, fetch, header, "No transactions in this period")
         
-        text_area.insert(END, "Date/Time                Balance\n")
-        text_area.insert(END, "--------------------------------\n")
+        ttk.Button(
+            filter_frame,
+            text="Show",
+            command=update_history,
+            style='Primary.TButton'
+        ).pack(side=RIGHT, padx=5)
         
-        for date, balance in history:
-            text_area.insert(END, f"{date}  ₹{balance:.2f}\n")
+        view = VirtualList(top)
+        view.pack(fill=BOTH, expand=True, padx=10, pady=5)
         
-        text_area.config(state=DISABLED)
+        update_history()
         
         ttk.Button(
             top,
@@ -807,35 +966,33 @@ class SmartBankApp:
         search_entry = ttk.Entry(search_frame)
         search_entry.pack(side=LEFT, padx=5, expand=True, fill=X)
         
+        searches = {'latest': 0}
+        
         def search_account():
             search_term = search_entry.get().strip()
             if not search_term:
                 return
-                
-            results = []
-            for acc_no, account in accounts.items():
-                if (search_term in acc_no or 
-                    search_term.lower() in account.name.lower()):
-                    results.append(account)
-            
-            text_area.config(state=NORMAL)
-            text_area.delete(1.0, END)
-            
-            if not results:
-                text_area.insert(END, "No accounts found")
-                return
-                
-            text_area.insert(END, f"Found {len(results)} accounts:\n\n")
-            for account in results:
-                text_area.insert(END, f"Account: {account.account_number}\n")
-                text_area.insert(END, f"Name: {account.name}\n")
-                text_area.insert(END, f"Type: {account.account_type}\n")
-                text_area.insert(END, f"Balance: ₹{account.balance:.2f}\n")
-                text_area.insert(END, f"Created: {account.creation_date}\n")
-                text_area.insert(END, f"Last Access: {account.last_accessed}\n")
-                text_area.insert(END, "-"*50 + "\n")
             
-            text_area.config(state=DISABLED)
+            # Searches run as the admin types; only the newest one is shown
+            searches['latest'] += 1
+            seq = searches['latest']
+            self.tasks.query(
+                "Searching",
+                lambda: accounts.search(search_term),
+                lambda results: show_results(results) if seq == searches['latest'] else None
+            )
+        
+        def show_results(results):
+            if len(results) == SEARCH_RESULT_LIMIT:
+                header = f"Showing the top {len(results)} matches:"
+            else:
+                header = f"Found {len(results)} accounts:"
+            view.set_model(
+                len(results),
+                lambda start, count: [self.account_row(a) for a in results[start:start + count]],
+                header + "\n" + ACCOUNT_ROW_HEADER,
+                "No accounts found"
+            )
         
         ttk.Button(
             search_frame,
@@ -843,25 +1000,54 @@ class SmartBankApp:
             command=search_account,
             style='Primary.TButton'
         ).pack(side=LEFT, padx=5)
+        search_entry.bind('<KeyRelease>', lambda event: search_account())
         
         # Stats Frame
         stats_frame = ttk.Frame(top)
         stats_frame.pack(pady=10, fill=X)
         
         def show_stats():
-            total_accounts = len(accounts)
-            savings = sum(1 for acc in accounts.values() if acc.account_type.lower() == "savings")
+            stats = storage.stats
+            total_accounts = stats.total_accounts()
+            savings = stats.accounts_by_type.get("savings", 0)
             current = total_accounts - savings
-            total_balance = sum(acc.balance for acc in accounts.values())
+            total_balance = stats.total_balance / 100
             
-            text_area.config(state=NORMAL)
-            text_area.delete(1.0, END)
-            text_area.insert(END, "Bank Statistics:\n\n")
-            text_area.insert(END, f"Total Accounts: {total_accounts}\n")
-            text_area.insert(END, f"Savings Accounts: {savings}\n")
-            text_area.insert(END, f"Current Accounts: {current}\n")
-            text_area.insert(END, f"Total Bank Balance: ₹{total_balance:.2f}\n")
-            text_area.config(state=DISABLED)
+            lines = [
+                f"Total Accounts: {total_accounts}",
+                f"Savings Accounts: {savings}",
+                f"Current Accounts: {current}",
+                f"Total Bank Balance: ₹{total_balance:.2f}",
+                "",
+                f"Transactions: {sum(stats.txn_counts.values())}"
+            ]
+            for txn_type in sorted(stats.txn_counts):
+                lines.append(
+                    f"  {txn_type.replace('_', ' ').title()}: {stats.txn_counts[txn_type]} "
+                    f"(₹{stats.txn_totals.get(txn_type, 0) / 100:.2f})"
+                )
+            
+            lines.extend(["", "Last 7 Days:        Deposits      Withdrawals"])
+            for days_ago in range(7):
+                day = (datetime.now() - timedelta(days=days_ago)).strftime('%Y-%m-%d')
+                volumes = stats.day(day)
+                deposits = volumes.get("deposit", [0, 0])[1] / 100
+                withdrawals = volumes.get("withdraw", [0, 0])[1] / 100
+                lines.append(f"  {day}   ₹{deposits:>12.2f}  ₹{withdrawals:>12.2f}")
+            
+            lines.extend(["", "Last 6 Months:      Deposits      Withdrawals    Closing Balance"])
+            for key, totals, closing in stats.rollup('month')[-6:]:
+                deposits = totals.get("deposit", [0, 0])[1] / 100
+                withdrawals = totals.get("withdraw", [0, 0])[1] / 100
+                lines.append(f"  {key}      ₹{deposits:>12.2f}  ₹{withdrawals:>12.2f}  ₹{closing / 100:>14.2f}")
+            
+            lines.extend(["", f"Velocity Alerts: {velocity.flagged} flagged, {velocity.blocked} blocked"])
+            for alert in list(velocity.alerts)[:-11:-1]:
+                lines.append(
+                    f"  {alert['date']}  {alert['account']:<10} {alert['action']:<5}  {alert['rule']} "
+                    f"({alert['txn_type'].replace('_', ' ')} ₹{alert['amount']:.2f})"
+                )
+            view.show_lines(lines, "Bank Statistics:")
         
         ttk.Button(
             stats_frame,
@@ -873,49 +1059,197 @@ class SmartBankApp:
         ttk.Button(
             stats_frame,
             text="List All Accounts",
-            command=lambda: self.list_all_accounts(text_area),
+            command=lambda: self.list_all_accounts(view),
             style='Primary.TButton'
         ).pack(side=LEFT, padx=5)
         
-        # Text Area
-        text_frame = ttk.Frame(top)
-        text_frame.pack(fill=BOTH, expand=True, padx=10, pady=5)
+        def month_end_interest():
+            self.tasks.query(
+                "Calculating interest",
+                lambda: apply_interest_to_all(accounts, dry_run=True),
+                confirm_interest
+            )
         
-        text_area = Text(
-            text_frame,
-            wrap=WORD,
-            font=('Consolas', 10)
-        )
-        scrollbar = ttk.Scrollbar(text_frame, orient=VERTICAL, command=text_area.yview)
-        text_area.config(yscrollcommand=scrollbar.set)
+        def confirm_interest(preview):
+            if not preview['accounts']:
+                messagebox.showinfo("Info", "No savings accounts are due any interest")
+                return
+            if not messagebox.askyesno(
+                    "Confirm",
+                    f"Post ₹{preview['total_interest']:.2f} interest to {preview['accounts']} savings accounts?"):
+                return
+            self.run_change("Posting interest", lambda: apply_interest_to_all(accounts), interest_posted)
+        
+        def interest_posted(report):
+            show_stats()
+            messagebox.showinfo(
+                "Success",
+                f"Posted ₹{report['total_interest']:.2f} interest to {report['accounts']} accounts"
+            )
         
-        text_area.pack(side=LEFT, fill=BOTH, expand=True)
-        scrollbar.pack(side=RIGHT, fill=Y)
+        ttk.Button(
+            stats_frame,
+            text="Month-End Interest",
+            command=month_end_interest,
+            style='Warning.TButton'
+        ).pack(side=LEFT, padx=5)
+        
+        ttk.Button(
+            stats_frame,
+            text="Metrics",
+            command=self.metrics_gui,
+            style='Primary.TButton'
+        ).pack(side=LEFT, padx=5)
+        
+        # Account list
+        view = VirtualList(top)
+        view.pack(fill=BOTH, expand=True, padx=10, pady=5)
         
         show_stats()
     
-    def list_all_accounts(self, text_area):
-        text_area.config(state=NORMAL)
-        text_area.delete(1.0, END)
+    def metrics_gui(self):
+        top = Toplevel(self.root)
+        top.title("Metrics")
+        top.geometry("950x500")
         
-        if not accounts:
-            text_area.insert(END, "No accounts in the system")
-            return
-            
-        text_area.insert(END, "All Accounts:\n\n")
-        for acc_no, account in accounts.items():
-            text_area.insert(END, f"Account: {acc_no}\n")
-            text_area.insert(END, f"Name: {account.name}\n")
-            text_area.insert(END, f"Type: {account.account_type}\n")
-            text_area.insert(END, f"Balance: ₹{account.balance:.2f}\n")
-            text_area.insert(END, f"Created: {account.creation_date}\n")
-            text_area.insert(END, f"Last Access: {account.last_accessed}\n")
-            text_area.insert(END, "-"*50 + "\n")
-        
-        text_area.config(state=DISABLED)
+        ttk.Label(
+            top,
+            text="Operation Latency",
+            style='Header.TLabel'
+        ).pack(pady=10)
+        
+        controls = ttk.Frame(top)
+        controls.pack(pady=5, fill=X)
+        
+        enabled = BooleanVar(value=metrics.enabled)
+        ttk.Checkbutton(
+            controls,
+            text="Record metrics",
+            variable=enabled,
+            command=lambda: setattr(metrics, 'enabled', enabled.get())
+        ).pack(side=LEFT, padx=5)
+        
+        ttk.Label(controls, text="Profile calls slower than (ms):").pack(side=LEFT, padx=5)
+        threshold_entry = ttk.Entry(controls, width=8)
+        threshold_entry.pack(side=LEFT, padx=5)
+        if metrics.profile_threshold is not None:
+            threshold_entry.insert(0, f"{metrics.profile_threshold * 1000:g}")
+        
+        def set_threshold():
+            text = threshold_entry.get().strip()
+            try:
+                threshold = float(text) / 1000 if text else None
+            except ValueError:
+                messagebox.showerror("Error", "Enter a number of milliseconds, or leave it empty to stop profiling")
+                return
+            metrics.profile_threshold = threshold
+        
+        ttk.Button(
+            controls,
+            text="Apply",
+            command=set_threshold,
+            style='Primary.TButton'
+        ).pack(side=LEFT, padx=5)
+        
+        def export():
+            try:
+                metrics.dump()
+            except OSError as e:
+                messagebox.showerror("Error", str(e))
+                return
+            messagebox.showinfo("Success", f"Metrics written to {METRICS_FILE}")
+        
+        ttk.Button(
+            controls,
+            text="Export",
+            command=export,
+            style='Success.TButton'
+        ).pack(side=LEFT, padx=5)
+        
+        ttk.Button(
+            controls,
+            text="Reset",
+            command=lambda: (metrics.reset(), refresh(again=False)),
+            style='Warning.TButton'
+        ).pack(side=LEFT, padx=5)
+        
+        view = VirtualList(top)
+        view.pack(fill=BOTH, expand=True, padx=10, pady=5)
+        
+        header = (
+            f"{'Operation':<36} {'Calls':>8} {'Errors':>6} {'p50 ms':>9} {'p95 ms':>9} "
+            f"{'p99 ms':>9} {'Max ms':>9} {'Total s':>9}"
+        )
+        
+        def refresh(again=True):
+            if not top.winfo_exists():
+                return
+            rows = [
+                f"{name[:36]:<36} {calls:>8} {errors:>6} {p50 * 1000:>9.2f} {p95 * 1000:>9.2f} "
+                f"{p99 * 1000:>9.2f} {slowest * 1000:>9.2f} {total:>9.2f}"
+                for name, calls, errors, p50, p95, p99, slowest, total in metrics.summary()
+            ]
+            status = "Recording" if metrics.enabled else "Paused"
+            if metrics.profiles_written:
+                status += f", {metrics.profiles_written} slow-call profiles in {PROFILE_DIR}/"
+            first = view.first
+            view.show_lines(rows, f"{status}\n{header}")
+            view.scroll_to(first)
+            if again:
+                top.after(METRICS_REFRESH_MS, refresh)
+        
+        refresh()
+        
+        ttk.Button(
+            top,
+            text="Close",
+            command=top.destroy,
+            style='Danger.TButton'
+        ).pack(pady=10)
+    
+    def list_all_accounts(self, view):
+        # Rows scrolled into view are read from the stored account headers,
+        # so no account or ledger is loaded to list it. Pages are read by the
+        # query thread; store_lock is never taken on the event thread.
+        total = len(accounts)
+
+        def rows(start, count):
+            with store_lock:
+                return [self.header_row(header) for header in islice(storage.account_headers(start), count)]
+
+        view.set_model(
+            total,
+            rows,
+            f"All Accounts ({total}):\n" + ACCOUNT_ROW_HEADER,
+            "No accounts in the system",
+            lambda work, on_done: self.tasks.query("Loading accounts", work, on_done)
+        )
+    
+    @staticmethod
+    def header_row(header):
+        return (
+            f"{header['account_number']:<12} {header['name'][:20]:<20} {header['account_type']:<8} "
+            f"₹{header['balance']:>12.2f}  {header['creation_date']}  {header['last_accessed']}"
+        )
+
+    @staticmethod
+    def account_row(account):
+        return SmartBankApp.header_row(vars(account))
+
+instrument_methods(SmartBankApp, 'gui')
 
 # Initialize and run the application
 if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        from smartbank_cli import main
+        sys.exit(main(sys.argv[1:]))
+    try:
+        accounts = open_bank()
+    except RuntimeError as e:
+        Tk().withdraw()
+        messagebox.showerror("SmartBank", str(e))
+        sys.exit(1)
+    storage = smartbank_core.storage
     root = Tk()
     app = SmartBankApp(root)
-    root.mainloop()
\ No newline at end of file
+    root.mainloop()
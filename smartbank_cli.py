@@ -0,0 +1,324 @@
+# SmartBank from the command line, with no GUI: account operations and
+# reports that read only the accounts they need, plus the bulk import and
+# export, server and benchmark tools.
+import argparse
+import getpass
+import json
+import sys
+import time
+from datetime import datetime, timedelta
+
+import smartbank_core
+from smartbank_core import *
+
+SCRATCH_COMMANDS = {'durability', 'recovery', 'bench', 'loadtest', 'stress'}
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="SmartBank command line tools")
+    commands = parser.add_subparsers(dest='command', required=True)
+    balance = commands.add_parser('balance', help="show an account's details and balance")
+    balance.add_argument('account')
+    balance.add_argument('--pin', help="asked for if not given")
+    for name, help_text in (('deposit', "deposit money"), ('withdraw', "withdraw money")):
+        change = commands.add_parser(name, help=help_text)
+        change.add_argument('account')
+        change.add_argument('amount', type=float)
+        change.add_argument('--description', default="")
+        change.add_argument('--pin', help="asked for if not given")
+    transfer = commands.add_parser('transfer', help="move money to another account")
+    transfer.add_argument('account')
+    transfer.add_argument('target')
+    transfer.add_argument('amount', type=float)
+    transfer.add_argument('--description', default="")
+    transfer.add_argument('--pin', help="asked for if not given")
+    statement = commands.add_parser('statement', help="an account's transactions with running balances")
+    statement.add_argument('account')
+    statement.add_argument('--from', dest='start', metavar='YYYY-MM-DD', help="defaults to the start of this month")
+    statement.add_argument('--to', dest='end', metavar='YYYY-MM-DD')
+    statement.add_argument('--pin', help="asked for if not given")
+    commands.add_parser('stats', help="bank-wide statistics")
+    reconciliation = commands.add_parser('reconcile', help="recompute every balance from its history and report discrepancies")
+    reconciliation.add_argument('--full', action='store_true',
+                                help="re-verify every account, not only those changed since the last run")
+    reconciliation.add_argument('--workers', type=int, help="processes to check with (default: one per CPU)")
+    reconciliation.add_argument('--json', action='store_true', help="print JSON instead of a table")
+    bulk = commands.add_parser('import', help="apply deposits, withdrawals and transfers from a CSV or JSONL file")
+    bulk.add_argument('file')
+    bulk_accounts = commands.add_parser('import-accounts', help="open the accounts in a SmartBank JSON data file")
+    bulk_accounts.add_argument('file')
+    export = commands.add_parser('export', help="write account statements with running balances as CSV or JSONL")
+    export.add_argument('output', help="file to write, or - for standard output")
+    export.add_argument('--account', action='append', dest='accounts', metavar='NUMBER',
+                        help="account to include (repeatable); all accounts by default")
+    export.add_argument('--from', dest='start', metavar='YYYY-MM-DD')
+    export.add_argument('--to', dest='end', metavar='YYYY-MM-DD')
+    export.add_argument('--format', choices=['csv', 'jsonl'],
+                        help="defaults to the output file's extension, else csv")
+    serve = commands.add_parser('serve', help="serve SmartBank operations as line-delimited JSON over a socket")
+    serve.add_argument('--host', default=SERVER_HOST)
+    serve.add_argument('--port', type=int, default=SERVER_PORT)
+    serve.add_argument('--unix', metavar='PATH', help="listen on a Unix socket instead of TCP")
+    serve.add_argument('--metrics', metavar='FILE', help="keep Prometheus text-format latency metrics in FILE")
+    serve.add_argument('--profile-slower-than', type=float, metavar='MS',
+                       help=f"save a cProfile trace of every operation slower than MS milliseconds in {PROFILE_DIR}/")
+    durability = commands.add_parser('durability', help="measure deposit latency and throughput in each journal mode")
+    durability.add_argument('--workers', type=int, default=8)
+    durability.add_argument('--operations', type=int, default=4000)
+    recovery = commands.add_parser('recovery', help="measure restart time as the transaction history grows")
+    recovery.add_argument('--sizes', type=int, nargs='+', default=[20000, 80000, 320000])
+    bench = commands.add_parser('bench', help="benchmark the core on a generated bank and write the results as JSON")
+    bench.add_argument('--accounts', type=int, default=2000)
+    bench.add_argument('--transactions', type=int, default=50, help="per account, on average")
+    bench.add_argument('--mix', default="deposit=50,withdraw=30,transfer=20",
+                       help="relative weights of the generated transaction types")
+    bench.add_argument('--operations', type=int, default=5000, help="of each kind of change")
+    bench.add_argument('--queries', type=int, default=500, help="of each kind of query")
+    bench.add_argument('--journal-mode', choices=['always', 'group', 'async'], default=JOURNAL_FSYNC)
+    bench.add_argument('--seed', type=int, default=1)
+    bench.add_argument('--output', help="write the results to this JSON file as well")
+    bench.add_argument('--compare', metavar='BASELINE', help="results file of an earlier run to compare with")
+    load = commands.add_parser('loadtest', help="simulate ATM customers from worker processes and check the ledger")
+    load.add_argument('--workers', type=int, default=4, help="ATMs, each a process with its own connection")
+    load.add_argument('--sessions', type=int, default=50, help="customer visits per ATM")
+    load.add_argument('--ops', type=int, default=5, help="operations per visit, on average")
+    load.add_argument('--mix', default="balance=30,deposit=30,withdraw=25,transfer=15")
+    load.add_argument('--think', type=float, default=0.0, metavar='MS', help="mean pause before each request")
+    load.add_argument('--accounts', type=int, default=100)
+    load.add_argument('--first-account', type=int, default=LOAD_FIRST_ACCOUNT)
+    load.add_argument('--opening-balance', type=float, default=10000, help="of each scratch account")
+    load.add_argument('--pin', default="1111")
+    load.add_argument('--seed', type=int, default=1)
+    load.add_argument('--journal-mode', choices=['always', 'group', 'async'], default=JOURNAL_FSYNC)
+    load.add_argument('--connect', metavar='ADDRESS',
+                      help="HOST:PORT or socket path of a running server whose accounts FIRST_ACCOUNT.. use PIN; "
+                           "by default a scratch server is started")
+    load.add_argument('--record', metavar='TRACE', help="write the traffic and its outcomes to a JSONL trace")
+    load.add_argument('--replay', metavar='TRACE', help="send a recorded trace instead of generating traffic")
+    rollups = commands.add_parser('rollups', help="day or month totals for the bank or one account")
+    rollups.add_argument('--account', help="one account instead of the whole bank")
+    rollups.add_argument('--period', choices=list(ROLLUP_PERIODS), default='month')
+    rollups.add_argument('--from', dest='start', metavar='DATE')
+    rollups.add_argument('--to', dest='end', metavar='DATE')
+    rollups.add_argument('--json', action='store_true', help="print JSON instead of a table")
+    rollups.add_argument('--rebuild', action='store_true', help="recount the bank-wide rollups from all accounts first")
+    stress = commands.add_parser('stress', help="check that concurrent operations keep the ledger consistent")
+    stress.add_argument('--workers', type=int, default=8)
+    stress.add_argument('--operations', type=int, default=20000)
+    stress.add_argument('--accounts', type=int, default=20)
+    for tool in (durability, recovery, bench, load, stress):
+        tool.add_argument('--velocity-rules', action='store_true',
+                          help="screen the synthetic traffic with the live velocity rules, which it soon trips")
+    args = parser.parse_args(argv)
+    if args.command in SCRATCH_COMMANDS:
+        return run_tool(parser, args)
+
+    try:
+        accounts = open_bank()
+    except RuntimeError as e:
+        parser.exit(1, f"{e}\n")
+    storage = smartbank_core.storage
+    try:
+        return run_command(parser, args, accounts)
+    finally:
+        storage.close()
+
+def customer(parser, accounts, acc_no, pin):
+    # The account, once its PIN checks out
+    account = accounts.get(acc_no)
+    if account is None:
+        parser.exit(1, f"Account {acc_no} not found\n")
+    if pin is None:
+        pin = getpass.getpass("PIN: ")
+    if account.pin != pin:
+        parser.exit(1, "Invalid PIN\n")
+    return account
+
+def run_command(parser, args, accounts):
+    storage = smartbank_core.storage
+    if args.command == 'balance':
+        print(customer(parser, accounts, args.account, args.pin).get_summary())
+        return 0
+
+    if args.command in ('deposit', 'withdraw', 'transfer'):
+        account = customer(parser, accounts, args.account, args.pin)
+        try:
+            if args.command == 'deposit':
+                account.deposit(args.amount, args.description)
+            elif args.command == 'withdraw':
+                account.withdraw(args.amount, args.description)
+            else:
+                target = accounts.get(args.target)
+                if target is None:
+                    raise ValueError("Recipient account not found")
+                account.transfer(target, args.amount, args.description)
+        except ValueError as e:
+            print(e, file=sys.stderr)
+            return 1
+        checkpoint_if_needed(accounts)
+        print(f"New balance: ₹{account.balance:.2f}")
+        return 0
+
+    if args.command == 'statement':
+        account = customer(parser, accounts, args.account, args.pin)
+        start = args.start or now_text()[:8] + "01"
+        try:
+            rows = list(statement_rows(accounts, [account.account_number], start, args.end))
+        except ValueError:
+            parser.error("dates must be in YYYY-MM-DD format")
+        print(f"Statement for {account.name}, account {account.account_number}, from {start}"
+              + (f" to {args.end}" if args.end else ""))
+        print(f"Opening balance: ₹{account.balance_as_of((datetime.fromisoformat(start) - timedelta(days=1)).strftime('%Y-%m-%d')):.2f}")
+        print(f"{'Date/Time':<20} {'Type':<14} {'Amount':>12} {'Balance':>12}  Description")
+        for row in rows:
+            print(f"{row['date']:<20} {row['txn_type']:<14} {row['amount']:>12.2f} {row['balance']:>12.2f}  "
+                  f"{row['description']}")
+        closing = rows[-1]['balance'] if rows else account.balance_as_of(args.end) if args.end else account.balance
+        print(f"Closing balance: ₹{closing:.2f} ({len(rows)} transactions)")
+        return 0
+
+    if args.command == 'stats':
+        stats = storage.stats
+        print(f"Total Accounts: {stats.total_accounts()}")
+        for account_type, count in sorted(stats.accounts_by_type.items()):
+            print(f"  {account_type.title()}: {count}")
+        print(f"Total Bank Balance: ₹{stats.total_balance / 100:.2f}")
+        print(f"Transactions: {sum(stats.txn_counts.values())}")
+        for txn_type in sorted(stats.txn_counts):
+            print(f"  {txn_type.replace('_', ' ').title()}: {stats.txn_counts[txn_type]} "
+                  f"(₹{stats.txn_totals.get(txn_type, 0) / 100:.2f})")
+        print()
+        print("\n".join(format_rollup(rollup_report(accounts, period='month')[-6:])))
+        return 0
+
+    if args.command == 'reconcile':
+        report = reconcile(storage, args.full, args.workers)
+        if args.json:
+            print(json.dumps(report, indent=2))
+        else:
+            print("\n".join(format_reconciliation(report)))
+        return 0 if report['ok'] else 1
+
+    if args.command == 'import':
+        report = import_operations(accounts, read_operations(args.file))
+        for line_no, message in report['errors']:
+            print(f"{args.file}:{line_no}: {message}", file=sys.stderr)
+        rate = report['applied'] / report['seconds'] if report['seconds'] else 0
+        print(f"Applied {report['applied']} operations, {report['failed']} failed "
+              f"({report['seconds']:.2f}s, {rate:,.0f} ops/s)")
+        return 1 if report['failed'] else 0
+
+    if args.command == 'import-accounts':
+        report = import_accounts(accounts, read_accounts(args.file))
+        print(f"Added {report['added']} accounts, skipped {report['skipped']} that already exist")
+        return 0
+
+    if args.command == 'export':
+        fmt = args.format or ('jsonl' if args.output.lower().endswith('.jsonl') else 'csv')
+        for acc_no in args.accounts or ():
+            if acc_no not in accounts:
+                print(f"Account {acc_no} not found", file=sys.stderr)
+                return 1
+        rows = statement_rows(accounts, args.accounts, args.start, args.end)
+        if args.output == '-':
+            count = write_statement(rows, sys.stdout, fmt)
+        else:
+            with open(args.output, 'w', newline='', encoding='utf-8') as out:
+                count = write_statement(rows, out, fmt)
+        print(f"Exported {count} transactions", file=sys.stderr)
+        return 0
+
+    if args.command == 'rollups':
+        if args.rebuild:
+            started = time.perf_counter()
+            with store_lock:
+                storage.rebuild_stats()
+            print(f"Rebuilt rollups in {time.perf_counter() - started:.2f}s", file=sys.stderr)
+        try:
+            rows = rollup_report(accounts, args.account, args.period, args.start, args.end)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.json:
+            print(json.dumps(rows, indent=2))
+        else:
+            print("\n".join(format_rollup(rows)))
+        return 0
+
+    if args.command == 'serve':
+        try:
+            metrics.enabled = bool(args.metrics or args.profile_slower_than is not None)
+            if args.profile_slower_than is not None:
+                metrics.profile_threshold = args.profile_slower_than / 1000
+            import asyncio
+            asyncio.run(BankServer(accounts, args.metrics).serve(args.host, args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            save_accounts(accounts)
+            if args.metrics:
+                metrics.dump(args.metrics)
+        return 0
+
+def run_tool(parser, args):
+    # Benchmarks and checks that bring their own scratch stores
+    rules = VELOCITY_RULES if args.velocity_rules else ()
+    if args.command == 'durability':
+        for mode, result in durability_benchmark(args.workers, args.operations, velocity_rules=rules).items():
+            print(f"{mode:>7}: {result['ops_per_second']:>8,} ops/s  "
+                  f"p50 {result['p50_ms']:.3f} ms  p99 {result['p99_ms']:.3f} ms  "
+                  f"{result['journal_writes']:,} journal writes  "
+                  f"{result['velocity_flagged']:,} flagged")
+        return 0
+
+    if args.command == 'recovery':
+        for total, row in recovery_benchmark(args.sizes, velocity_rules=rules).items():
+            print(f"{total:>9,} transactions: "
+                  f"snapshots {row['snapshots']['seconds']:.3f}s "
+                  f"({row['snapshots']['replayed_records']:,} records replayed), "
+                  f"journal only {row['journal_only']['seconds']:.3f}s "
+                  f"({row['journal_only']['replayed_records']:,} records replayed)")
+        return 0
+
+    if args.command == 'bench':
+        try:
+            mix = parse_mix(args.mix, BENCH_TXN_MIX)
+        except ValueError as e:
+            parser.error(f"--mix: {e}")
+        report = benchmark_suite(args.accounts, args.transactions, mix, args.operations, args.queries,
+                                 args.journal_mode, args.seed, rules)
+        print(json.dumps(report, indent=2))
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(report, f, indent=2)
+        if args.compare:
+            with open(args.compare) as f:
+                baseline = json.load(f)
+            print(f"\n{'metric':<40} {'baseline':>12} {'current':>12} {'ratio':>8}", file=sys.stderr)
+            for metric, old, new, ratio in compare_benchmarks(baseline, report):
+                print(f"{metric:<40} {old:>12} {new:>12} {ratio if ratio is not None else '-':>8}", file=sys.stderr)
+        return 0
+
+    if args.command == 'loadtest':
+        try:
+            mix = parse_mix(args.mix, LOAD_MIX)
+        except ValueError as e:
+            parser.error(f"--mix: {e}")
+        address = None
+        if args.connect:
+            host, _, port = args.connect.rpartition(':')
+            address = (host or SERVER_HOST, int(port)) if port.isdigit() else args.connect
+        report = load_test(args.workers, args.sessions, args.ops, mix, args.think / 1000, args.accounts,
+                           args.opening_balance, args.pin, seed=args.seed, address=address, first_account=args.first_account,
+                           journal_mode=args.journal_mode, record=args.record, replay=args.replay,
+                           velocity_rules=rules)
+        print(json.dumps(report, indent=2))
+        return 0 if report['consistency']['ok'] else 1
+
+    if args.command == 'stress':
+        report = stress_test(args.workers, args.operations, args.accounts, rules)
+        for key, value in report.items():
+            print(f"{key}: {value}")
+        return 0 if report['ok'] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
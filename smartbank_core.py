@@ -0,0 +1,3755 @@
+# SmartBank model, storage and tools, without any GUI. The Tk interface is
+# ATM Minor Project (Python).py and the command line is smartbank_cli.py.
+import heapq
+import json
+import logging
+import math
+import mmap
+import os
+import random
+import re
+import struct
+import sys
+import threading
+import time
+import weakref
+import zlib
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import chain, islice
+from functools import lru_cache, wraps
+from operator import attrgetter, itemgetter
+from typing import Optional
+
+# What the GUI and the command line take with "from smartbank_core import *".
+# storage and accounts are left out: open_bank() rebinds them, so read them
+# as smartbank_core.storage and smartbank_core.accounts.
+__all__ = [
+    # Settings
+    'DATA_FILE', 'INDEX_FILE', 'JOURNAL_FILE', 'DB_FILE', 'LOCK_FILE', 'STORAGE_BACKEND', 'ADMIN_PIN', 'JOURNAL_FSYNC',
+    'JOURNAL_GROUP_WINDOW', 'JOURNAL_ASYNC_INTERVAL', 'CHECKPOINT_EVERY', 'SHARD_COUNT', 'ACCOUNT_CACHE_SIZE',
+    'SEARCH_RESULT_LIMIT', 'IMPORT_BATCH_SIZE', 'STATS_DAILY_DAYS', 'ROLLUP_PERIODS', 'RECONCILE_FILE',
+    'RECONCILE_CHUNK', 'METRICS_ENABLED', 'METRICS_FILE', 'METRICS_RECENT', 'LATENCY_BUCKETS', 'PROFILE_DIR',
+    'VELOCITY_SLOTS', 'VELOCITY_ALERTS_KEPT', 'SERVER_HOST', 'SERVER_PORT', 'SERVER_BATCH_LIMIT',
+    'SERVER_REPORT_EVERY', 'LOAD_FIRST_ACCOUNT', 'LOAD_MIX', 'CREDIT_TYPES', 'TXN_TYPES', 'TXN_FAMILIES',
+    'ACCOUNT_KINDS', 'VELOCITY_RULES', 'STATEMENT_FIELDS', 'BENCH_TXN_MIX',
+    # Dates
+    'now_text', 'date_to_epoch', 'epoch_to_date', 'period_in_range', 'account_kind',
+    # Model and storage
+    'Transaction', 'TransactionLedger', 'BankAccount', 'BankStats', 'VelocityRule', 'VelocityGuard', 'velocity',
+    'Journal', 'FileStorage', 'SqliteStorage', 'create_storage', 'AccountMap', 'AccountSearchIndex',
+    'store_lock', 'batch_changes', 'lock_bank', 'open_bank', 'load_accounts', 'save_accounts', 'checkpoint_if_needed',
+    # Metrics
+    'Metrics', 'metrics', 'instrumented', 'instrument_methods',
+    # Operations and reports
+    'open_account', 'apply_interest_to_all', 'read_accounts', 'import_accounts', 'read_operations',
+    'import_operations', 'statement_rows', 'write_statement', 'rollup_report', 'format_rollup', 'audit_account',
+    'reconcile', 'format_reconciliation',
+    # Server and tools
+    'BankServer', 'scratch_storage', 'stress_test', 'durability_benchmark', 'recovery_benchmark',
+    'generate_accounts', 'latency_summary', 'benchmark_suite', 'parse_mix', 'compare_benchmarks', 'load_test'
+]
+
+log = logging.getLogger(__name__)  # unconfigured, warnings and errors still reach stderr
+
+DATA_FILE = 'bank_gui_data.json'
+INDEX_FILE = 'bank_gui_data.idx'
+JOURNAL_FILE = 'bank_gui_journal.jsonl'
+DB_FILE = 'bank_gui_data.db'
+LOCK_FILE = 'bank_gui_data.lock'  # held by the one process that has the bank open
+STORAGE_BACKEND = 'file'  # 'file' (DATA_FILE snapshot + journal) or 'sqlite' (DB_FILE)
+ADMIN_PIN = "admin123"  # Simple admin access (in real app, use proper authentication)
+
+# Journal durability (the SQLite backend maps it to its synchronous pragma):
+#   'always' - each change is written and fsynced before the call returns
+#   'group'  - changes queue up and a flusher writes everything waiting with a
+#              single fsync (group commit); callers still return only once
+#              their change is on disk
+#   'async'  - changes are written and fsynced in the background every
+#              JOURNAL_ASYNC_INTERVAL; a crash can lose the last interval
+JOURNAL_FSYNC = 'group'
+# Extra seconds a group flush waits for more changes to join it. Changes that
+# arrive while the previous fsync runs join the next one anyway, so this only
+# pays off when fsync is cheaper than the gap between changes.
+JOURNAL_GROUP_WINDOW = 0.0
+JOURNAL_ASYNC_INTERVAL = 0.05
+CHECKPOINT_EVERY = 1000  # journal records before the changed snapshot shards are rewritten
+# Snapshot files the accounts are spread over (DATA_FILE itself when 1). An
+# existing single DATA_FILE is split up on the first start with more, and
+# kept as DATA_FILE.unsharded.
+SHARD_COUNT = 4
+ACCOUNT_CACHE_SIZE = 1000  # hydrated accounts kept in memory
+SEARCH_RESULT_LIMIT = 50
+IMPORT_BATCH_SIZE = 1000  # accounts opened per commit by import-accounts
+STATS_DAILY_DAYS = 31  # days of per-day volumes kept in the bank statistics
+ROLLUP_PERIODS = {'day': 10, 'month': 7}  # rollup period -> length of its key, a prefix of the date text
+SNAPSHOT_META_KEY = '__smartbank__'
+RECONCILE_FILE = 'bank_gui_reconcile.json'  # per-account record checksums and totals from the last reconciliation
+RECONCILE_CHUNK = 10000  # snapshot accounts per reconciliation task
+METRICS_ENABLED = True  # time instrumented operations; can be switched at runtime
+METRICS_FILE = 'bank_gui_metrics.prom'  # Prometheus text format
+METRICS_RECENT = 2048  # latest durations per operation the percentiles are taken from
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+PROFILE_DIR = 'profiles'  # where cProfile traces of slow operations are written
+VELOCITY_SLOTS = 12  # ring buffer slots per sliding window; windows are accurate to one slot
+VELOCITY_ALERTS_KEPT = 200  # latest flagged or blocked transactions shown to the admin
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 8750
+SERVER_BATCH_LIMIT = 1000  # requests committed together at most
+SERVER_REPORT_EVERY = 10  # seconds between throughput lines in the server log
+LOAD_FIRST_ACCOUNT = 700000  # load-test accounts are numbered from here
+LOAD_MIX = {'balance': 30, 'deposit': 30, 'withdraw': 25, 'transfer': 15}
+
+# Transaction types that add to the balance; everything else takes away from it
+CREDIT_TYPES = {"deposit", "interest", "transfer_from"}
+TXN_TYPES = ["deposit", "withdraw", "interest", "transfer_to", "transfer_from"]
+TXN_TYPE_CODES = {t: i for i, t in enumerate(TXN_TYPES)}
+# Filters that cover more than one stored type
+TXN_FAMILIES = {"transfer_to": "transfer", "transfer_from": "transfer"}
+EPOCH = datetime(1970, 1, 1)
+# Account types with a one-byte code in the snapshot index (0 = anything else)
+ACCOUNT_KINDS = ["savings", "current"]
+
+def account_kind(account_type):
+    account_type = account_type.lower()
+    return ACCOUNT_KINDS.index(account_type) + 1 if account_type in ACCOUNT_KINDS else 0
+
+def fsync_dir(path):
+    # Makes a rename into the directory holding path durable (POSIX only)
+    if os.name != 'posix':
+        return
+    fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+def iter_json_object(f, chunk_size=1 << 16):
+    # Streams the (key, value) members of the JSON object in text file f. Each
+    # member is decoded on its own from a buffer that is refilled as it runs
+    # dry, so memory is bounded by the largest value, not the document.
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+
+    def more():
+        nonlocal buf, pos, eof
+        # Read at least as much again as is buffered, so retrying a long value
+        # costs linear time overall
+        chunk = f.read(max(chunk_size, len(buf) - pos))
+        buf, pos = buf[pos:] + chunk, 0
+        eof = not chunk
+
+    def skip_space():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos] in ' \t\r\n':
+                pos += 1
+            if pos < len(buf) or eof:
+                return
+            more()
+
+    def expect(chars):
+        nonlocal pos
+        skip_space()
+        if pos >= len(buf) or buf[pos] not in chars:
+            raise json.JSONDecodeError(f"Expecting one of {chars!r}", buf, pos)
+        pos += 1
+        return buf[pos - 1]
+
+    def value():
+        # A number is only complete once something that cannot continue it
+        # follows, or the file has ended: '1.' in the buffer decodes as 1 but
+        # may be the start of 1.5
+        nonlocal pos
+        while True:
+            skip_space()
+            try:
+                result, end = decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                if eof:
+                    raise
+            else:
+                stop = end
+                if isinstance(result, (int, float)):
+                    while stop < len(buf) and buf[stop] in '0123456789+-.eE':
+                        stop += 1
+                if stop < len(buf) or eof:
+                    pos = end
+                    return result
+            more()
+
+    more()
+    expect('{')
+    skip_space()
+    if buf[pos:pos + 1] == '}':
+        return
+    while True:
+        key = value()
+        if not isinstance(key, str):
+            raise json.JSONDecodeError("Expecting property name", buf, pos)
+        expect(':')
+        yield key, value()
+        if expect(',}') == '}':
+            return
+
+def read_accounts(path):
+    # Streams the accounts in a SmartBank data file (the current one-line-per-
+    # account snapshot or an older indented one) without loading the document
+    with open(path, 'r', encoding='utf-8') as f:
+        for acc_no, data in iter_json_object(f):
+            if acc_no != SNAPSHOT_META_KEY:
+                yield BankAccount.from_dict(data)
+
+def txn_type_code(txn_type):
+    code = TXN_TYPE_CODES.get(txn_type)
+    if code is None:
+        code = TXN_TYPE_CODES[txn_type] = len(TXN_TYPES)
+        TXN_TYPES.append(txn_type)
+    return code
+
+_clock = [None, ""]  # last whole second formatted by now_text, and its text
+
+def now_text():
+    # datetime.now().strftime(...) for the current second, formatted only once per second
+    second = int(time.time())
+    if second != _clock[0]:
+        _clock[0], _clock[1] = second, datetime.fromtimestamp(second).strftime('%Y-%m-%d %H:%M:%S')
+    return _clock[1]
+
+@lru_cache(maxsize=4096)
+def date_to_epoch(date):
+    return int((datetime.fromisoformat(date) - EPOCH).total_seconds())
+
+def epoch_to_date(timestamp):
+    return (EPOCH + timedelta(seconds=timestamp)).isoformat(' ')
+
+def period_in_range(key, start=None, end=None):
+    # Whether a rollup key ('YYYY-MM' or 'YYYY-MM-DD') falls within start..end,
+    # dates that are cut to the key's precision
+    return (not start or key >= start[:len(key)]) and (not end or key <= end[:len(key)])
+
+def date_bound(date, end=False):
+    # A bare 'YYYY-MM-DD' covers the whole day: midnight as a lower bound, 23:59:59 as an upper one
+    timestamp = date_to_epoch(date)
+    if end and len(date) == 10:
+        timestamp += 86399
+    return timestamp
+
+# Instrumentation
+class OperationMetrics:
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.slowest = 0.0
+        self.buckets = [0] * len(LATENCY_BUCKETS)  # per bucket, not cumulative
+        self.recent = deque(maxlen=METRICS_RECENT)
+    
+    def percentile(self, q):
+        samples = sorted(self.recent)
+        return samples[min(len(samples) - 1, int(len(samples) * q))] if samples else 0.0
+
+class Metrics:
+    # Call counts and latency histograms per named operation, recorded by the
+    # functions wrapped with instrumented(). Setting enabled to False turns
+    # every wrapper into a plain call. With profile_threshold set (seconds),
+    # each outermost instrumented call runs under cProfile and the trace is
+    # kept in PROFILE_DIR if the call took at least that long.
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self.profile_threshold = None
+        self.profiles_written = 0
+        self.operations = {}
+        self.lock = threading.Lock()
+        self.local = threading.local()
+    
+    def call(self, name, func, args, kwargs):
+        profiler = None
+        if self.profile_threshold is not None and not getattr(self.local, 'profiling', False):
+            import cProfile
+            profiler = cProfile.Profile()
+            try:
+                profiler.enable()
+                self.local.profiling = True
+            except ValueError:
+                profiler = None  # another profiler is running
+        failed = False
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        except BaseException:
+            failed = True
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            if profiler is not None:
+                profiler.disable()
+                self.local.profiling = False
+                threshold = self.profile_threshold
+                if threshold is not None and elapsed >= threshold:
+                    self.save_profile(name, profiler, elapsed)
+            self.record(name, elapsed, failed)
+    
+    def record(self, name, seconds, failed=False):
+        with self.lock:
+            op = self.operations.get(name)
+            if op is None:
+                op = self.operations[name] = OperationMetrics()
+            op.count += 1
+            op.errors += failed
+            op.total += seconds
+            op.slowest = max(op.slowest, seconds)
+            i = bisect_left(LATENCY_BUCKETS, seconds)
+            if i < len(op.buckets):
+                op.buckets[i] += 1
+            op.recent.append(seconds)
+    
+    def save_profile(self, name, profiler, elapsed):
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S-%f')
+        path = os.path.join(PROFILE_DIR, f"{re.sub(r'[^A-Za-z0-9_.-]+', '_', name)}-{stamp}-{elapsed * 1000:.0f}ms.prof")
+        profiler.dump_stats(path)  # read with python -m pstats
+        with self.lock:
+            self.profiles_written += 1
+        return path
+    
+    def summary(self):
+        # (name, calls, errors, p50, p95, p99, max, total), times in seconds, by total time
+        with self.lock:
+            rows = [
+                (name, op.count, op.errors, op.percentile(0.5), op.percentile(0.95), op.percentile(0.99),
+                 op.slowest, op.total)
+                for name, op in self.operations.items()
+            ]
+        rows.sort(key=itemgetter(7), reverse=True)
+        return rows
+    
+    def prometheus(self):
+        def labels(name, **extra):
+            pairs = [('operation', name)] + list(extra.items())
+            escaped = (f'{key}="{str(value).replace(chr(92), chr(92) * 2).replace(chr(34), chr(92) + chr(34))}"'
+                       for key, value in pairs)
+            return "{" + ",".join(escaped) + "}"
+        
+        with self.lock:
+            operations = [(name, op.count, op.errors, op.total, list(op.buckets),
+                           [op.percentile(q) for q in (0.5, 0.95, 0.99)])
+                          for name, op in sorted(self.operations.items())]
+        lines = [
+            "# HELP smartbank_operation_seconds Time spent in SmartBank operations.",
+            "# TYPE smartbank_operation_seconds histogram"
+        ]
+        for name, count, errors, total, buckets, recent in operations:
+            cumulative = 0
+            for bound, in_bucket in zip(LATENCY_BUCKETS, buckets):
+                cumulative += in_bucket
+                lines.append(f"smartbank_operation_seconds_bucket{labels(name, le=bound)} {cumulative}")
+            lines.append(f"smartbank_operation_seconds_bucket{labels(name, le='+Inf')} {count}")
+            lines.append(f"smartbank_operation_seconds_sum{labels(name)} {total:.6f}")
+            lines.append(f"smartbank_operation_seconds_count{labels(name)} {count}")
+        lines += [
+            "# HELP smartbank_operation_errors_total SmartBank operations that raised.",
+            "# TYPE smartbank_operation_errors_total counter"
+        ]
+        lines += [f"smartbank_operation_errors_total{labels(name)} {errors}"
+                  for name, count, errors, total, buckets, recent in operations]
+        lines += [
+            f"# HELP smartbank_operation_recent_seconds Latency percentiles over the latest {METRICS_RECENT} calls.",
+            "# TYPE smartbank_operation_recent_seconds gauge"
+        ]
+        for name, count, errors, total, buckets, recent in operations:
+            for q, value in zip((0.5, 0.95, 0.99), recent):
+                lines.append(f"smartbank_operation_recent_seconds{labels(name, quantile=q)} {value:.6f}")
+        return "\n".join(lines) + "\n"
+    
+    def dump(self, path=METRICS_FILE):
+        # Written whole and renamed into place, so a scraper never reads half a file
+        temp = path + '.tmp'
+        with open(temp, 'w') as f:
+            f.write(self.prometheus())
+        os.replace(temp, path)
+    
+    def reset(self):
+        with self.lock:
+            self.operations.clear()
+
+metrics = Metrics()
+
+def instrumented(name):
+    # Decorator recording every call of the function under name in metrics
+    def decorate(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not metrics.enabled:
+                return func(*args, **kwargs)
+            return metrics.call(name, func, args, kwargs)
+        return wrapper
+    return decorate
+
+def instrument_methods(cls, prefix):
+    # Wraps every public method defined on cls, named prefix.method
+    for name, attr in list(vars(cls).items()):
+        if callable(attr) and not name.startswith('_') and not isinstance(attr, (staticmethod, classmethod, type)):
+            setattr(cls, name, instrumented(f"{prefix}.{name}")(attr))
+    return cls
+
+class Transaction:
+    __slots__ = ('txn_type', 'amount', 'date', 'description')
+
+    def __init__(self, txn_type: str, amount: float, date: Optional[str] = None, description: str = ""):
+        self.txn_type = txn_type
+        self.amount = amount
+        self.date = date or now_text()
+        self.description = description
+
+    def to_dict(self):
+        return {
+            'txn_type': self.txn_type,
+            'amount': self.amount,
+            'date': self.date,
+            'description': self.description
+        }
+
+    @staticmethod
+    def from_dict(data):
+        return Transaction(
+            data['txn_type'],
+            data['amount'],
+            data['date'],
+            data.get('description', "")
+        )
+
+def row_checksum(checksum, txn_type, paise, date, description):
+    # Rolls a ledger checksum forward over one more transaction
+    return zlib.crc32(f"{txn_type}|{paise}|{date}|{description}\n".encode(), checksum)
+
+class TransactionLedger:
+    # Column-per-field transaction store: type codes, amounts in paise and epoch
+    # seconds live in flat arrays and descriptions are stored once per distinct
+    # text. Transaction objects are only built when a row is read.
+    #
+    # running[i] is the net effect of rows 0..i, maintained as rows are added,
+    # so the balance after any row is opening + running[i]. Rows arrive in time
+    # order, which lets date lookups bisect the timestamps column, and
+    # type_positions keeps the row numbers of each type (and family) in order.
+    # checksum is a crc32 rolled over the rows (see row_checksum) and stored
+    # with the account, so reconcile() can tell whether the history it reads
+    # back is the one that was written. It is rolled forward lazily, over the
+    # rows added since it was last taken.
+    def __init__(self, transactions=()):
+        self.types = array('B')
+        self.amounts = array('q')
+        self.timestamps = array('q')
+        self.desc_ids = array('I')
+        self.running = array('q')
+        self.opening = 0  # balance in paise before the first row
+        self.type_positions = {}
+        self.descriptions = []
+        self.desc_lookup = {}
+        self.rollups = {}  # period -> totals per period, see rollup()
+        self.checksum = 0
+        self.checksummed = 0  # rows the checksum covers
+        for txn in transactions:
+            self.append(txn)
+
+    @classmethod
+    def from_dicts(cls, rows):
+        ledger = cls()
+        for row in rows:
+            ledger.add(row['txn_type'], row['amount'], row['date'], row.get('description', ""))
+        return ledger
+
+    def add(self, txn_type, amount, date, description=""):
+        desc_id = self.desc_lookup.get(description)
+        if desc_id is None:
+            desc_id = self.desc_lookup[description] = len(self.descriptions)
+            self.descriptions.append(sys.intern(description))
+        paise = round(amount * 100)
+        running = self.running
+        net = running[-1] if running else 0
+        position = len(running)
+        positions = self.type_positions.get(txn_type)
+        if positions is None:
+            positions = self.type_positions[txn_type] = array('q')
+        positions.append(position)
+        family = TXN_FAMILIES.get(txn_type)
+        if family:
+            self.type_positions.setdefault(family, array('q')).append(position)
+        code = TXN_TYPE_CODES.get(txn_type)
+        self.types.append(code if code is not None else txn_type_code(txn_type))
+        self.amounts.append(paise)
+        self.timestamps.append(date_to_epoch(date))
+        self.desc_ids.append(desc_id)
+        running.append(net + paise if txn_type in CREDIT_TYPES else net - paise)
+        if self.rollups:
+            for period, table in self.rollups.items():
+                self._roll(table, date[:ROLLUP_PERIODS[period]], txn_type, paise, position)
+
+    @staticmethod
+    def _roll(table, key, txn_type, paise, position):
+        entry = table.get(key)
+        if entry is None:
+            entry = table[key] = [{}, position]
+        totals = entry[0].get(txn_type)
+        if totals is None:
+            totals = entry[0][txn_type] = [0, 0]
+        totals[0] += 1
+        totals[1] += paise
+        entry[1] = position
+
+    def rollup(self, period='month'):
+        # Materialized totals: {key: [{txn_type: [count, paise]}, last row]} for
+        # every day or month with transactions, in time order. Built from the
+        # columns the first time a period is asked for, then kept current by add().
+        table = self.rollups.get(period)
+        if table is None:
+            width = ROLLUP_PERIODS[period]
+            table = {}
+            day = key = None
+            for i in range(len(self)):
+                if self.timestamps[i] // 86400 != day:
+                    day = self.timestamps[i] // 86400
+                    key = epoch_to_date(day * 86400)[:width]
+                self._roll(table, key, TXN_TYPES[self.types[i]], self.amounts[i], i)
+            self.rollups[period] = table
+        return table
+
+    def rollup_rows(self, period='month', start=None, end=None):
+        # (key, {txn_type: [count, paise]}, closing balance in paise), oldest first
+        return [
+            (key, totals, self.balance_after(last))
+            for key, (totals, last) in self.rollup(period).items() if period_in_range(key, start, end)
+        ]
+
+    def append(self, txn):
+        self.add(txn.txn_type, txn.amount, txn.date, txn.description)
+
+    def net(self):
+        return self.running[-1] if self.running else 0
+
+    def rolled_checksum(self):
+        checksum = self.checksum
+        for i in range(self.checksummed, len(self)):
+            checksum = row_checksum(checksum, TXN_TYPES[self.types[i]], self.amounts[i],
+                                    epoch_to_date(self.timestamps[i]), self.descriptions[self.desc_ids[i]])
+        self.checksum, self.checksummed = checksum, len(self)
+        return checksum
+
+    def balance_after(self, i):
+        # Balance in paise once row i is applied; i = -1 means before any row
+        return self.opening + (self.running[i] if i >= 0 else 0)
+
+    def _row(self, i):
+        return Transaction(
+            TXN_TYPES[self.types[i]],
+            self.amounts[i] / 100,
+            epoch_to_date(self.timestamps[i]),
+            self.descriptions[self.desc_ids[i]]
+        )
+
+    def __len__(self):
+        return len(self.types)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._row(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("transaction index out of range")
+        return self._row(index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._row(i)
+
+class Slice:
+    # Read-only window onto part of a sequence that copies nothing, e.g. the
+    # positions of one transaction type between two dates
+    __slots__ = ('items', 'start', 'stop')
+
+    def __init__(self, items, start, stop):
+        self.items = items
+        self.start = start
+        self.stop = stop
+
+    def __len__(self):
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("slice index out of range")
+        return self.items[self.start + index]
+
+# Velocity checks
+class VelocityRule:
+    # Limits how many transactions of txn_types an account makes, or how much
+    # money they move, within the last window seconds. A 'block' rule refuses
+    # the transaction that would go over the limit; a 'flag' rule lets it
+    # through and raises an alert.
+    def __init__(self, name, txn_types, window, max_count=None, max_amount=None, action='block'):
+        self.name = name
+        self.txn_types = frozenset(txn_types)
+        self.window = window
+        self.max_count = max_count if max_count is not None else math.inf
+        self.max_paise = round(max_amount * 100) if max_amount is not None else math.inf
+        self.action = action
+
+VELOCITY_RULES = [
+    VelocityRule("Withdrawals per minute", ["withdraw"], 60, max_count=5),
+    VelocityRule("Daily withdrawal limit", ["withdraw"], 86400, max_amount=100000),
+    VelocityRule("Deposits per minute", ["deposit"], 60, max_count=10, action='flag'),
+    VelocityRule("Transfers per hour", ["transfer_to"], 3600, max_count=30, action='flag'),
+    VelocityRule("Money out per hour", ["withdraw", "transfer_to"], 3600, max_amount=200000, action='flag')
+]
+
+class SlidingWindow:
+    # Count and sum of the events in the last span seconds, kept in a ring of
+    # VELOCITY_SLOTS buckets of span / VELOCITY_SLOTS seconds each. Moving
+    # forward empties the buckets that fell out of the window, so an update
+    # costs O(1) amortized; an event is forgotten up to one bucket late.
+    __slots__ = ('width', 'counts', 'sums', 'head', 'newest', 'until', 'count', 'total')
+
+    def __init__(self, span):
+        self.width = span / VELOCITY_SLOTS
+        self.counts = [0] * VELOCITY_SLOTS
+        self.sums = [0] * VELOCITY_SLOTS
+        self.head = 0  # bucket number of the newest bucket
+        self.newest = 0  # its position in the ring
+        self.until = 0  # when it ends
+        self.count = 0
+        self.total = 0
+
+    def advance(self, now):
+        if now < self.until:
+            return
+        slot = int(now // self.width)
+        gap = slot - self.head
+        if gap >= VELOCITY_SLOTS:
+            self.counts = [0] * VELOCITY_SLOTS
+            self.sums = [0] * VELOCITY_SLOTS
+            self.count = self.total = 0
+        else:
+            counts, sums = self.counts, self.sums
+            for bucket in range(self.head + 1, slot + 1):
+                i = bucket % VELOCITY_SLOTS
+                self.count -= counts[i]
+                self.total -= sums[i]
+                counts[i] = sums[i] = 0
+        self.head = slot
+        self.newest = slot % VELOCITY_SLOTS
+        self.until = (slot + 1) * self.width
+
+    def add(self, paise):
+        # Into the newest bucket; advance() first
+        i = self.newest
+        self.counts[i] += 1
+        self.sums[i] += paise
+        self.count += 1
+        self.total += paise
+
+class VelocityGuard:
+    # The rules stage every deposit, withdrawal and transfer passes through
+    # before it is written. Each account keeps one sliding window per rule,
+    # created when the account is first screened and filled from the recent
+    # end of its ledger, so limits survive restarts and cache evictions.
+    # Screening runs with the account locked.
+    def __init__(self, rules=VELOCITY_RULES):
+        self.rules = list(rules)
+        self.by_type = {}  # txn_type -> [(rule position, rule)]
+        for position, rule in enumerate(self.rules):
+            for txn_type in rule.txn_types:
+                self.by_type.setdefault(txn_type, []).append((position, rule))
+        self.alerts = deque(maxlen=VELOCITY_ALERTS_KEPT)
+        self.flagged = 0
+        self.blocked = 0
+        self.lock = threading.Lock()
+        self.local = threading.local()
+
+    def windows(self, account):
+        windows = account.velocity
+        if windows is None:
+            windows = account.velocity = [SlidingWindow(rule.window) for rule in self.rules]
+            ledger = account.transactions
+            now = date_to_epoch(now_text())
+            longest = max((rule.window for rule in self.rules), default=0)
+            for i in range(bisect_left(ledger.timestamps, now - longest), len(ledger)):
+                timestamp = ledger.timestamps[i]
+                for position, rule in self.by_type.get(TXN_TYPES[ledger.types[i]], ()):
+                    if timestamp > now - rule.window:
+                        windows[position].advance(timestamp)
+                        windows[position].add(ledger.amounts[i])
+        return windows
+
+    def screen(self, account, txn_type, amount):
+        # Counts the transaction into the account's windows, or raises
+        # ValueError if a block rule does not allow it
+        rules = self.by_type.get(txn_type)
+        if not rules:
+            return
+        if getattr(self.local, 'exempt', False):
+            account.velocity = None  # refilled from the ledger, this transaction included, when next screened
+            return
+        windows = account.velocity or self.windows(account)
+        now = date_to_epoch(now_text())
+        paise = round(amount * 100)
+        flagged = None
+        # Runs for every transaction, so the window updates are inlined
+        for position, rule in rules:
+            window = windows[position]
+            if now >= window.until:
+                window.advance(now)
+            if window.count >= rule.max_count or window.total + paise > rule.max_paise:
+                if rule.action == 'block':
+                    self.alert(account, rule, txn_type, amount)
+                    raise ValueError(f"{rule.name} reached; please try again later")
+                flagged = (flagged or []) + [rule]
+        for position, _ in rules:
+            window = windows[position]
+            i = window.newest
+            window.counts[i] += 1
+            window.sums[i] += paise
+            window.count += 1
+            window.total += paise
+        for rule in flagged or ():
+            self.alert(account, rule, txn_type, amount)
+
+    def alert(self, account, rule, txn_type, amount):
+        with self.lock:
+            if rule.action == 'block':
+                self.blocked += 1
+            else:
+                self.flagged += 1
+            self.alerts.append({'date': now_text(), 'account': account.account_number, 'rule': rule.name,
+                                'action': rule.action, 'txn_type': txn_type, 'amount': amount})
+
+    @contextmanager
+    def exempt(self):
+        # Transactions in the block are not screened, e.g. an administrator's
+        # bulk import, but still count towards the limits of later ones
+        saved = getattr(self.local, 'exempt', False)
+        self.local.exempt = True
+        try:
+            yield
+        finally:
+            self.local.exempt = saved
+
+velocity = VelocityGuard()
+
+class BankAccount:
+    def __init__(self, name, account_number, pin, account_type, balance=0.0, transactions=None):
+        self.name = name
+        self.account_number = account_number
+        self.pin = pin
+        self.account_type = account_type
+        self.balance = balance
+        # Held while an operation validates against the balance; see store_lock
+        self.lock = threading.RLock()
+        self.velocity = None  # sliding windows, see VelocityGuard
+        if isinstance(transactions, TransactionLedger):
+            self.transactions = transactions
+        else:
+            self.transactions = TransactionLedger(transactions or ())
+        # Whatever the history does not explain was there before it started
+        self.transactions.opening = round(balance * 100) - self.transactions.net()
+        self.last_accessed = now_text()
+        self.creation_date = self.last_accessed[:10]
+
+    @instrumented('account.deposit')
+    def deposit(self, amount: float, description: str = ""):
+        # Amounts are kept to whole paise (see _leg), so one under half a paise is not positive
+        if not (round(amount, 2) > 0 and math.isfinite(amount)):
+            raise ValueError("Deposit amount must be positive")
+        with self.lock:
+            velocity.screen(self, "deposit", amount)
+            self._post("deposit", amount, description)
+        wait_durable()
+
+    @instrumented('account.withdraw')
+    def withdraw(self, amount: float, description: str = ""):
+        if not (round(amount, 2) > 0 and math.isfinite(amount)):
+            raise ValueError("Withdrawal amount must be positive")
+        with self.lock:
+            if amount > self.balance:
+                raise ValueError("Insufficient balance")
+            velocity.screen(self, "withdraw", amount)
+            self._post("withdraw", amount, description)
+        wait_durable()
+
+    @instrumented('account.apply_interest')
+    def apply_interest(self, rate: float = 0.04):
+        if self.account_type.lower() == "savings":
+            with self.lock:
+                interest = round(self.balance * rate, 2)
+                self._post("interest", interest, f"Interest @ {rate*100}%")
+            wait_durable()
+            return interest
+        return 0
+
+    @instrumented('account.transfer')
+    def transfer(self, target_account, amount: float, description: str = ""):
+        if not (round(amount, 2) > 0 and math.isfinite(amount)):
+            raise ValueError("Transfer amount must be positive")
+        if self.account_number == target_account.account_number:
+            raise ValueError("Cannot transfer to the same account")
+        if not isinstance(description, str):
+            raise ValueError("Description must be text")
+        # Lock both accounts in account-number order, so two transfers going
+        # opposite ways between the same pair cannot each hold one and wait
+        first, second = sorted((self, target_account), key=attrgetter('account_number'))
+        with first.lock, second.lock:
+            if amount > self.balance:
+                raise ValueError("Insufficient balance")
+            velocity.screen(self, "transfer_to", amount)
+            velocity.screen(target_account, "transfer_from", amount)
+            with store_lock:
+                # Both legs go into a single journal record so a crash never leaves
+                # half a transfer; if writing it fails, neither account has changed
+                out_leg = self._leg("transfer_to", amount, f"Transfer to {target_account.account_number}: {description}")
+                in_leg = target_account._leg("transfer_from", amount, f"Transfer from {self.account_number}: {description}")
+                record_change({'op': 'txn', 'legs': [out_leg, in_leg]})
+                self._apply(out_leg)
+                target_account._apply(in_leg)
+        wait_durable()
+
+    def _leg(self, txn_type, amount, description=""):
+        # Everything _apply() needs is checked here, before the record is
+        # written, so a record that reaches the journal can always be replayed.
+        # Amounts and balances are kept to whole paise, matching the ledger.
+        # The leg carries the ledger checksum with itself added.
+        if not isinstance(description, str):
+            raise ValueError("Description must be text")
+        if isinstance(amount, bool) or not isinstance(amount, (int, float)) or not math.isfinite(amount):
+            raise ValueError("Amount must be a number")
+        amount = round(amount, 2)
+        balance = self.balance + amount if txn_type in CREDIT_TYPES else self.balance - amount
+        date = now_text()
+        checksum = row_checksum(self.transactions.rolled_checksum(), txn_type, round(amount * 100), date, description)
+        return {'txn_type': txn_type, 'amount': amount, 'date': date, 'description': description,
+                'account': self.account_number, 'balance': round(balance, 2), 'checksum': checksum}
+
+    def _post(self, txn_type, amount, description):
+        # The record is written before the change is applied, and the leg is built
+        # under the store lock so no bulk change can move the balance in between
+        with store_lock:
+            leg = self._leg(txn_type, amount, description)
+            record_change({'op': 'txn', 'legs': [leg]})
+            self._apply(leg)
+
+    def _apply(self, leg):
+        ledger = self.transactions
+        ledger.add(leg['txn_type'], leg['amount'], leg['date'], leg['description'])
+        if 'checksum' in leg:
+            # The checksum as written, not one recomputed from what was read back
+            ledger.checksum, ledger.checksummed = leg['checksum'], len(ledger)
+        self.balance = leg['balance']
+        self.last_accessed = leg['date']
+
+    def get_summary(self):
+        return (
+            f"Account Holder: {self.name}\n"
+            f"Account Number: {self.account_number}\n"
+            f"Account Type: {self.account_type.capitalize()}\n"
+            f"Creation Date: {self.creation_date}\n"
+            f"Last Accessed: {self.last_accessed}\n"
+            f"Current Balance: ₹{self.balance:.2f}\n"
+            f"Transaction Count: {len(self.transactions)}"
+        )
+
+    @instrumented('account.get_transactions')
+    def get_transactions(self, limit=None, txn_type=None):
+        transactions, _ = self.query_transactions(txn_type=txn_type, page_size=limit)
+        transactions.reverse()
+        return transactions
+
+    @instrumented('account.query_transactions')
+    def query_transactions(self, txn_type=None, start=None, end=None, text=None, page_size=20, cursor=None):
+        # Newest first. Returns (transactions, next_cursor); pass next_cursor back
+        # to get the following page, it is None once the history is exhausted.
+        ledger = self.transactions
+        lo, hi = self._time_range(start, end)
+        if cursor is not None:
+            hi = min(hi, cursor)
+        if txn_type:
+            positions = ledger.type_positions.get(txn_type, ())
+            first, last = bisect_left(positions, lo), bisect_left(positions, hi)
+            candidates = (positions[k] for k in range(last - 1, first - 1, -1))
+        else:
+            candidates = range(hi - 1, lo - 1, -1)
+        matching = self._matching_descriptions(text) if text else None
+        page = []
+        for i in candidates:
+            if matching is not None and ledger.desc_ids[i] not in matching:
+                continue
+            page.append(i)
+            if len(page) == page_size:
+                break
+        next_cursor = page[-1] if page_size and len(page) == page_size else None
+        return [ledger[i] for i in page], next_cursor
+
+    @instrumented('account.transaction_rows')
+    def transaction_rows(self, txn_type=None, start=None, end=None, text=None):
+        # Ledger positions of the matching rows, oldest first, as a sequence that
+        # can be indexed anywhere; nothing is copied unless text filters the rows
+        ledger = self.transactions
+        lo, hi = self._time_range(start, end)
+        if txn_type:
+            positions = ledger.type_positions.get(txn_type, ())
+            rows = Slice(positions, bisect_left(positions, lo), bisect_left(positions, hi))
+        else:
+            rows = range(lo, hi)
+        if text:
+            matching = self._matching_descriptions(text)
+            desc_ids = ledger.desc_ids
+            rows = array('q', (i for i in rows if desc_ids[i] in matching))
+        return rows
+
+    def _time_range(self, start, end):
+        # Positions [lo, hi) of the rows dated within start..end (whole days)
+        ledger = self.transactions
+        lo = bisect_left(ledger.timestamps, date_bound(start)) if start else 0
+        hi = bisect_right(ledger.timestamps, date_bound(end, end=True)) if end else len(ledger)
+        return lo, hi
+
+    def _matching_descriptions(self, text):
+        # Match against the distinct description table once, not row by row
+        needle = text.lower()
+        return {j for j, d in enumerate(self.transactions.descriptions) if needle in d.lower()}
+
+    @instrumented('account.get_balance_history')
+    def get_balance_history(self, start=None, end=None):
+        ledger = self.transactions
+        lo, hi = self._time_range(start, end)
+        return [
+            (epoch_to_date(ledger.timestamps[i]), ledger.balance_after(i) / 100)
+            for i in range(lo, hi)
+        ]
+
+    def rollup(self, period='month', start=None, end=None):
+        with self.lock:
+            return self.transactions.rollup_rows(period, start, end)
+
+    def balance_as_of(self, date):
+        ledger = self.transactions
+        i = bisect_right(ledger.timestamps, date_bound(date, end=True))
+        return ledger.balance_after(i - 1) / 100
+
+    @instrumented('account.change_pin')
+    def change_pin(self, new_pin):
+        if not re.match(r'^\d{4}$', new_pin):
+            raise ValueError("PIN must be 4 digits")
+        with self.lock, store_lock:
+            now = now_text()
+            record_change({'op': 'pin', 'account': self.account_number, 'pin': new_pin, 'date': now})
+            self.pin = new_pin
+            self.last_accessed = now
+        wait_durable()
+
+    def to_dict(self):
+        return {
+            'name': self.name,
+            'account_number': self.account_number,
+            'pin': self.pin,
+            'account_type': self.account_type,
+            'balance': self.balance,
+            'opening_balance': self.transactions.opening / 100,
+            'checksum': self.transactions.rolled_checksum(),
+            'creation_date': self.creation_date,
+            'last_accessed': self.last_accessed,
+            'transactions': [t.to_dict() for t in self.transactions]
+        }
+
+    @staticmethod
+    def from_dict(data):
+        account = BankAccount(
+            data['name'],
+            data['account_number'],
+            data['pin'],
+            data['account_type'],
+            data['balance'],
+            TransactionLedger.from_dicts(data.get('transactions', []))
+        )
+        account.creation_date = data.get('creation_date', account.creation_date)
+        account.last_accessed = data.get('last_accessed', account.last_accessed)
+        # Kept as written, so a balance or history that has drifted shows up
+        ledger = account.transactions
+        if 'opening_balance' in data:
+            ledger.opening = round(data['opening_balance'] * 100)
+        if 'checksum' in data:
+            ledger.checksum, ledger.checksummed = data['checksum'], len(ledger)
+        return account
+
+class BankStats:
+    # Bank-wide totals kept current by every change record, so the admin
+    # dashboard reads them instead of scanning accounts. Money is in paise.
+    def __init__(self):
+        self.accounts_by_type = {}
+        self.total_balance = 0
+        self.txn_counts = {}
+        self.txn_totals = {}
+        self.daily = {}  # 'YYYY-MM-DD' -> {txn_type: [count, paise]}, last STATS_DAILY_DAYS days
+        # period -> key -> [{txn_type: [count, paise]}, net change in the bank balance], all history
+        self.periods = {period: {} for period in ROLLUP_PERIODS}
+        self.changed = set()  # (period, key) of the rollups changed since the storage last wrote them
+
+    @staticmethod
+    def daily_cutoff():
+        return (datetime.now() - timedelta(days=STATS_DAILY_DAYS)).strftime('%Y-%m-%d')
+
+    def total_accounts(self):
+        return sum(self.accounts_by_type.values())
+
+    def day(self, day):
+        return self.daily.get(day, {})
+
+    def add_account(self, account_type, balance):
+        account_type = account_type.lower()
+        self.accounts_by_type[account_type] = self.accounts_by_type.get(account_type, 0) + 1
+        self.total_balance += round(balance * 100)
+
+    def _add_daily(self, day, txn_type, paise, count=1):
+        bucket = self.daily.get(day)
+        if bucket is None:
+            cutoff = self.daily_cutoff()
+            if day < cutoff:
+                return
+            for old in [d for d in self.daily if d < cutoff]:
+                del self.daily[old]
+            bucket = self.daily[day] = {}
+        entry = bucket.setdefault(txn_type, [0, 0])
+        entry[0] += count
+        entry[1] += paise
+
+    def _roll(self, date, totals):
+        # Adds {txn_type: [count, paise]} on date to the day and month rollups;
+        # an opening balance comes as txn_type None
+        net = sum(paise if txn_type in CREDIT_TYPES or txn_type is None else -paise
+                  for txn_type, (_, paise) in totals.items())
+        for period, width in ROLLUP_PERIODS.items():
+            table = self.periods[period]
+            entry = table.get(date[:width])
+            if entry is None:
+                entry = table[date[:width]] = [{}, 0]
+            self.changed.add((period, date[:width]))
+            for txn_type, (count, paise) in totals.items():
+                if txn_type is not None:
+                    counted = entry[0].setdefault(txn_type, [0, 0])
+                    counted[0] += count
+                    counted[1] += paise
+            entry[1] += net
+
+    def _roll_account(self, ledger, creation_date):
+        # Everything an account brings along: its opening balance, dated when
+        # it was opened or at its first transaction if that is earlier, and its history
+        first = epoch_to_date(ledger.timestamps[0])[:10] if len(ledger) else creation_date
+        self._roll(min(creation_date or first, first), {None: [0, ledger.opening]})
+        for day, (totals, _) in ledger.rollup('day').items():
+            self._roll(day, totals)
+
+    def rollup(self, period='month', start=None, end=None):
+        # (key, {txn_type: [count, paise]}, closing bank balance in paise), oldest first
+        table = self.periods[period]
+        rows = []
+        closing = 0
+        for key in sorted(table):
+            totals, net = table[key]
+            closing += net
+            if period_in_range(key, start, end):
+                rows.append((key, totals, closing))
+        return rows
+
+    def apply(self, record):
+        if record['op'] == 'open':
+            account = record['account']
+            self.add_account(account['account_type'], account['balance'])
+            opened = BankAccount.from_dict(account)
+            self._roll_account(opened.transactions, opened.creation_date)
+        elif record['op'] == 'txn':
+            # Totalled per day first: a bulk import commits its legs as one record
+            days = {}
+            for leg in record['legs']:
+                totals = days.get(leg['date'][:10])
+                if totals is None:
+                    totals = days[leg['date'][:10]] = {}
+                entry = totals.get(leg['txn_type'])
+                if entry is None:
+                    entry = totals[leg['txn_type']] = [0, 0]
+                entry[0] += 1
+                entry[1] += round(leg['amount'] * 100)
+            for day, totals in days.items():
+                for txn_type, (count, paise) in totals.items():
+                    self.total_balance += paise if txn_type in CREDIT_TYPES else -paise
+                    self.txn_counts[txn_type] = self.txn_counts.get(txn_type, 0) + count
+                    self.txn_totals[txn_type] = self.txn_totals.get(txn_type, 0) + paise
+                    self._add_daily(day, txn_type, paise, count)
+                self._roll(day, totals)
+
+    @classmethod
+    def rebuild(cls, accounts):
+        stats = cls()
+        cutoff = date_to_epoch(cls.daily_cutoff())
+        for account in accounts:
+            stats.add_account(account.account_type, account.balance)
+            ledger = account.transactions
+            for txn_type in TXN_TYPES:
+                positions = ledger.type_positions.get(txn_type)
+                if positions:
+                    stats.txn_counts[txn_type] = stats.txn_counts.get(txn_type, 0) + len(positions)
+                    stats.txn_totals[txn_type] = (
+                        stats.txn_totals.get(txn_type, 0) + sum(ledger.amounts[i] for i in positions)
+                    )
+            for i in range(bisect_left(ledger.timestamps, cutoff), len(ledger)):
+                stats._add_daily(
+                    epoch_to_date(ledger.timestamps[i])[:10], TXN_TYPES[ledger.types[i]], ledger.amounts[i]
+                )
+            stats._roll_account(ledger, account.creation_date)
+        return stats
+
+    def to_dict(self):
+        return {
+            'accounts_by_type': self.accounts_by_type,
+            'total_balance': self.total_balance,
+            'txn_counts': self.txn_counts,
+            'txn_totals': self.txn_totals,
+            'daily': self.daily,
+            'periods': self.periods
+        }
+
+    @staticmethod
+    def from_dict(data):
+        stats = BankStats()
+        stats.accounts_by_type = data.get('accounts_by_type', {})
+        stats.total_balance = data.get('total_balance', 0)
+        stats.txn_counts = data.get('txn_counts', {})
+        stats.txn_totals = data.get('txn_totals', {})
+        stats.daily = data.get('daily', {})
+        stats.periods.update(data.get('periods', {}))
+        return stats
+
+class Journal:
+    # append() is called under store_lock and hands out sequence numbers; in
+    # 'group' and 'async' mode the lines are written by a flusher thread, and
+    # wait(seq) blocks until a given record is on disk.
+    #
+    # rotate() moves the records so far aside to path.1 while a snapshot that
+    # covers them is written in the background; replay reads both files.
+    def __init__(self, path, mode=JOURNAL_FSYNC):
+        self.path = path
+        self.rotated = path + '.1'
+        self.mode = mode
+        self.seq = 0          # sequence number of the last record appended
+        self.records = 0      # records appended since the last snapshot
+        self.durable_seq = 0  # last record known to be written and fsynced
+        self.queue = []       # encoded lines not yet written
+        self.queued_seq = 0   # sequence number of the last line in the queue
+        self.file = None
+        self.writes = 0       # write+fsync rounds, for measuring how well records coalesce
+        self.error = None
+        self.cond = threading.Condition()  # guards the queue and durable_seq
+        self.io_lock = threading.Lock()    # one writer of the file at a time, in order
+        self.flusher = None
+        self.closing = False
+
+    def append(self, record):
+        self.seq += 1
+        record['seq'] = self.seq
+        line = json.dumps(record, separators=(',', ':')) + "\n"
+        self.records += 1
+        if self.mode == 'always':
+            with self.io_lock:
+                self._write(line)
+            self.durable_seq = self.seq
+            return self.seq
+        with self.cond:
+            self.queue.append(line)
+            self.queued_seq = self.seq
+            if self.flusher is None:
+                self.closing = False
+                self.flusher = threading.Thread(target=self._flush_loop, name="journal-flusher", daemon=True)
+                self.flusher.start()
+            self.cond.notify_all()
+        return self.seq
+
+    def _write(self, data):
+        if self.file is None:
+            self.file = open(self.path, 'a', encoding='utf-8')
+        self.file.write(data)
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.writes += 1
+
+    def _flush_loop(self):
+        delay = JOURNAL_GROUP_WINDOW if self.mode == 'group' else JOURNAL_ASYNC_INTERVAL
+        while True:
+            with self.cond:
+                while not self.queue and not self.closing:
+                    self.cond.wait()
+                if self.closing:
+                    return
+            if delay:
+                time.sleep(delay)  # let more records join this write
+            try:
+                self.sync()
+            except OSError as e:
+                with self.cond:
+                    self.error = e
+                    self.cond.notify_all()
+                return
+
+    def sync(self):
+        # Writes whatever is queued with one write and one fsync
+        with self.io_lock:
+            with self.cond:
+                lines, self.queue = self.queue, []
+                last = self.queued_seq
+            if lines:
+                self._write(''.join(lines))
+            with self.cond:
+                self.durable_seq = max(self.durable_seq, last)
+                self.cond.notify_all()
+
+    def wait(self, seq):
+        if self.mode != 'group':
+            return
+        with self.cond:
+            while self.durable_seq < seq:
+                if self.error is not None:
+                    raise OSError(f"Journal write failed: {self.error}")
+                self.cond.wait()
+
+    def close(self):
+        with self.cond:
+            self.closing = True
+            self.cond.notify_all()
+        if self.flusher is not None:
+            self.flusher.join()
+            self.flusher = None
+        self.sync()
+
+    def replay(self, after_seq=0):
+        self.seq = max(self.seq, after_seq)
+        records = []
+        for path in (self.rotated, self.path):
+            if not os.path.exists(path):
+                continue
+            good_bytes = 0
+            with open(path, 'rb') as f:
+                for line in f:
+                    # A torn last line means we crashed mid-write; everything before it is intact
+                    if not line.endswith(b"\n"):
+                        break
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        break
+                    good_bytes += len(line)
+                    self.seq = max(self.seq, record['seq'])
+                    if record['seq'] > after_seq:
+                        records.append(record)
+            if good_bytes < os.path.getsize(path):
+                with open(path, 'r+b') as f:
+                    f.truncate(good_bytes)
+        self.records = len(records)
+        return records
+
+    def has_rotated(self):
+        return os.path.exists(self.rotated)
+
+    def rotate(self):
+        # Called under store_lock, so the queue is complete once synced; new
+        # records go to a fresh file
+        self.sync()
+        with self.io_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if os.path.exists(self.path):
+                os.replace(self.path, self.rotated)
+                fsync_dir(self.path)
+        self.records = 0
+
+    def drop_rotated(self):
+        # Once a snapshot covering the rotated records is in place
+        if os.path.exists(self.rotated):
+            os.remove(self.rotated)
+
+    def reset(self):
+        # Callers sync() first and hold store_lock, so nothing is queued
+        with self.io_lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            open(self.path, 'w').close()
+        self.drop_rotated()
+        self.records = 0
+
+class SnapshotIndex:
+    # Sorted fixed-width records (account number, offset, length) pointing at
+    # each account's JSON in DATA_FILE; looked up by binary search over an mmap,
+    # so opening it costs the same for ten accounts or ten million. Each record
+    # also carries the account's balance (paise) and kind as of the snapshot,
+    # so bank-wide passes can read them as columns without parsing any JSON.
+    MAGIC = b'SBX3'
+    # magic, key width, count, data size, data mtime, offset and length of the snapshot metadata
+    HEADER = struct.Struct('<4sHQQqQI')
+    ENTRY = struct.Struct('<QIqB')
+
+    def __init__(self, buf=None):
+        self.buf = buf
+        self.key_width = 0
+        self.count = 0
+        self.meta_span = (0, 0)
+        if buf is not None:
+            _, self.key_width, self.count, _, _, meta_offset, meta_length = self.HEADER.unpack_from(buf)
+            self.meta_span = (meta_offset, meta_length)
+        self.entry_size = self.key_width + self.ENTRY.size
+
+    @classmethod
+    def open(cls, path, data_file):
+        # Returns None when the index is missing or was not written for the current data file
+        try:
+            st = os.stat(data_file)
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return None
+        with f:
+            header = f.read(cls.HEADER.size)
+            if len(header) < cls.HEADER.size:
+                return None
+            magic, _, _, data_size, data_mtime, _, _ = cls.HEADER.unpack(header)
+            if magic != cls.MAGIC or data_size != st.st_size or data_mtime != st.st_mtime_ns:
+                return None
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    @classmethod
+    def write(cls, path, entries, data_file, meta_span):
+        entries = [(key.encode(), *fields) for key, *fields in entries]
+        key_width = max((len(entry[0]) for entry in entries), default=1)
+        st = os.stat(data_file)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(cls.HEADER.pack(
+                cls.MAGIC, key_width, len(entries), st.st_size, st.st_mtime_ns, *meta_span
+            ))
+            for key, *fields in entries:
+                f.write(key.ljust(key_width, b'\0') + cls.ENTRY.pack(*fields))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+        fsync_dir(path)
+
+    def find(self, acc_no):
+        target = acc_no.encode()
+        if len(target) > self.key_width:
+            return None
+        target = target.ljust(self.key_width, b'\0')
+        buf, width, size, base = self.buf, self.key_width, self.entry_size, self.HEADER.size
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            pos = base + mid * size
+            probe = buf[pos:pos + width]
+            if probe < target:
+                lo = mid + 1
+            elif probe > target:
+                hi = mid
+            else:
+                pos = self.HEADER.size + mid * self.entry_size + self.key_width
+                return self.ENTRY.unpack_from(self.buf, pos)[:2]
+        return None
+
+    def key(self, i):
+        pos = self.HEADER.size + i * self.entry_size
+        return self.buf[pos:pos + self.key_width].rstrip(b'\0').decode()
+
+    def rank(self, acc_no):
+        # Number of entries that sort before acc_no
+        lo, hi = 0, self.count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self.key(mid) < acc_no:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _records(self, start=0):
+        # Records from position start in one unpack pass: (padded key, offset,
+        # length, balance, kind)
+        if start >= self.count:
+            return iter(())
+        record = struct.Struct(f'<{self.key_width}s' + self.ENTRY.format[1:])
+        base = self.HEADER.size
+        return record.iter_unpack(self.buf[base + start * self.entry_size:base + self.count * self.entry_size])
+
+    def entries(self, start=0):
+        for key, *fields in self._records(start):
+            yield (key.rstrip(b'\0').decode(), *fields)
+
+    def kind_balances(self, kind):
+        # (account number, balance in paise) of every snapshot account of one kind
+        for key, _, _, balance, entry_kind in self._records():
+            if entry_kind == kind:
+                yield key.rstrip(b'\0').decode(), balance
+
+    def close(self):
+        if self.buf is not None:
+            self.buf.close()
+            self.buf = None
+
+class SnapshotShard:
+    # One snapshot file and its index, plus the accounts opened and the journal
+    # records applied since it was written. The file holds one account per
+    # line ("acc_no": {...},) so it stays a plain JSON object while individual
+    # accounts can be read by offset.
+    def __init__(self, data_file, index_file):
+        self.data_file = data_file
+        self.index_file = index_file
+        self.data = None
+        self.opened = {}    # accounts created since the snapshot: acc_no -> account dict
+        self.pending = {}   # acc_no -> journal records since the snapshot
+        self.opened_keys = None  # sorted(opened), until opened changes
+        self.index = SnapshotIndex.open(index_file, data_file)
+        if self.index is None:
+            self._reindex()
+        if os.path.exists(data_file):
+            self.data = self._map(data_file)
+        self.meta = json.loads(self._read(*self.index.meta_span)) if self.index.meta_span[1] else {}
+
+    def _reindex(self):
+        self.index = SnapshotIndex()
+        if not os.path.exists(self.data_file):
+            return
+        scanned = self._scan_snapshot()
+        if scanned is not None:
+            entries, meta_span = scanned
+            SnapshotIndex.write(self.index_file, entries, self.data_file, meta_span)
+            self.index = SnapshotIndex.open(self.index_file, self.data_file)
+            return
+        # Older files were written with indent=4; rewrite them once in the line
+        # format, streaming one account at a time
+        meta = {}
+
+        def items(f):
+            for key, value in iter_json_object(f):
+                if key == SNAPSHOT_META_KEY:
+                    meta.update(value)
+                    continue
+                yield (key, json.dumps(value, separators=(',', ':')).encode(),
+                       round(value.get('balance', 0) * 100), account_kind(value.get('account_type', '')))
+
+        with open(self.data_file, 'r', encoding='utf-8') as f:
+            try:
+                self._write_snapshot(items(f), meta)
+            except ValueError as e:
+                # A damaged file (e.g. cut short by a crash mid-save) is left
+                # exactly as it is rather than replaced by an empty bank
+                if os.path.exists(self.data_file + '.tmp'):
+                    os.remove(self.data_file + '.tmp')
+                raise RuntimeError(
+                    f"{self.data_file} is damaged and was left untouched: {e}. "
+                    "Restore it from a backup before opening the bank"
+                ) from None
+
+    def _scan_snapshot(self):
+        decoder = json.JSONDecoder()
+        entries = []
+        meta_span = (0, 0)
+        with open(self.data_file, 'rb') as f:
+            if f.readline() != b'{\n':
+                return None
+            offset = 2
+            for line in f:
+                if line.startswith(b'}'):
+                    break
+                try:
+                    text = line.decode('ascii')
+                    key, end = decoder.raw_decode(text)
+                except (UnicodeDecodeError, json.JSONDecodeError):
+                    return None
+                if text[end:end + 2] != ': ':
+                    return None
+                value_end = len(text.rstrip('\n').rstrip(','))
+                if key == SNAPSHOT_META_KEY:
+                    meta_span = (offset + end + 2, value_end - end - 2)
+                else:
+                    span = (offset + end + 2, value_end - end - 2)
+                    value = line[end + 2:value_end]
+                    header = self._parse_header(value) or json.loads(value)
+                    entries.append((key, *span, round(header.get('balance', 0) * 100),
+                                    account_kind(header.get('account_type', ''))))
+                offset += len(line)
+        entries.sort()
+        return entries, meta_span
+
+    def _write_snapshot(self, items, meta):
+        self._write_files(items, meta)
+        self._install()
+
+    def _write_files(self, items, meta):
+        # Writes the next snapshot beside the current one, with its index.
+        # items are (acc_no, compact JSON bytes, balance in paise, kind), normally
+        # in account-number order; meta is written last, so items may fill it in
+        tmp = self.data_file + '.tmp'
+        entries = []
+        with open(tmp, 'wb') as f:
+            f.write(b'{\n')
+            for acc_no, value, balance, kind in items:
+                prefix = (json.dumps(acc_no) + ': ').encode()
+                entries.append((acc_no, f.tell() + len(prefix), len(value), balance, kind))
+                f.write(prefix + value + b',\n')
+            prefix = (json.dumps(SNAPSHOT_META_KEY) + ': ').encode()
+            meta = json.dumps(meta, separators=(',', ':')).encode()
+            meta_span = (f.tell() + len(prefix), len(meta))
+            f.write(prefix + meta + b'\n}\n')
+            f.flush()
+            os.fsync(f.fileno())
+        entries.sort()
+        # Renames keep the size and mtime the index is checked against
+        SnapshotIndex.write(self.index_file + '.next', entries, tmp, meta_span)
+
+    def _install(self):
+        # Swaps in the snapshot _write_files() left beside the current one. The
+        # data file goes first: a crash in between only costs a reindex.
+        self.close()
+        os.replace(self.data_file + '.tmp', self.data_file)
+        os.replace(self.index_file + '.next', self.index_file)
+        fsync_dir(self.data_file)
+        self.index = SnapshotIndex.open(self.index_file, self.data_file)
+        self.data = self._map(self.data_file)
+        self.meta = json.loads(self._read(*self.index.meta_span)) if self.index.meta_span[1] else {}
+
+    @staticmethod
+    def _map(path):
+        with open(path, 'rb') as f:
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def track(self, acc_no, record):
+        # record is an open or pin record, or a txn record with only acc_no's legs
+        if record['op'] == 'open':
+            self.opened[acc_no] = record['account']
+            self.opened_keys = None
+        else:
+            self.pending.setdefault(acc_no, []).append(record)
+
+    def dirty(self):
+        return bool(self.opened or self.pending)
+
+    def clear(self):
+        self.opened.clear()
+        self.pending.clear()
+        self.opened_keys = None
+
+    def prune(self, opened, pending):
+        # Drops what a newly installed snapshot covers: the given overlays, frozen
+        # when it was started (records added since stay)
+        for acc_no in opened:
+            del self.opened[acc_no]
+        self.opened_keys = None
+        for acc_no, covered in pending.items():
+            remaining = self.pending[acc_no][len(covered):]
+            if remaining:
+                self.pending[acc_no] = remaining
+            else:
+                del self.pending[acc_no]
+
+    def _opened_keys(self):
+        if self.opened_keys is None:
+            self.opened_keys = sorted(self.opened)
+        return self.opened_keys
+
+    def _snapshot_entries(self, start=0, opened=None):
+        # Snapshot accounts and accounts opened since, merged in account-number
+        # order, from position start of the merged order
+        opened = self._opened_keys() if opened is None else sorted(opened)
+        # Of the first start accounts, j come from the snapshot and start - j were
+        # opened since; find j by bisecting on where the two orders interleave
+        lo, hi = max(0, start - len(opened)), min(start, self.index.count)
+        while lo < hi:
+            j = (lo + hi) // 2
+            if self.index.key(j) > opened[start - j - 1]:
+                hi = j
+            else:
+                lo = j + 1
+        return heapq.merge(
+            self.index.entries(lo),
+            [(acc_no, None, None, None, None) for acc_no in opened[start - lo:]]
+        )
+
+    def rank(self, acc_no):
+        # How many of this shard's accounts sort before acc_no
+        return self.index.rank(acc_no) + bisect_left(self._opened_keys(), acc_no)
+
+    def _read(self, offset, length):
+        return self.data[offset:offset + length]
+
+    def load_account(self, acc_no):
+        return self._build(acc_no, self.opened, self.pending)
+
+    def _build(self, acc_no, opened, pending):
+        # The snapshot's copy of an account with the given journal records on top
+        if acc_no in opened:
+            account = BankAccount.from_dict(opened[acc_no])
+        else:
+            entry = self.index.find(acc_no)
+            if entry is None:
+                return None
+            account = BankAccount.from_dict(json.loads(self._read(*entry)))
+        for record in pending.get(acc_no, ()):
+            apply_record({acc_no: account}, record)
+        return account
+
+    def _read_header(self, offset, length):
+        # A short read is usually enough to get the scalar fields. Accounts
+        # written before the dates moved ahead of the transaction list keep
+        # them at the end, so for those the tail is read as well.
+        header = self._parse_header(self._read(offset, min(length, 512)))
+        if header is None:
+            return json.loads(self._read(offset, length))
+        if 'last_accessed' not in header:
+            tail = self._read(offset + max(0, length - 256), min(length, 256))
+            try:
+                header.update(json.loads(b'{' + tail[tail.rindex(b'"creation_date":'):]))
+            except ValueError:
+                return json.loads(self._read(offset, length))
+        return header
+
+    @staticmethod
+    def _parse_header(raw):
+        # Accounts are serialized with their scalar fields ahead of the transaction
+        # list; parse just those, or return None if the list is not in raw
+        # ('"transactions":' cannot occur inside a JSON string, where quotes are escaped)
+        cut = raw.find(b'"transactions":')
+        if cut > 0:
+            try:
+                return json.loads(raw[:cut].rstrip(b',') + b'}')
+            except ValueError:
+                pass
+        return None
+
+    def account_headers(self, start=0):
+        # name, account_number, account_type, balance, creation_date and
+        # last_accessed of every account, without building any BankAccount
+        # that has no changes since the snapshot
+        for acc_no, offset, length, _, _ in self._snapshot_entries(start):
+            if acc_no in self.pending or acc_no in self.opened:
+                account = self.load_account(acc_no)
+                yield {'name': account.name, 'account_number': acc_no,
+                       'account_type': account.account_type, 'balance': account.balance,
+                       'creation_date': account.creation_date, 'last_accessed': account.last_accessed}
+            else:
+                yield self._read_header(offset, length)
+
+    def kind_balances(self, kind):
+        # (account number, balance in paise) of every account of one kind, from the
+        # index columns, with the balance carried by the newest journal leg for
+        # accounts changed since the snapshot; nothing is hydrated
+        for acc_no, balance in self.index.kind_balances(kind):
+            yield acc_no, self._latest_balance(acc_no, balance)
+        for acc_no in self._opened_keys():
+            data = self.opened[acc_no]
+            if account_kind(data['account_type']) == kind:
+                yield acc_no, self._latest_balance(acc_no, round(data['balance'] * 100))
+
+    def _latest_balance(self, acc_no, balance):
+        for record in reversed(self.pending.get(acc_no, ())):
+            if record['op'] == 'txn':
+                return round(record['legs'][-1]['balance'] * 100)
+        return balance
+
+    def has_account(self, acc_no):
+        return acc_no in self.opened or self.index.find(acc_no) is not None
+
+    def account_numbers(self, start=0):
+        # In account-number order, from position start
+        return (entry[0] for entry in self._snapshot_entries(start))
+
+    def count(self):
+        return self.index.count + len(self.opened)
+
+    def _compacted_items(self, opened=None, pending=None):
+        # Untouched accounts are copied byte for byte; only changed ones are re-serialized
+        opened = self.opened if opened is None else opened
+        pending = self.pending if pending is None else pending
+        for acc_no, offset, length, balance, kind in self._snapshot_entries(opened=opened):
+            if acc_no in pending or acc_no in opened:
+                yield self._item(self._build(acc_no, opened, pending))
+            else:
+                yield acc_no, self._read(offset, length), balance, kind
+
+    @staticmethod
+    def _item(account):
+        value = json.dumps(account.to_dict(), separators=(',', ':')).encode()
+        return account.account_number, value, round(account.balance * 100), account_kind(account.account_type)
+
+    def close(self):
+        if self.data is not None:
+            self.data.close()
+            self.data = None
+        self.index.close()
+
+def shard_of(acc_no, shards):
+    # crc32 rather than hash(), which differs from one process to the next
+    return zlib.crc32(acc_no.encode()) % shards
+
+def shard_path(path, shard, shards):
+    # path itself when there is a single shard, else e.g. bank_gui_data.2-of-4.json
+    if shards == 1:
+        return path
+    base, ext = os.path.splitext(path)
+    return f"{base}.{shard}-of-{shards}{ext}"
+
+def index_shard(data_file, index_file):
+    # Process pool entry point: opening a shard (re)writes a missing or stale index
+    SnapshotShard(data_file, index_file).close()
+
+class FileStorage:
+    # Accounts are spread over SHARD_COUNT snapshot shards by a hash of the
+    # account number, in front of one journal, so a transfer between shards is
+    # still a single all-or-nothing record. Each shard's metadata holds the
+    # journal position it covers, which lets a checkpoint rewrite only the
+    # shards that changed since the last one.
+    def __init__(self, data_file=DATA_FILE, journal_file=JOURNAL_FILE, index_file=INDEX_FILE,
+                 journal_mode=JOURNAL_FSYNC, shards=SHARD_COUNT):
+        self.journal = Journal(journal_file, journal_mode)
+        self.compaction = None  # the snapshot being written in the background, see _start_compaction
+        paths = [(shard_path(data_file, i, shards), shard_path(index_file, i, shards)) for i in range(shards)]
+        if shards > 1 and os.path.exists(data_file) and not any(os.path.exists(d) for d, _ in paths):
+            self._split(data_file, index_file, paths)
+        self._index_in_parallel(paths)
+        self.shards = [SnapshotShard(*path) for path in paths]
+        covered = [shard.meta.get('journal_seq', 0) for shard in self.shards]
+        newest = self.shards[covered.index(max(covered))].meta
+        if 'periods' in newest.get('stats', {}):
+            self.stats = BankStats.from_dict(newest['stats'])
+        else:
+            # Snapshot from before statistics or rollups were kept: count once and store the result
+            self.stats = BankStats.rebuild(self.load_account(acc_no) for acc_no in self.account_numbers())
+            for shard in self.shards:
+                if shard.data is not None:
+                    shard._write_snapshot(shard._compacted_items(), dict(shard.meta, stats=self.stats.to_dict()))
+        # A record goes to the shards whose snapshot predates it, and into the
+        # statistics if the newest snapshot does
+        self.journal.seq = stats_seq = max(covered)
+        for record in self.journal.replay(after_seq=min(covered)):
+            self._track(record, covered)
+            if record['seq'] > stats_seq:
+                self.stats.apply(record)
+        if self.journal.has_rotated():
+            # Stopped while a background snapshot was being written; finish the job
+            self.checkpoint()
+
+    @staticmethod
+    def _split(data_file, index_file, paths):
+        # First start with several shards: deal the accounts in the single
+        # snapshot out to them (copying bytes, not parsing), then set it aside
+        source = SnapshotShard(data_file, index_file)
+        for k, path in enumerate(paths):
+            shard = SnapshotShard(*path)
+            shard._write_snapshot(
+                ((acc_no, source._read(offset, length), balance, kind)
+                 for acc_no, offset, length, balance, kind in source.index.entries()
+                 if shard_of(acc_no, len(paths)) == k),
+                source.meta
+            )
+            shard.close()
+        source.close()
+        os.replace(data_file, data_file + '.unsharded')
+        if os.path.exists(index_file):
+            os.remove(index_file)
+
+    @staticmethod
+    def _index_in_parallel(paths):
+        # Shards with a missing or stale index are scanned in parallel processes.
+        # Children are forked, so they start with this module already loaded;
+        # without fork each shard indexes itself as it opens.
+        stale = []
+        for data_file, index_file in paths:
+            index = SnapshotIndex.open(index_file, data_file)
+            if index is not None:
+                index.close()
+            elif os.path.exists(data_file):
+                stale.append((data_file, index_file))
+        if len(stale) < 2:
+            return
+        import multiprocessing
+        if 'fork' not in multiprocessing.get_all_start_methods():
+            return
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=min(len(stale), os.cpu_count() or 1),
+                                 mp_context=multiprocessing.get_context('fork')) as pool:
+            list(pool.map(index_shard, *zip(*stale)))
+
+    def _shard(self, acc_no):
+        return self.shards[shard_of(acc_no, len(self.shards))]
+
+    def _meta(self):
+        return {'journal_seq': self.journal.seq, 'stats': self.stats.to_dict()}
+
+    def _track(self, record, covered=None):
+        # Hands each shard its accounts' part of a record: while replaying, only
+        # to the shards whose snapshot does not cover it yet
+        if record['op'] == 'open':
+            parts = [(record['account']['account_number'], record)]
+        elif record['op'] == 'pin':
+            parts = [(record['account'], record)]
+        else:
+            # Keep only each account's own legs, so a bulk record spanning many
+            # accounts does not get walked in full every time one is hydrated
+            legs_by_account = {}
+            for leg in record['legs']:
+                legs_by_account.setdefault(leg['account'], []).append(leg)
+            parts = [(acc_no, {'op': 'txn', 'legs': legs}) for acc_no, legs in legs_by_account.items()]
+        for acc_no, part in parts:
+            k = shard_of(acc_no, len(self.shards))
+            if covered is None or record['seq'] > covered[k]:
+                self.shards[k].track(acc_no, part)
+
+    def _starts(self, start):
+        # Where each shard's run begins for the merged account-number order to
+        # begin at position start: shard k contributes the accounts that have
+        # fewer than start accounts (over all shards) ahead of them
+        if len(self.shards) == 1 or start == 0:
+            return [start] * len(self.shards)
+        starts = []
+        for shard in self.shards:
+            lo, hi = 0, shard.count()
+            while lo < hi:
+                mid = (lo + hi) // 2
+                key = next(shard.account_numbers(mid))
+                if sum(other.rank(key) for other in self.shards) < start:
+                    lo = mid + 1
+                else:
+                    hi = mid
+            starts.append(lo)
+        return starts
+
+    def load_account(self, acc_no):
+        return self._shard(acc_no).load_account(acc_no)
+
+    def account_headers(self, start=0):
+        return heapq.merge(
+            *(shard.account_headers(j) for shard, j in zip(self.shards, self._starts(start))),
+            key=itemgetter('account_number')
+        )
+
+    def kind_balances(self, kind):
+        return chain.from_iterable(shard.kind_balances(kind) for shard in self.shards)
+
+    def has_account(self, acc_no):
+        return self._shard(acc_no).has_account(acc_no)
+
+    def account_numbers(self, start=0):
+        # In account-number order, from position start
+        return heapq.merge(*(shard.account_numbers(j) for shard, j in zip(self.shards, self._starts(start))))
+
+    def count(self):
+        return sum(shard.count() for shard in self.shards)
+
+    def load(self):
+        return {acc_no: self.load_account(acc_no) for acc_no in self.account_numbers()}
+
+    def record(self, record):
+        # Returns a ticket for wait()
+        seq = self.journal.append(record)
+        self._track(record)
+        self.stats.apply(record)
+        return seq
+
+    def wait(self, seq):
+        self.journal.wait(seq)
+
+    def save(self, accounts):
+        self._finish_compaction(wait=True)
+        self.journal.sync()
+        self.stats = BankStats.rebuild(accounts.values())
+        meta = self._meta()
+        numbers = [[] for _ in self.shards]
+        for acc_no in sorted(accounts):
+            numbers[shard_of(acc_no, len(self.shards))].append(acc_no)
+        for shard, shard_numbers in zip(self.shards, numbers):
+            shard._write_snapshot((shard._item(accounts[k]) for k in shard_numbers), meta)
+        self._reset_journal()
+
+    def checkpoint(self, force=False):
+        # Called under store_lock. Once CHECKPOINT_EVERY records have built up
+        # the journal is rotated and the changed shards are rewritten by a
+        # background thread, taking over at the first call after it is done.
+        # Should the journal get another 2 * CHECKPOINT_EVERY records ahead of
+        # it, this waits for it, so recovery never replays more than about
+        # 4 * CHECKPOINT_EVERY records however long the history. force folds
+        # everything into the snapshots before returning.
+        self._finish_compaction(wait=force or self.journal.records >= 2 * CHECKPOINT_EVERY)
+        if self.compaction is not None:
+            return
+        leftover = self.journal.has_rotated()  # from a failed or interrupted background snapshot
+        if force or leftover:
+            if self.journal.records or leftover:
+                self.journal.sync()
+                meta = self._meta()
+                for shard in self.shards:
+                    if shard.dirty():
+                        shard._write_snapshot(shard._compacted_items(), meta)
+                self._reset_journal()
+        elif self.journal.records >= CHECKPOINT_EVERY:
+            self._start_compaction()
+
+    def _start_compaction(self):
+        # Everything up to now is frozen for the writer thread: the rotated
+        # journal, copies of the changed shards' overlays and the metadata as of now
+        self.journal.rotate()
+        frozen = [
+            (shard, dict(shard.opened), {acc_no: list(records) for acc_no, records in shard.pending.items()})
+            for shard in self.shards if shard.dirty()
+        ]
+        meta = json.loads(json.dumps(self._meta()))
+        result = {}
+
+        def write():
+            try:
+                for shard, opened, pending in frozen:
+                    shard._write_files(shard._compacted_items(opened, pending), meta)
+            except Exception as e:
+                result['error'] = e
+
+        thread = threading.Thread(target=write, name="snapshot-writer", daemon=True)
+        self.compaction = (thread, result, frozen)
+        thread.start()
+
+    def _finish_compaction(self, wait=False):
+        # Installs finished background snapshots and drops the journal records
+        # they cover from the overlays (under store_lock)
+        if self.compaction is None:
+            return
+        thread, result, frozen = self.compaction
+        if thread.is_alive():
+            if not wait:
+                return
+            thread.join()
+        self.compaction = None
+        if 'error' in result:
+            # The rotated journal is still there; the next checkpoint folds it in
+            log.error("Background snapshot failed: %s", result['error'], exc_info=result['error'])
+            return
+        for shard, opened, pending in frozen:
+            shard._install()
+            shard.prune(opened, pending)
+        self.journal.drop_rotated()
+
+    def rebuild_stats(self):
+        # Recounts the statistics and rollups from the accounts themselves and
+        # writes every shard out with them (under store_lock)
+        self._finish_compaction(wait=True)
+        self.journal.sync()
+        self.stats = BankStats.rebuild(self.load_account(acc_no) for acc_no in self.account_numbers())
+        meta = self._meta()
+        for shard in self.shards:
+            if shard.data is not None or shard.dirty():
+                shard._write_snapshot(shard._compacted_items(), meta)
+        self._reset_journal()
+
+    def _reset_journal(self):
+        self.journal.reset()
+        for shard in self.shards:
+            shard.clear()
+
+    def close(self):
+        self._finish_compaction(wait=True)
+        self.journal.close()
+        for shard in self.shards:
+            shard.close()
+
+class SqliteStorage:
+    SYNCHRONOUS = {'always': 'FULL', 'group': 'NORMAL', 'async': 'OFF'}
+
+    def __init__(self, path=DB_FILE):
+        # Shared between threads; every use is serialized by store_lock
+        import sqlite3
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(f"PRAGMA synchronous={self.SYNCHRONOUS.get(JOURNAL_FSYNC, 'NORMAL')}")
+        with self.conn:
+            self.conn.executescript("""
+                CREATE TABLE IF NOT EXISTS accounts (
+                    account_number TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    pin TEXT NOT NULL,
+                    account_type TEXT NOT NULL,
+                    balance REAL NOT NULL,
+                    creation_date TEXT,
+                    last_accessed TEXT,
+                    opening_balance REAL
+                );
+                CREATE TABLE IF NOT EXISTS transactions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    account_number TEXT NOT NULL REFERENCES accounts(account_number),
+                    txn_type TEXT NOT NULL,
+                    amount REAL NOT NULL,
+                    date TEXT NOT NULL,
+                    description TEXT NOT NULL DEFAULT ''
+                );
+                CREATE INDEX IF NOT EXISTS idx_transactions_account ON transactions(account_number, id);
+                CREATE INDEX IF NOT EXISTS idx_transactions_type ON transactions(txn_type);
+                CREATE INDEX IF NOT EXISTS idx_transactions_date ON transactions(date);
+                CREATE TABLE IF NOT EXISTS meta (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL
+                );
+                CREATE TABLE IF NOT EXISTS rollups (
+                    period TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    totals TEXT NOT NULL,
+                    net INTEGER NOT NULL,
+                    PRIMARY KEY (period, key)
+                );
+            """)
+            if 'opening_balance' not in {column[1] for column in self.conn.execute("PRAGMA table_info(accounts)")}:
+                # Databases from before opening balances were kept derive them from the balance
+                self.conn.execute("ALTER TABLE accounts ADD COLUMN opening_balance REAL")
+        # The bank totals are one small row in meta; the rollups, which grow
+        # with every day of history, have a row each so a change rewrites
+        # only the ones it touched
+        row = self.conn.execute("SELECT value FROM meta WHERE key = 'totals'").fetchone()
+        legacy = self.conn.execute("SELECT value FROM meta WHERE key = 'stats'").fetchone()
+        if row:
+            self.stats = BankStats.from_dict(json.loads(row[0]))
+            for period, key, totals, net in self.conn.execute("SELECT period, key, totals, net FROM rollups"):
+                self.stats.periods.setdefault(period, {})[key] = [json.loads(totals), net]
+        elif legacy and 'periods' in json.loads(legacy[0]):
+            # Older databases kept the rollups inside one stats document
+            self.stats = BankStats.from_dict(json.loads(legacy[0]))
+            with self.conn:
+                self._save_stats(rewrite=True)
+        else:
+            self.rebuild_stats()
+
+    def rebuild_stats(self):
+        stats = BankStats()
+        # Each balance is rounded to paise on its own, as add_account() and
+        # reconcile() do, so balances with fractions of a paise add up the same
+        for account_type, balance in self.conn.execute("SELECT account_type, balance FROM accounts"):
+            stats.add_account(account_type, balance)
+        for txn_type, count, total in self.conn.execute(
+                "SELECT txn_type, COUNT(*), SUM(ROUND(amount * 100)) FROM transactions GROUP BY txn_type"):
+            stats.txn_counts[txn_type] = count
+            stats.txn_totals[txn_type] = round(total)
+        for day, txn_type, count, total in self.conn.execute(
+                "SELECT substr(date, 1, 10), txn_type, COUNT(*), SUM(ROUND(amount * 100)) FROM transactions "
+                "WHERE date >= ? GROUP BY 1, 2", (BankStats.daily_cutoff(),)):
+            stats.daily.setdefault(day, {})[txn_type] = [count, round(total)]
+        credit_types = ", ".join(f"'{t}'" for t in sorted(CREDIT_TYPES))
+        for day, txn_type, count, total in self.conn.execute(
+                "SELECT substr(date, 1, 10), txn_type, COUNT(*), SUM(ROUND(amount * 100)) FROM transactions GROUP BY 1, 2"):
+            stats._roll(day, {txn_type: [count, round(total)]})
+        # Opening balances: whatever each account's history does not explain
+        for day, opening in self.conn.execute(
+                "SELECT COALESCE(min(a.creation_date, t.first), a.creation_date, t.first), "
+                "SUM(ROUND(COALESCE(a.opening_balance, a.balance - COALESCE(t.net, 0)) * 100)) FROM accounts a LEFT JOIN ("
+                f"  SELECT account_number, SUM(CASE WHEN txn_type IN ({credit_types}) THEN amount ELSE -amount END) "
+                "  AS net, MIN(substr(date, 1, 10)) AS first FROM transactions GROUP BY account_number"
+                ") t USING (account_number) GROUP BY 1"):
+            stats._roll(day or now_text(), {None: [0, round(opening)]})
+        self.stats = stats
+        with self.conn:
+            self._save_stats(rewrite=True)
+
+    def _save_stats(self, rewrite=False):
+        # Writes the totals and the rollups changed since the last save, or
+        # with rewrite every rollup in place of what the database holds
+        stats = self.stats
+        totals = stats.to_dict()
+        del totals['periods']
+        self.conn.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('totals', ?)", (json.dumps(totals, separators=(',', ':')),)
+        )
+        if rewrite:
+            self.conn.execute("DELETE FROM rollups")
+            self.conn.execute("DELETE FROM meta WHERE key = 'stats'")
+            changed = [(period, key) for period, table in stats.periods.items() for key in table]
+        else:
+            changed = stats.changed
+        self.conn.executemany(
+            "INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?)",
+            [(period, key, json.dumps(stats.periods[period][key][0], separators=(',', ':')),
+              stats.periods[period][key][1]) for period, key in changed]
+        )
+        stats.changed.clear()
+
+    def is_empty(self):
+        return self.conn.execute("SELECT 1 FROM accounts LIMIT 1").fetchone() is None
+
+    ACCOUNT_COLUMNS = "name, account_number, pin, account_type, balance, creation_date, last_accessed, opening_balance"
+
+    @staticmethod
+    def _account_from_row(row, transactions):
+        # transactions is the account's complete ledger, so the opening balance
+        # derived from it is right when none was stored
+        account = BankAccount(row[0], row[1], row[2], row[3], row[4], transactions)
+        account.creation_date, account.last_accessed = row[5], row[6]
+        if row[7] is not None:
+            account.transactions.opening = round(row[7] * 100)
+        return account
+
+    def load(self):
+        rows = self.conn.execute(f"SELECT {self.ACCOUNT_COLUMNS} FROM accounts").fetchall()
+        ledgers = {row[1]: TransactionLedger() for row in rows}
+        for acc_no, txn_type, amount, date, description in self.conn.execute(
+                "SELECT account_number, txn_type, amount, date, description FROM transactions ORDER BY id"):
+            ledgers[acc_no].add(txn_type, amount, date, description)
+        return {row[1]: self._account_from_row(row, ledgers[row[1]]) for row in rows}
+
+    def load_account(self, acc_no):
+        row = self.conn.execute(
+            f"SELECT {self.ACCOUNT_COLUMNS} FROM accounts WHERE account_number = ?", (acc_no,)
+        ).fetchone()
+        if row is None:
+            return None
+        ledger = TransactionLedger()
+        for txn_type, amount, date, description in self.conn.execute(
+                "SELECT txn_type, amount, date, description FROM transactions "
+                "WHERE account_number = ? ORDER BY id", (acc_no,)):
+            ledger.add(txn_type, amount, date, description)
+        return self._account_from_row(row, ledger)
+
+    def has_account(self, acc_no):
+        return self.conn.execute(
+            "SELECT 1 FROM accounts WHERE account_number = ?", (acc_no,)
+        ).fetchone() is not None
+
+    def account_numbers(self, start=0):
+        return (row[0] for row in self.conn.execute(
+            "SELECT account_number FROM accounts ORDER BY account_number LIMIT -1 OFFSET ?", (start,)))
+
+    def account_headers(self, start=0):
+        for name, acc_no, account_type, balance, creation_date, last_accessed in self.conn.execute(
+                "SELECT name, account_number, account_type, balance, creation_date, last_accessed FROM accounts "
+                "ORDER BY account_number LIMIT -1 OFFSET ?", (start,)):
+            yield {'name': name, 'account_number': acc_no, 'account_type': account_type, 'balance': balance,
+                   'creation_date': creation_date, 'last_accessed': last_accessed}
+
+    def kind_balances(self, kind):
+        for acc_no, account_type, balance in self.conn.execute(
+                "SELECT account_number, account_type, balance FROM accounts ORDER BY account_number"):
+            if account_kind(account_type) == kind:
+                yield acc_no, round(balance * 100)
+
+    def count(self):
+        return self.conn.execute("SELECT COUNT(*) FROM accounts").fetchone()[0]
+
+    def _insert_account(self, account):
+        self.conn.execute(
+            "INSERT INTO accounts VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (account.account_number, account.name, account.pin, account.account_type,
+             account.balance, account.creation_date, account.last_accessed, account.transactions.opening / 100)
+        )
+        self.conn.executemany(
+            "INSERT INTO transactions (account_number, txn_type, amount, date, description) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(account.account_number, t.txn_type, t.amount, t.date, t.description)
+             for t in account.transactions]
+        )
+
+    def record(self, record):
+        # One SQLite transaction per record, so both legs of a transfer commit together
+        with self.conn:
+            if record['op'] == 'open':
+                self._insert_account(BankAccount.from_dict(record['account']))
+            elif record['op'] == 'pin':
+                self.conn.execute(
+                    "UPDATE accounts SET pin = ?, last_accessed = ? WHERE account_number = ?",
+                    (record['pin'], record['date'], record['account'])
+                )
+            elif record['op'] == 'txn':
+                legs = record['legs']
+                self.conn.executemany(
+                    "INSERT INTO transactions (account_number, txn_type, amount, date, description) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    [(leg['account'], leg['txn_type'], leg['amount'], leg['date'], leg['description']) for leg in legs]
+                )
+                self.conn.executemany(
+                    "UPDATE accounts SET balance = ?, last_accessed = ? WHERE account_number = ?",
+                    [(leg['balance'], leg['date'], leg['account']) for leg in legs]
+                )
+            self.stats.apply(record)
+            self._save_stats()
+
+    def save(self, accounts):
+        with self.conn:
+            self.conn.execute("DELETE FROM transactions")
+            self.conn.execute("DELETE FROM accounts")
+            for account in accounts.values():
+                self._insert_account(account)
+        self.rebuild_stats()
+
+    def checkpoint(self, force=False):
+        # Every record is already committed to the database
+        pass
+
+    def close(self):
+        self.conn.close()
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == 'sqlite':
+        storage = SqliteStorage(DB_FILE)
+        # First run on SQLite: carry over whatever the file backend holds
+        if storage.is_empty():
+            legacy = FileStorage().load()
+            if legacy:
+                storage.save(legacy)
+        return storage
+    return FileStorage()
+
+# Lock ordering: account locks first (several at once in account-number
+# order), then store_lock. store_lock covers storage, the account cache and
+# the build/record/apply step of every change, so storage and the accounts
+# in memory always agree whenever it is free.
+store_lock = threading.RLock()
+_local = threading.local()  # .batch: the ChangeBatch this thread is filling, if any
+                            # .ticket: storage ticket of its last change, until waited on
+
+def record_change(record):
+    batch = getattr(_local, 'batch', None)
+    if batch is not None:
+        batch.records.append(record)
+    else:
+        if storage is None:
+            open_bank()  # a change made before anything opened the bank
+        _local.ticket = storage.record(record)
+
+def take_ticket():
+    ticket = getattr(_local, 'ticket', None)
+    _local.ticket = None
+    return ticket
+
+def wait_durable():
+    # Blocks until this thread's last change is as durable as JOURNAL_FSYNC
+    # promises. Call it once store_lock and account locks are released, so
+    # other threads' changes can join the same journal write meanwhile.
+    ticket = take_ticket()
+    if ticket is not None:
+        storage.wait(ticket)
+
+class ChangeBatch:
+    # Change records held back by batch_changes(), plus the accounts they
+    # touch. Those stay locked until commit so nothing else can write a leg
+    # for them that would land in storage ahead of the held-back ones.
+    def __init__(self):
+        self.records = []
+        self.held = {}
+
+    def hold(self, *accounts):
+        needed = [a for a in {a.account_number: a for a in accounts}.values() if a.account_number not in self.held]
+        for account in needed:
+            if account.lock.acquire(blocking=False):
+                self.held[account.account_number] = account
+                continue
+            # Waiting for an account while holding store_lock could deadlock with
+            # its owner, who wants store_lock next: commit, let go of everything
+            # and take back what was held along with what is needed, in
+            # account-number order and with store_lock released, the same order
+            # as everyone else (account locks first, then store_lock)
+            wanted = {**self.held, **{a.account_number: a for a in needed}}
+            self.commit()
+            store_lock.release()
+            try:
+                wait_durable()
+                for other in sorted(wanted.values(), key=attrgetter('account_number')):
+                    other.lock.acquire()
+                    self.held[other.account_number] = other
+            finally:
+                store_lock.acquire()
+            return
+
+    def commit(self):
+        records, self.records = self.records, []
+        legs = []
+        for record in records:
+            if record['op'] == 'txn':
+                legs.extend(record['legs'])
+                continue
+            if legs:
+                _local.ticket = storage.record({'op': 'txn', 'legs': legs})
+                legs = []
+            _local.ticket = storage.record(record)
+        if legs:
+            _local.ticket = storage.record({'op': 'txn', 'legs': legs})
+        for account in self.held.values():
+            account.lock.release()
+        self.held.clear()
+
+@contextmanager
+def batch_changes(wait=True):
+    # Changes made inside the block reach storage together when it exits, with
+    # all transaction legs in a single record (one journal line or one SQLite
+    # transaction). Hold the accounts you change with batch.hold() first.
+    # store_lock is kept for the whole block, so do not enter it holding
+    # account locks taken outside the batch. With wait=False the caller
+    # waits for durability itself (take_ticket / storage.wait).
+    batch = getattr(_local, 'batch', None)
+    if batch is not None:
+        yield batch  # already inside a batch; the outer one commits
+        return
+    with store_lock:
+        batch = _local.batch = ChangeBatch()
+        try:
+            yield batch
+        finally:
+            _local.batch = None
+            batch.commit()
+    if wait:
+        wait_durable()
+
+def apply_record(accounts, record):
+    if record['op'] == 'open':
+        account = BankAccount.from_dict(record['account'])
+        accounts[account.account_number] = account
+    elif record['op'] == 'pin':
+        account = accounts.get(record['account'])
+        if account:
+            account.pin = record['pin']
+            account.last_accessed = record['date']
+    elif record['op'] == 'txn':
+        for leg in record['legs']:
+            account = accounts.get(leg['account'])
+            if account:
+                account._apply(leg)
+
+class AccountSearchIndex:
+    # Trigram postings over lower-cased names and account numbers. Each account
+    # gets a small integer id; postings are arrays of ids. Every 1- and
+    # 2-character substring is a gram too, so short queries never scan, and
+    # every word gets 1- and 2-character prefix grams (marked with a leading
+    # NUL). Matches inside a word rank lower and are only looked up when there
+    # are too few prefix matches.
+    def __init__(self, accounts=()):
+        self.ids = {}
+        self.account_numbers = []
+        self.names = []
+        self.keys = []
+        self.postings = {}
+        for acc_no, name in accounts:
+            self.add(acc_no, name)
+
+    @staticmethod
+    def _grams(text):
+        grams = {text[i:i + n] for n in (1, 2, 3) for i in range(len(text) - n + 1)}
+        for word in text.split():
+            grams.add('\0' + word[:1])
+            grams.add('\0' + word[:2])
+        return grams
+
+    def add(self, acc_no, name):
+        if acc_no in self.ids:
+            return
+        account_id = self.ids[acc_no] = len(self.account_numbers)
+        self.account_numbers.append(acc_no)
+        self.names.append(name)
+        self.keys.append((acc_no.lower(), name.lower()))
+        for gram in self._grams(acc_no.lower()) | self._grams(name.lower()):
+            self.postings.setdefault(gram, array('I')).append(account_id)
+
+    @instrumented('accounts.search_index')
+    def search(self, term, limit=SEARCH_RESULT_LIMIT):
+        term = term.strip().lower()
+        if not term:
+            return []
+        if len(term) < 3:
+            hits = self.postings.get('\0' + term, ())
+            if len(hits) < limit:
+                hits = self.postings.get(term, ())  # exactly the accounts containing term
+        else:
+            # The rarest trigram bounds the candidates; each one is then verified
+            grams = [term[i:i + 3] for i in range(len(term) - 2)]
+            shortest = min((self.postings.get(g, ()) for g in grams), key=len)
+            hits = [i for i in shortest if term in self.keys[i][0] or term in self.keys[i][1]]
+
+        def rank(i):
+            acc_no, name = self.keys[i]
+            if term == acc_no or term == name:
+                score = 0
+            elif acc_no.startswith(term):
+                score = 1
+            elif any(word.startswith(term) for word in name.split()):
+                score = 2
+            else:
+                score = 3
+            return score, name, acc_no
+
+        return [self.account_numbers[i] for i in heapq.nsmallest(limit, hits, key=rank)]
+
+class AccountMap:
+    # Dict-like view over the storage backend that hydrates accounts on first
+    # use and keeps only the most recently used ones in memory.
+    def __init__(self, storage, capacity=ACCOUNT_CACHE_SIZE):
+        self.storage = storage
+        self.capacity = capacity
+        self.cache = OrderedDict()
+        # Accounts evicted from the LRU but still referenced elsewhere (e.g. the
+        # logged-in user) must not be hydrated a second time as a stale copy
+        self.live = weakref.WeakValueDictionary()
+        self.search_index = None  # built on the first search
+
+    def _lookup(self, acc_no):
+        # Under store_lock, so two threads can never hydrate the same account twice
+        with store_lock:
+            account = self.cache.get(acc_no) or self.live.get(acc_no)
+            if account is None:
+                account = self.storage.load_account(acc_no)
+                if account is not None:
+                    self.live[acc_no] = account
+            return account
+
+    def get(self, acc_no, default=None):
+        with store_lock:
+            account = self._lookup(acc_no)
+            if account is None:
+                return default
+            self[acc_no] = account
+            return account
+
+    def __getitem__(self, acc_no):
+        account = self.get(acc_no)
+        if account is None:
+            raise KeyError(acc_no)
+        return account
+
+    def __setitem__(self, acc_no, account):
+        with store_lock:
+            self.cache[acc_no] = account
+            self.cache.move_to_end(acc_no)
+            self.live[acc_no] = account
+            while len(self.cache) > self.capacity:
+                # Dirty accounts need no write-back here: their changes are already in
+                # the journal and get folded into the snapshot at the next checkpoint
+                self.cache.popitem(last=False)
+
+    def __contains__(self, acc_no):
+        with store_lock:
+            return acc_no in self.cache or self.storage.has_account(acc_no)
+
+    def __len__(self):
+        return self.storage.count()
+
+    def __iter__(self):
+        return iter(self.storage.account_numbers())
+
+    def keys(self):
+        return iter(self)
+
+    def items(self):
+        # Full scans hydrate one account at a time and leave the LRU alone
+        for acc_no in self.storage.account_numbers():
+            yield acc_no, self._lookup(acc_no)
+
+    def values(self):
+        for _, account in self.items():
+            yield account
+
+    def page(self, start, count):
+        # count accounts from position start in account-number order, hydrating
+        # only those (for list views that show a window onto every account)
+        with store_lock:
+            return [self._lookup(acc_no) for acc_no in islice(self.storage.account_numbers(start), count)]
+
+    def apply_to_loaded(self, record):
+        # Bring hydrated accounts in line with a record that was written straight
+        # to storage (callers hold store_lock across both)
+        for leg in record['legs']:
+            account = self.cache.get(leg['account']) or self.live.get(leg['account'])
+            if account is not None:
+                account._apply(leg)
+
+    @instrumented('accounts.search')
+    def search(self, term, limit=SEARCH_RESULT_LIMIT):
+        with store_lock:
+            if self.search_index is None:
+                self.search_index = AccountSearchIndex(
+                    (header['account_number'], header['name']) for header in self.storage.account_headers()
+                )
+            return [self._lookup(acc_no) for acc_no in self.search_index.search(term, limit)]
+
+def open_account(accounts, account):
+    with store_lock:
+        record_change({'op': 'open', 'account': account.to_dict()})
+        accounts[account.account_number] = account
+        if isinstance(accounts, AccountMap) and accounts.search_index is not None:
+            accounts.search_index.add(account.account_number, account.name)
+    wait_durable()
+
+def apply_interest_to_all(accounts, rate=0.04, dry_run=False):
+    # Month-end run: one pass over every savings balance (in paise) straight from
+    # storage (no accounts are hydrated) and a single change record for the lot.
+    # Holding store_lock throughout keeps storage and loaded accounts in step;
+    # interest only adds money, so checks other threads made under their
+    # account locks still hold afterwards.
+    with store_lock:
+        acc_nos = []
+        balances = array('q')
+        for acc_no, balance in accounts.storage.kind_balances(account_kind("savings")):
+            acc_nos.append(acc_no)
+            balances.append(balance)
+        interest = array('q', (round(balance * rate) for balance in balances))
+        report = {
+            'rate': rate,
+            'accounts': sum(1 for amount in interest if amount > 0),
+            'total_interest': sum(interest) / 100,
+            'dry_run': dry_run
+        }
+        if dry_run or not report['accounts']:
+            return report
+        now = now_text()
+        description = f"Interest @ {rate*100}%"
+        legs = [
+            {'txn_type': "interest", 'amount': amount / 100, 'date': now, 'description': description,
+             'account': acc_no, 'balance': (balance + amount) / 100}
+            for acc_no, balance, amount in zip(acc_nos, balances, interest) if amount > 0
+        ]
+        record = {'op': 'txn', 'legs': legs}
+        record_change(record)
+        accounts.apply_to_loaded(record)
+    wait_durable()
+    return report
+
+def read_operations(path):
+    # Streams (line number, row) from a CSV file with a header row or a JSON Lines
+    # file; JSON lines are passed on unparsed so a bad one fails only its own row
+    with open(path, newline='') as f:
+        if path.lower().endswith('.csv'):
+            import csv
+            reader = csv.DictReader(f)
+            for row in reader:
+                yield reader.line_num, row
+        else:
+            for line_no, line in enumerate(f, 1):
+                if line.strip():
+                    yield line_no, line
+
+def import_operations(accounts, rows):
+    # Applies deposit/withdraw/transfer rows ({type, account, amount, target,
+    # description}) with the same validation as the ATM, apart from the
+    # velocity limits, and stores all the ones that succeed as a single
+    # commit (more than one only if another thread needs an account the
+    # import is holding). Returns counts and per-row errors.
+    def find(acc_no):
+        account = batch.held.get(acc_no) or accounts.get(acc_no)
+        if account is None:
+            raise ValueError(f"Account {acc_no} not found")
+        return account
+
+    report = {'applied': 0, 'failed': 0, 'errors': []}
+    started = time.perf_counter()
+    with batch_changes() as batch, velocity.exempt():
+        for line_no, row in rows:
+            try:
+                if isinstance(row, str):
+                    row = json.loads(row)
+                if not isinstance(row, dict):
+                    raise ValueError("Row must be a JSON object")
+                op = row['type'].strip().lower()
+                amount = float(row['amount'])
+                if not math.isfinite(amount):
+                    raise ValueError("Amount must be a number")
+                account = find(str(row['account']).strip())
+                description = row.get('description') or "Bulk import"
+                if not isinstance(description, str):
+                    raise ValueError("Description must be text")
+                if op == "deposit":
+                    batch.hold(account)
+                    account.deposit(amount, description)
+                elif op == "withdraw":
+                    batch.hold(account)
+                    account.withdraw(amount, description)
+                elif op == "transfer":
+                    target = find(str(row['target']).strip())
+                    batch.hold(account, target)
+                    account.transfer(target, amount, description)
+                else:
+                    raise ValueError(f"Unknown operation '{row['type']}'")
+                report['applied'] += 1
+            except KeyError as e:
+                report['failed'] += 1
+                report['errors'].append((line_no, f"Missing field {e}"))
+            except (ValueError, TypeError, AttributeError) as e:
+                report['failed'] += 1
+                report['errors'].append((line_no, str(e)))
+    report['seconds'] = time.perf_counter() - started
+    checkpoint_if_needed(accounts)
+    return report
+
+STATEMENT_FIELDS = ['account_number', 'date', 'txn_type', 'amount', 'description', 'balance']
+
+def statement_rows(accounts, acc_nos=None, start=None, end=None):
+    # Streams one dict per transaction (STATEMENT_FIELDS), oldest first within
+    # each account, with the balance after it. Without acc_nos it covers every
+    # account, hydrating one at a time.
+    if acc_nos is None:
+        selected = accounts.values()
+    else:
+        selected = (accounts[acc_no] for acc_no in acc_nos)
+    for account in selected:
+        ledger = account.transactions
+        lo, hi = account._time_range(start, end)
+        for i in range(lo, hi):
+            txn = ledger[i]
+            yield {
+                'account_number': account.account_number,
+                'date': txn.date,
+                'txn_type': txn.txn_type,
+                'amount': txn.amount,
+                'description': txn.description,
+                'balance': ledger.balance_after(i) / 100
+            }
+
+def write_statement(rows, out, fmt='csv'):
+    # Writes statement rows to the text stream out as CSV (with a header row)
+    # or JSON Lines as they arrive; returns the number of rows
+    count = 0
+    if fmt == 'csv':
+        import csv
+        writer = csv.DictWriter(out, STATEMENT_FIELDS, lineterminator='\n')
+        writer.writeheader()
+        for count, row in enumerate(rows, 1):
+            writer.writerow(row)
+    elif fmt == 'jsonl':
+        for count, row in enumerate(rows, 1):
+            out.write(json.dumps(row, ensure_ascii=False) + '\n')
+    else:
+        raise ValueError(f"Unknown statement format '{fmt}'")
+    return count
+
+def import_accounts(accounts, source):
+    # Opens every account in source (an iterable of BankAccount, e.g.
+    # read_accounts) that does not exist yet, IMPORT_BATCH_SIZE per commit.
+    # Returns the numbers of accounts added and skipped.
+    report = {'added': 0, 'skipped': 0}
+    source = iter(source)
+    while True:
+        chunk = list(islice(source, IMPORT_BATCH_SIZE))
+        if not chunk:
+            break
+        with batch_changes():
+            for account in chunk:
+                if account.account_number in accounts:
+                    report['skipped'] += 1
+                else:
+                    open_account(accounts, account)
+                    report['added'] += 1
+        checkpoint_if_needed(accounts)
+    return report
+
+def rollup_report(accounts, acc_no=None, period='month', start=None, end=None):
+    # Day or month totals for one account, or the whole bank without acc_no,
+    # read from the materialized rollups rather than the transactions
+    if acc_no is None:
+        rows = storage.stats.rollup(period, start, end)
+    else:
+        account = accounts.get(acc_no)
+        if account is None:
+            raise ValueError(f"Account {acc_no} not found")
+        rows = account.rollup(period, start, end)
+    return [
+        {'period': key,
+         'counts': {txn_type: count for txn_type, (count, _) in totals.items()},
+         'totals': {txn_type: paise / 100 for txn_type, (_, paise) in totals.items()},
+         'closing': closing / 100}
+        for key, totals, closing in rows
+    ]
+
+def format_rollup(rows):
+    lines = [f"{'Period':<10} {'Deposits':>20} {'Withdrawals':>20} {'Interest':>20} "
+             f"{'Transfers in':>20} {'Transfers out':>20} {'Closing':>16}"]
+    for row in rows:
+        cells = [
+            f"{row['counts'].get(txn_type, 0)} ₹{row['totals'].get(txn_type, 0):.2f}"
+            for txn_type in ("deposit", "withdraw", "interest", "transfer_from", "transfer_to")
+        ]
+        closing = f"₹{row['closing']:.2f}"
+        lines.append(f"{row['period']:<10} {cells[0]:>20} {cells[1]:>20} {cells[2]:>20} "
+                     f"{cells[3]:>20} {cells[4]:>20} {closing:>16}")
+    return lines
+
+def audit_account(data, indexed_balance=None):
+    # Recomputes an account's balance from its stored history. Returns its
+    # totals [balance in paise, transactions, transfer pairing] and the
+    # problems found. Each transfer leg adds (out) or takes away (in) a hash of
+    # payer, payee and amount, so summed over the bank the pairings cancel out
+    # when every transfer has both its legs.
+    acc_no = data['account_number']
+    balance = round(data['balance'] * 100)
+    rows = data.get('transactions', [])
+    problems = []
+    checksum = net = lowest = pairing = 0
+    previous = lowest_date = ""
+    in_order = True
+    crc32 = zlib.crc32
+    for row in rows:
+        txn_type, date, description = row['txn_type'], row['date'], row.get('description', "")
+        paise = round(row['amount'] * 100)
+        # row_checksum, inlined
+        checksum = crc32(f"{txn_type}|{paise}|{date}|{description}\n".encode(), checksum)
+        if paise < 0:
+            problems.append(f"{txn_type} of ₹{paise / 100:.2f} on {date}")
+        if date < previous and in_order:
+            problems.append(f"transactions out of date order at {date}")
+            in_order = False
+        previous = date
+        if txn_type in CREDIT_TYPES:
+            net += paise
+            if txn_type == "transfer_from":
+                payer = description[len("Transfer from "):].partition(':')[0]
+                pairing -= crc32(f"{payer}>{acc_no}:{paise}".encode())
+        else:
+            net -= paise
+            if net < lowest:
+                lowest, lowest_date = net, date
+            if txn_type == "transfer_to":
+                payee = description[len("Transfer to "):].partition(':')[0]
+                pairing += crc32(f"{acc_no}>{payee}:{paise}".encode())
+    opening = balance - net
+    if 'opening_balance' in data:
+        recorded = round(data['opening_balance'] * 100)
+        if recorded != opening:
+            problems.append(f"balance is ₹{balance / 100:.2f} but its history comes to ₹{(recorded + net) / 100:.2f}")
+        opening = recorded
+    if opening + lowest < 0:
+        problems.append(f"balance falls to ₹{(opening + lowest) / 100:.2f} on {lowest_date}" if lowest_date
+                        else f"history comes to ₹{net / 100:.2f}, more than the balance")
+    if 'checksum' in data and data['checksum'] != checksum:
+        problems.append("transactions do not match their checksum")
+    if indexed_balance is not None and indexed_balance != balance:
+        problems.append(f"snapshot index has the balance as ₹{indexed_balance / 100:.2f}")
+    return [balance, len(rows), pairing], problems
+
+def reconcile_record(known, acc_no, raw, indexed_balance=None):
+    # Returns (state, problems, verified) for one account's JSON record; state
+    # is [crc32 of the record, *totals], with no crc32 if there were problems.
+    # A record byte for byte the same as a clean one in known is not parsed again.
+    crc = zlib.crc32(raw)
+    state = known.get(acc_no)
+    if state is not None and state[0] == crc:
+        return state, [], False
+    try:
+        data = json.loads(raw)
+        totals, problems = audit_account(data, indexed_balance)
+    except (ValueError, KeyError, TypeError, AttributeError) as e:
+        return [None, 0, 0, 0], [f"unreadable record ({e!r})"], True
+    if data['account_number'] != acc_no:
+        problems.append(f"record is for account {data['account_number']}")
+    return [None if problems else crc, *totals], problems, True
+
+_reconciling = None  # (snapshot shards, last run's account states) for reconcile_chunk; forked workers inherit it
+
+def reconcile_chunk(shard_no, start, stop):
+    # Process pool entry point: checks a shard's snapshot accounts start..stop,
+    # leaving out those with journal records on top
+    shards, known = _reconciling
+    shard = shards[shard_no]
+    return [
+        (acc_no, *reconcile_record(known, acc_no, shard._read(offset, length), balance))
+        for acc_no, offset, length, balance, _ in islice(shard.index.entries(start), stop - start)
+        if acc_no not in shard.pending
+    ]
+
+@instrumented('reconcile')
+def reconcile(storage, full=False, workers=None, state_file=RECONCILE_FILE):
+    # Recomputes every account's balance from its history, checks the bank's
+    # totals against its statistics and returns a report of the discrepancies.
+    # Snapshot accounts are checked in forked processes, RECONCILE_CHUNK at a
+    # time. The crc32 of each account's record is kept in state_file with its
+    # totals, so unless full only records changed since the last run (or with
+    # problems then) are parsed again. Accounts with journal records since the
+    # snapshot, and all of a SQLite store, are rebuilt and checked in this
+    # process. Replaying takes the checksum from the journal legs (see
+    # BankAccount._apply), so a changed leg is caught like a changed snapshot row.
+    global _reconciling
+    started = time.perf_counter()
+    known = {}
+    if not full and os.path.exists(state_file):
+        with open(state_file) as f:
+            known = json.load(f)['accounts']
+    results = []
+    if isinstance(storage, FileStorage):
+        jobs = [
+            (k, start, min(start + RECONCILE_CHUNK, shard.index.count))
+            for k, shard in enumerate(storage.shards) for start in range(0, shard.index.count, RECONCILE_CHUNK)
+        ]
+        rebuilt = sorted(set(chain.from_iterable(chain(shard.opened, shard.pending) for shard in storage.shards)))
+        workers = workers or os.cpu_count() or 1
+        _reconciling = (storage.shards, known)
+        try:
+            import multiprocessing
+            if workers > 1 and len(jobs) > 1 and 'fork' in multiprocessing.get_all_start_methods():
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=min(workers, len(jobs)),
+                                         mp_context=multiprocessing.get_context('fork')) as pool:
+                    results = list(chain.from_iterable(pool.map(reconcile_chunk, *zip(*jobs))))
+            else:
+                results = list(chain.from_iterable(reconcile_chunk(*job) for job in jobs))
+        finally:
+            _reconciling = None
+    else:
+        rebuilt = storage.account_numbers()
+    for acc_no in rebuilt:
+        raw = json.dumps(storage.load_account(acc_no).to_dict(), separators=(',', ':')).encode()
+        results.append((acc_no, *reconcile_record(known, acc_no, raw)))
+
+    state = {}
+    problems = []
+    verified = 0
+    for acc_no, account_state, found, checked in results:
+        state[acc_no] = account_state
+        verified += checked
+        problems.extend({'account': acc_no, 'problem': problem} for problem in found)
+    problems.sort(key=itemgetter('account'))
+    stats = storage.stats
+    balances = sum(account_state[1] for account_state in state.values())
+    transactions = sum(account_state[2] for account_state in state.values())
+    bank = []
+    if len(state) != stats.total_accounts():
+        bank.append(f"{len(state)} accounts checked, the statistics count {stats.total_accounts()}")
+    if balances != stats.total_balance:
+        bank.append(f"balances add up to ₹{balances / 100:.2f}, the statistics say ₹{stats.total_balance / 100:.2f}")
+    if transactions != sum(stats.txn_counts.values()):
+        bank.append(f"{transactions} transactions found, the statistics count {sum(stats.txn_counts.values())}")
+    if sum(account_state[3] for account_state in state.values()):
+        bank.append("transfer legs do not pair up: a transfer is missing a side or its sides disagree")
+    tmp = state_file + '.tmp'
+    with open(tmp, 'w') as f:
+        f.write(json.dumps({'checked_at': now_text(), 'accounts': state}, separators=(',', ':')))
+    os.replace(tmp, state_file)
+    return {
+        'accounts': len(state),
+        'verified': verified,
+        'unchanged': len(state) - verified,
+        'seconds': round(time.perf_counter() - started, 3),
+        'ok': not problems and not bank,
+        'problems': problems,
+        'bank': bank
+    }
+
+def format_reconciliation(report):
+    lines = [f"Checked {report['accounts']} accounts in {report['seconds']:.2f}s: {report['verified']} verified, "
+             f"{report['unchanged']} unchanged since the last run"]
+    if report['ok']:
+        lines.append("No discrepancies")
+    if report['problems']:
+        lines.append(f"{'Account':<12} Problem")
+        lines.extend(f"{row['account']:<12} {row['problem']}" for row in report['problems'])
+    lines.extend(f"Bank: {problem}" for problem in report['bank'])
+    return lines
+
+@contextmanager
+def scratch_storage(journal_mode=JOURNAL_FSYNC, velocity_rules=()):
+    # Points the module at an empty FileStorage in a temporary directory, and
+    # at a VelocityGuard with velocity_rules, for the length of the block;
+    # yields its file paths so it can be reopened. Synthetic workloads would
+    # trip the live limits within seconds, so by default there are no rules.
+    import tempfile
+    global storage, velocity
+    saved_storage, saved_velocity = storage, velocity
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, name) for name in (DATA_FILE, JOURNAL_FILE, INDEX_FILE)]
+        storage = FileStorage(*paths, journal_mode=journal_mode)
+        velocity = VelocityGuard(velocity_rules)
+        try:
+            yield paths
+        finally:
+            storage.close()
+            storage, velocity = saved_storage, saved_velocity
+
+def stress_test(workers=8, operations=20000, account_count=20, velocity_rules=()):
+    # Hammers a scratch store from many threads with transfers, deposits and
+    # withdrawals between a few accounts, then checks that no money appeared
+    # or vanished and that replaying the journal gives the same balances
+    saved_interval = sys.getswitchinterval()
+    with scratch_storage(velocity_rules=velocity_rules) as paths:
+        sys.setswitchinterval(1e-6)  # switch threads as often as possible
+        try:
+            bank = AccountMap(storage)
+            numbers = [f"S{i:04d}" for i in range(account_count)]
+            for acc_no in numbers:
+                open_account(bank, BankAccount(f"Stress {acc_no}", acc_no, "0000", "Savings", 1000.0))
+            opening_total = round(sum(bank[acc_no].balance for acc_no in numbers), 2)
+            net_flows = [0.0] * workers  # money added (deposits, interest) minus withdrawals, per worker
+
+            def work(worker):
+                rng = random.Random(worker)
+                for _ in range(operations // workers):
+                    source, target = rng.sample(numbers, 2)
+                    amount = rng.randint(1, 300)
+                    action = rng.random()
+                    try:
+                        if action < 0.1:
+                            net_flows[worker] += apply_interest_to_all(bank, rate=0.001)['total_interest']
+                        elif action < 0.2:
+                            import_operations(bank, [(0, {'type': 'transfer', 'account': source,
+                                                          'target': target, 'amount': amount})])
+                        elif action < 0.7:
+                            bank[source].transfer(bank[target], amount, "stress")
+                        elif action < 0.85:
+                            bank[source].deposit(amount, "stress")
+                            net_flows[worker] += amount
+                        else:
+                            bank[source].withdraw(amount, "stress")
+                            net_flows[worker] -= amount
+                    except ValueError:
+                        pass  # insufficient balance is an expected outcome
+
+            threads = [threading.Thread(target=work, args=(i,)) for i in range(workers)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+
+            balances = {acc_no: bank[acc_no].balance for acc_no in numbers}
+            with store_lock:
+                # A second store on the same files must not race the snapshot writer
+                storage._finish_compaction(wait=True)
+            storage.journal.sync()
+            replayed = FileStorage(*paths)
+            replayed_balances = {acc_no: replayed.load_account(acc_no).balance for acc_no in numbers}
+            replayed.close()
+            report = {
+                'workers': workers,
+                'operations': operations,
+                'seconds': elapsed,
+                'replay_matches': replayed_balances == balances,
+                'ledgers_match': all(
+                    bank[acc_no].transactions.balance_after(len(bank[acc_no].transactions) - 1)
+                    == round(balances[acc_no] * 100) for acc_no in numbers
+                ),
+                'no_overdraft': all(balance >= 0 for balance in balances.values()),
+                'conserved': round(opening_total + sum(net_flows), 2) == round(sum(balances.values()), 2),
+                'velocity_blocked': velocity.blocked,
+                'velocity_flagged': velocity.flagged
+            }
+            report['ok'] = all(report[key] for key in ('replay_matches', 'ledgers_match', 'no_overdraft', 'conserved'))
+            return report
+        finally:
+            sys.setswitchinterval(saved_interval)
+
+def durability_benchmark(workers=8, operations=4000, modes=('always', 'group', 'async'), velocity_rules=()):
+    # Deposits from several threads into a scratch store under each journal
+    # mode. Latency is per deposit and includes waiting for the journal write.
+    results = {}
+    for mode in modes:
+        with scratch_storage(journal_mode=mode, velocity_rules=velocity_rules):
+            bank = AccountMap(storage)
+            numbers = [f"D{i:04d}" for i in range(workers)]
+            for acc_no in numbers:
+                open_account(bank, BankAccount(f"Durability {acc_no}", acc_no, "0000", "Current", 0.0))
+            latencies = [[] for _ in range(workers)]
+
+            def work(worker):
+                account = bank[numbers[worker]]
+                for _ in range(operations // workers):
+                    started = time.perf_counter()
+                    account.deposit(1, "durability")
+                    latencies[worker].append(time.perf_counter() - started)
+
+            threads = [threading.Thread(target=work, args=(i,)) for i in range(workers)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            samples = list(chain.from_iterable(latencies))
+            results[mode] = dict(
+                latency_summary(samples),
+                ops_per_second=round(len(samples) / elapsed),
+                journal_writes=storage.journal.writes,
+                velocity_flagged=velocity.flagged
+            )
+    return results
+
+def recovery_benchmark(history_sizes=(20000, 80000, 320000), account_count=1000, batch_size=10, velocity_rules=()):
+    # Builds scratch stores holding each amount of transaction history, with
+    # deposits committed batch_size at a time as the server does, then times
+    # reopening them as if the process had just died. 'snapshots' checkpoints
+    # after every batch like the app; 'journal_only' never does, so recovery
+    # has to replay the whole history.
+    results = {}
+    for total in history_sizes:
+        results[total] = {}
+        for label, checkpoints in (('snapshots', True), ('journal_only', False)):
+            with scratch_storage(journal_mode='async', velocity_rules=velocity_rules) as paths:
+                bank = AccountMap(storage)
+                numbers = [f"R{i:05d}" for i in range(account_count)]
+                with batch_changes():
+                    for acc_no in numbers:
+                        open_account(bank, BankAccount(f"Recovery {acc_no}", acc_no, "0000", "Current", 0.0))
+                for first in range(0, total, batch_size):
+                    with batch_changes() as batch:
+                        for k in range(first, min(first + batch_size, total)):
+                            account = bank[numbers[k % account_count]]
+                            batch.hold(account)
+                            account.deposit(1, "recovery")
+                    if checkpoints:
+                        checkpoint_if_needed(bank)
+                with store_lock:
+                    storage._finish_compaction(wait=True)  # as in stress_test
+                storage.journal.sync()
+                started = time.perf_counter()
+                reopened = FileStorage(*paths)
+                replayed = reopened.journal.records
+                AccountMap(reopened)[numbers[0]]
+                elapsed = time.perf_counter() - started
+                reopened.close()
+            results[total][label] = {'seconds': round(elapsed, 3), 'replayed_records': replayed}
+    return results
+
+BENCH_FIRST_NAMES = ["Aarav", "Diya", "Ishaan", "Kavya", "Rohan", "Sneha", "Vikram", "Ananya", "Arjun", "Meera"]
+BENCH_LAST_NAMES = ["Sharma", "Patel", "Iyer", "Reddy", "Gupta", "Nair", "Khan", "Das", "Mehta", "Singh"]
+BENCH_TXN_MIX = {'deposit': 50, 'withdraw': 30, 'transfer': 20}
+
+def generate_accounts(count=2000, txns_per_account=50, mix=BENCH_TXN_MIX, savings_share=0.6, seed=1):
+    # Synthetic bank for benchmarks: count accounts with random names and
+    # types, and count * txns_per_account transactions drawn from mix (weights
+    # for deposit, withdraw and transfer) spread over the past year in time
+    # order. Withdrawals and transfers the balance cannot cover become
+    # deposits; a transfer writes both legs. Returns {acc_no: BankAccount}.
+    rng = random.Random(seed)
+    numbers = [str(500000 + i) for i in range(count)]
+    opening = {acc_no: rng.randint(500, 50000) * 100 for acc_no in numbers}
+    balances = dict(opening)
+    ledgers = {acc_no: TransactionLedger() for acc_no in numbers}
+    kinds, weights = zip(*mix.items())
+    total = count * txns_per_account
+    start = date_to_epoch((datetime.now() - timedelta(days=365)).strftime('%Y-%m-%d %H:%M:%S'))
+    step = max(1, 365 * 86400 // max(1, total))
+    for i, kind in enumerate(rng.choices(kinds, weights, k=total)):
+        date = epoch_to_date(start + i * step)
+        acc_no = numbers[rng.randrange(count)]
+        paise = rng.randint(1, 5000) * 100
+        if kind != 'deposit' and balances[acc_no] < paise:
+            kind = 'deposit'
+        if kind == 'transfer' and count > 1:
+            target = numbers[rng.randrange(count)]
+            if target == acc_no:
+                target = numbers[(numbers.index(acc_no) + 1) % count]
+            ledgers[acc_no].add('transfer_to', paise / 100, date, f"Transfer to {target}: bench")
+            ledgers[target].add('transfer_from', paise / 100, date, f"Transfer from {acc_no}: bench")
+            balances[acc_no] -= paise
+            balances[target] += paise
+        elif kind == 'withdraw':
+            ledgers[acc_no].add('withdraw', paise / 100, date, "ATM")
+            balances[acc_no] -= paise
+        else:
+            ledgers[acc_no].add('deposit', paise / 100, date, "Salary")
+            balances[acc_no] += paise
+    accounts = {}
+    for acc_no in numbers:
+        name = f"{rng.choice(BENCH_FIRST_NAMES)} {rng.choice(BENCH_LAST_NAMES)}"
+        account_type = "savings" if rng.random() < savings_share else "current"
+        account = BankAccount(name, acc_no, "1111", account_type, balances[acc_no] / 100, ledgers[acc_no])
+        account.creation_date = epoch_to_date(start)[:10]
+        accounts[acc_no] = account
+    return accounts
+
+def latency_summary(samples):
+    # Milliseconds at the usual percentiles of a list of durations in seconds
+    samples = sorted(samples)
+    if not samples:
+        return {}
+    def at(q):
+        return round(samples[min(len(samples) - 1, int(len(samples) * q))] * 1000, 3)
+    return {'count': len(samples), 'p50_ms': at(0.5), 'p95_ms': at(0.95), 'p99_ms': at(0.99),
+            'mean_ms': round(sum(samples) / len(samples) * 1000, 3)}
+
+def benchmark_suite(account_count=2000, txns_per_account=50, mix=BENCH_TXN_MIX, operations=5000,
+                    queries=500, journal_mode=JOURNAL_FSYNC, seed=1, velocity_rules=()):
+    # Measures the core against a generated bank in a scratch store and returns
+    # a JSON-ready dict (settings, environment and results) for comparing runs
+    global storage
+    rng = random.Random(seed)
+    results = {}
+    started = time.perf_counter()
+    generated = generate_accounts(account_count, txns_per_account, mix, seed=seed)
+    results['generate_seconds'] = round(time.perf_counter() - started, 3)
+    numbers = sorted(generated)
+    with scratch_storage(journal_mode=journal_mode, velocity_rules=velocity_rules) as paths:
+        started = time.perf_counter()
+        save_accounts(generated)
+        results['save_seconds'] = round(time.perf_counter() - started, 3)
+        directory = os.path.dirname(paths[0])
+        results['data_bytes'] = sum(
+            os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory)
+        )
+        del generated
+
+        # Cold start, as after a restart, then a full scan
+        storage.close()
+        started = time.perf_counter()
+        storage = FileStorage(*paths, journal_mode=journal_mode)
+        bank = AccountMap(storage)
+        bank[numbers[0]]
+        results['load_seconds'] = round(time.perf_counter() - started, 3)
+        started = time.perf_counter()
+        for _ in bank.values():
+            pass
+        results['load_all_seconds'] = round(time.perf_counter() - started, 3)
+
+        for op in ('deposit', 'withdraw', 'transfer'):
+            samples = []
+            for _ in range(operations):
+                account = bank[rng.choice(numbers)]
+                began = time.perf_counter()
+                try:
+                    if op == 'deposit':
+                        account.deposit(10, "bench")
+                    elif op == 'withdraw':
+                        account.withdraw(10, "bench")
+                    else:
+                        account.transfer(bank[rng.choice(numbers)], 10, "bench")
+                except ValueError:
+                    pass  # an empty account or a transfer to itself still counts
+                samples.append(time.perf_counter() - began)
+                checkpoint_if_needed(bank)
+            results[op] = dict(latency_summary(samples), ops_per_second=round(len(samples) / sum(samples)))
+
+        def timed(call):
+            samples = []
+            for _ in range(queries):
+                account = bank[rng.choice(numbers)]
+                began = time.perf_counter()
+                call(account)
+                samples.append(time.perf_counter() - began)
+            return latency_summary(samples)
+
+        month_ago = (datetime.now() - timedelta(days=30)).strftime('%Y-%m-%d')
+        results['get_transactions'] = timed(lambda account: account.get_transactions(limit=20))
+        results['get_transactions_filtered'] = timed(lambda account: account.get_transactions(limit=20, txn_type='transfer'))
+        results['get_balance_history'] = timed(lambda account: account.get_balance_history(start=month_ago))
+
+        started = time.perf_counter()
+        bank.search(BENCH_LAST_NAMES[0])
+        results['search_first_seconds'] = round(time.perf_counter() - started, 3)  # builds the index
+        terms = [rng.choice(BENCH_FIRST_NAMES)[:rng.randint(2, 5)] for _ in range(queries)]
+        samples = []
+        for term in terms:
+            began = time.perf_counter()
+            bank.search(term)
+            samples.append(time.perf_counter() - began)
+        results['search'] = latency_summary(samples)
+
+        started = time.perf_counter()
+        save_accounts(bank)
+        results['checkpoint_seconds'] = round(time.perf_counter() - started, 3)
+        screened = {'rules': len(velocity.rules), 'blocked': velocity.blocked, 'flagged': velocity.flagged}
+    return {
+        'settings': {'accounts': account_count, 'txns_per_account': txns_per_account, 'mix': mix,
+                     'operations': operations, 'queries': queries, 'journal_mode': journal_mode,
+                     'shards': SHARD_COUNT, 'seed': seed},
+        'environment': {'python': sys.version.split()[0], 'platform': sys.platform,
+                        'cpus': os.cpu_count(), 'date': now_text()},
+        'velocity': screened,
+        'results': results
+    }
+
+def parse_mix(text, kinds):
+    # 'deposit=50,withdraw=30' -> {'deposit': 50.0, 'withdraw': 30.0}
+    try:
+        mix = {kind.strip(): float(weight) for kind, weight in (part.split('=') for part in text.split(','))}
+    except ValueError:
+        raise ValueError("a mix is kind=weight pairs, e.g. deposit=50,withdraw=30,transfer=20") from None
+    unknown = set(mix) - set(kinds)
+    if unknown:
+        raise ValueError(f"unknown kind in mix: {', '.join(sorted(unknown))}")
+    if not any(weight > 0 for weight in mix.values()):
+        raise ValueError("a mix needs at least one positive weight")
+    return mix
+
+def compare_benchmarks(baseline, current):
+    # (metric, baseline, current, current / baseline) for every number in both
+    # results; for times and sizes above 1 is worse, for ops_per_second better
+    def flatten(results, prefix=''):
+        for key, value in results.items():
+            if isinstance(value, dict):
+                yield from flatten(value, f"{prefix}{key}.")
+            elif isinstance(value, (int, float)) and not key.endswith('count'):
+                yield f"{prefix}{key}", value
+    old = dict(flatten(baseline['results']))
+    return [
+        (metric, old[metric], value, round(value / old[metric], 3) if old[metric] else None)
+        for metric, value in flatten(current['results']) if metric in old
+    ]
+
+class BankServer:
+    # Line-delimited JSON over TCP or a Unix socket. Each line is a request
+    # ({"id": ..., "op": ..., ...}), and each gets one response line, in the
+    # same order, echoing its id. A connection may send many requests without
+    # waiting for replies. Requests from every connection share one queue;
+    # everything waiting there is run in order as a single batch, so one
+    # storage commit covers all of it, and replies are only sent after that
+    # commit.
+    def __init__(self, accounts, metrics_file=None):
+        self.accounts = accounts
+        self.metrics_file = metrics_file  # Prometheus text rewritten with every report
+        self.queue = None
+        self.connections = 0
+        self.requests = 0
+        self.requests_per_second = 0.0
+        operations = {
+            'login': self.op_login,
+            'logout': self.op_logout,
+            'balance': self.op_balance,
+            'deposit': self.op_deposit,
+            'withdraw': self.op_withdraw,
+            'transfer': self.op_transfer,
+            'history': self.op_history,
+            'stats': self.op_stats
+        }
+        self.operations = {name: instrumented(f"server.{name}")(op) for name, op in operations.items()}
+
+    async def serve(self, host=SERVER_HOST, port=SERVER_PORT, path=None):
+        import asyncio
+        self.queue = asyncio.Queue()
+        if path:
+            server = await asyncio.start_unix_server(self.handle, path=path)
+        else:
+            server = await asyncio.start_server(self.handle, host, port)
+        where = path or f"{host}:{port}"
+        print(f"SmartBank server listening on {where}", flush=True)
+        workers = [asyncio.create_task(self.run_batches()), asyncio.create_task(self.report())]
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            for task in workers:
+                task.cancel()
+
+    async def handle(self, reader, writer):
+        session = {'account': None, 'admin': False, 'writer': writer}
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                if line.strip():
+                    self.queue.put_nowait((session, line))
+                # Stop reading from a client that is not reading its replies
+                await writer.drain()
+        except (ConnectionError, ValueError):
+            pass  # client went away, or sent a line longer than the stream limit
+        finally:
+            self.connections -= 1
+            self.queue.put_nowait((session, None))  # closed once its earlier requests are answered
+
+    async def run_batches(self):
+        import asyncio
+        while True:
+            batch_items = [await self.queue.get()]
+            while not self.queue.empty() and len(batch_items) < SERVER_BATCH_LIMIT:
+                batch_items.append(self.queue.get_nowait())
+            replies = {}  # writer -> encoded responses, in request order
+            closing = []
+            with batch_changes(wait=False) as batch:
+                for session, line in batch_items:
+                    if line is None:
+                        closing.append(session['writer'])
+                        continue
+                    response = self.execute(batch, session, line)
+                    replies.setdefault(session['writer'], []).append(
+                        json.dumps(response, separators=(',', ':')).encode()
+                    )
+                    self.requests += 1
+            ticket = take_ticket()
+            if ticket is not None:
+                # Wait for the journal write off the loop, so connections keep reading meanwhile
+                await asyncio.get_running_loop().run_in_executor(None, storage.wait, ticket)
+            # A checkpoint can wait on store_lock or start a snapshot, so it runs off the loop too
+            await asyncio.get_running_loop().run_in_executor(None, checkpoint_if_needed, self.accounts)
+            # Nothing is answered until the batch is committed; then each
+            # connection gets all of its replies in one write
+            for writer, lines in replies.items():
+                if not writer.is_closing():
+                    lines.append(b'')
+                    writer.write(b'\n'.join(lines))
+            for writer in closing:
+                writer.close()
+            await asyncio.sleep(0)  # let connections read and queue more before the next batch
+
+    async def report(self):
+        import asyncio
+        while True:
+            seen = self.requests
+            await asyncio.sleep(SERVER_REPORT_EVERY)
+            self.requests_per_second = (self.requests - seen) / SERVER_REPORT_EVERY
+            print(f"{self.requests_per_second:,.0f} req/s, {self.connections} connections", flush=True)
+            if self.metrics_file and metrics.enabled:
+                metrics.dump(self.metrics_file)
+
+    def execute(self, batch, session, line):
+        request_id = None
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError("Request must be a JSON object")
+            request_id = request.get('id')
+            operation = self.operations.get(request.get('op'))
+            if operation is None:
+                raise ValueError(f"Unknown operation '{request.get('op')}'")
+            return {'id': request_id, 'ok': True, **operation(batch, session, request)}
+        except KeyError as e:
+            return {'id': request_id, 'ok': False, 'error': f"Missing field {e}"}
+        except (ValueError, TypeError) as e:
+            return {'id': request_id, 'ok': False, 'error': str(e)}
+        except Exception as e:
+            # One bad request must not take the batch loop, and every client with it, down
+            print(f"Request failed: {e!r}", file=sys.stderr)
+            return {'id': request_id, 'ok': False, 'error': f"Internal error: {e}"}
+
+    @staticmethod
+    def _field(request, name, types, default=KeyError):
+        # request[name], checked to be one of types (never a bool); a missing or
+        # null field gives default, or is an error if there is none
+        value = request.get(name)
+        if value is None:
+            if default is KeyError:
+                raise KeyError(name)
+            return default
+        if isinstance(value, bool) or not isinstance(value, types):
+            raise ValueError(f"Field '{name}' must be {' or '.join(t.__name__ for t in types)}")
+        return value
+
+    @classmethod
+    def _amount(cls, request):
+        amount = float(cls._field(request, 'amount', (int, float)))
+        if not math.isfinite(amount):
+            raise ValueError("Amount must be a number")
+        return amount
+
+    @classmethod
+    def _description(cls, request):
+        return cls._field(request, 'description', (str,), "")
+
+    @staticmethod
+    def _user(session):
+        if session['account'] is None:
+            raise ValueError("Please login first")
+        return session['account']
+
+    def op_login(self, batch, session, request):
+        acc_no = str(self._field(request, 'account', (str, int))).strip()
+        pin = str(self._field(request, 'pin', (str, int))).strip()
+        if acc_no == "admin" and pin == ADMIN_PIN:
+            session.update(account=None, admin=True)
+            return {'admin': True}
+        user = self.accounts.get(acc_no)
+        if not user:
+            raise ValueError("Account not found")
+        if user.pin != pin:
+            raise ValueError("Invalid PIN")
+        session.update(account=user, admin=False)
+        return {'account': user.account_number, 'name': user.name, 'balance': user.balance}
+
+    def op_logout(self, batch, session, request):
+        session.update(account=None, admin=False)
+        return {}
+
+    def op_balance(self, batch, session, request):
+        return {'balance': self._user(session).balance}
+
+    def op_deposit(self, batch, session, request):
+        user = self._user(session)
+        amount, description = self._amount(request), self._description(request)
+        batch.hold(user)
+        user.deposit(amount, description)
+        return {'balance': user.balance}
+
+    def op_withdraw(self, batch, session, request):
+        user = self._user(session)
+        amount, description = self._amount(request), self._description(request)
+        batch.hold(user)
+        user.withdraw(amount, description)
+        return {'balance': user.balance}
+
+    def op_transfer(self, batch, session, request):
+        user = self._user(session)
+        recipient = str(self._field(request, 'target', (str, int))).strip()
+        amount, description = self._amount(request), self._description(request)
+        if recipient == user.account_number:
+            raise ValueError("Cannot transfer to your own account")
+        target_account = self.accounts.get(recipient)
+        if not target_account:
+            raise ValueError("Recipient account not found")
+        batch.hold(user, target_account)
+        user.transfer(target_account, amount, description)
+        return {'balance': user.balance}
+
+    def op_history(self, batch, session, request):
+        user = self._user(session)
+        limit = self._field(request, 'limit', (int,), 20)
+        if limit < 1:
+            raise ValueError("Field 'limit' must be positive")
+        transactions, next_cursor = user.query_transactions(
+            txn_type=self._field(request, 'type', (str,), None),
+            start=self._field(request, 'start', (str,), None),
+            end=self._field(request, 'end', (str,), None),
+            text=self._field(request, 'text', (str,), None),
+            page_size=limit,
+            cursor=self._field(request, 'cursor', (int,), None)
+        )
+        return {'transactions': [t.to_dict() for t in transactions], 'cursor': next_cursor}
+
+    def op_stats(self, batch, session, request):
+        if not session['admin']:
+            raise ValueError("Admin login required")
+        stats = storage.stats
+        return {
+            'accounts': stats.total_accounts(),
+            'accounts_by_type': stats.accounts_by_type,
+            'total_balance': stats.total_balance / 100,
+            'txn_counts': stats.txn_counts,
+            'txn_totals': {t: paise / 100 for t, paise in stats.txn_totals.items()},
+            'velocity_flagged': velocity.flagged,
+            'velocity_blocked': velocity.blocked,
+            'connections': self.connections,
+            'requests': self.requests,
+            'requests_per_second': self.requests_per_second
+        }
+
+# Load generation
+def plan_sessions(account_numbers, pin, sessions, ops_per_session=5, mix=LOAD_MIX, think=0.0, rng=None):
+    # Customer visits for one simulated ATM: each logs in to a random account,
+    # runs about ops_per_session operations drawn from mix and logs out. Every
+    # step carries the pause before it (exponential, mean think seconds).
+    rng = rng or random.Random()
+    kinds, weights = zip(*mix.items())
+    plan = []
+    for _ in range(sessions):
+        acc_no = rng.choice(account_numbers)
+        steps = [{'op': 'login', 'account': acc_no, 'pin': pin}]
+        for kind in rng.choices(kinds, weights, k=rng.randint(1, 2 * ops_per_session - 1)):
+            step = {'op': kind}
+            if kind != 'balance':
+                step['amount'] = rng.randint(1, 500)
+            if kind == 'transfer':
+                step['target'] = rng.choice(account_numbers)
+                if step['target'] == acc_no:
+                    step['target'] = account_numbers[(account_numbers.index(acc_no) + 1) % len(account_numbers)]
+            steps.append(step)
+        steps.append({'op': 'logout'})
+        for step in steps:
+            step['think'] = round(rng.expovariate(1 / think), 4) if think else 0
+        plan.append(steps)
+    return plan
+
+def connect(address, timeout=None):
+    # address is a Unix socket path or a (host, port) pair
+    import socket
+    if isinstance(address, str):
+        sock = socket.socket(socket.AF_UNIX)
+        sock.settimeout(timeout)
+        sock.connect(address)
+    else:
+        sock = socket.create_connection(address, timeout)
+    sock.settimeout(None)
+    return sock
+
+def run_load_worker(address, plan):
+    # One ATM: runs its sessions in order over a single connection, waiting
+    # for each reply. Returns (ok, seconds) per step, in plan order.
+    results = []
+    with connect(address) as sock, sock.makefile('rwb') as stream:
+        for steps in plan:
+            for step in steps:
+                if step['think']:
+                    time.sleep(step['think'])
+                request = {key: value for key, value in step.items() if key != 'think'}
+                began = time.perf_counter()
+                stream.write(json.dumps(request, separators=(',', ':')).encode() + b'\n')
+                stream.flush()
+                reply = stream.readline()
+                if not reply:
+                    raise ConnectionError("Server closed the connection")
+                results.append((json.loads(reply)['ok'], time.perf_counter() - began))
+    return results
+
+def fetch_balances(address, account_numbers, pin):
+    # Balance of every account, with all the requests pipelined on one connection
+    with connect(address) as sock, sock.makefile('rwb') as stream:
+        for acc_no in account_numbers:
+            stream.write(json.dumps({'op': 'login', 'account': acc_no, 'pin': pin}).encode() + b'\n')
+            stream.write(json.dumps({'op': 'balance'}).encode() + b'\n')
+        stream.write(b'{"op":"logout"}\n')
+        stream.flush()
+        balances = {}
+        for acc_no in account_numbers:
+            login, reply = json.loads(stream.readline()), json.loads(stream.readline())
+            if not login['ok']:
+                raise ValueError(f"Cannot log in to account {acc_no}: {login['error']}")
+            balances[acc_no] = round(reply['balance'] * 100)
+        stream.readline()
+    return balances
+
+def fetch_stats(address):
+    # The admin statistics of a server, e.g. its velocity alert counts
+    with connect(address) as sock, sock.makefile('rwb') as stream:
+        stream.write(json.dumps({'op': 'login', 'account': 'admin', 'pin': ADMIN_PIN}).encode() + b'\n')
+        stream.write(b'{"op":"stats"}\n{"op":"logout"}\n')
+        stream.flush()
+        login, reply = json.loads(stream.readline()), json.loads(stream.readline())
+        stream.readline()
+    if not login['ok'] or not reply['ok']:
+        raise ValueError(f"Cannot read the server statistics: {(reply if login['ok'] else login)['error']}")
+    return reply
+
+def expected_changes(plan, outcomes):
+    # Net paise per account from the steps the server accepted
+    changes = {}
+    current = None
+    for step, (ok, _) in zip(chain.from_iterable(plan), outcomes):
+        if not ok:
+            continue
+        op = step['op']
+        if op == 'login':
+            current = step['account']
+        elif op == 'logout':
+            current = None
+        elif op != 'balance':
+            paise = round(step['amount'] * 100)
+            if op == 'deposit':
+                changes[current] = changes.get(current, 0) + paise
+            else:
+                changes[current] = changes.get(current, 0) - paise
+                if op == 'transfer':
+                    changes[step['target']] = changes.get(step['target'], 0) + paise
+    return changes
+
+def run_scratch_server(paths, address, account_numbers, opening_balance, pin, journal_mode, velocity_rules=()):
+    # Process entry point: a server over a fresh store holding the load-test
+    # accounts, screened by velocity_rules only
+    import asyncio
+    global storage, velocity
+    sys.stdout = open(os.devnull, 'w')
+    storage = FileStorage(*paths, journal_mode=journal_mode)
+    velocity = VelocityGuard(velocity_rules)
+    bank = AccountMap(storage)
+    import_accounts(bank, (
+        BankAccount(f"Load Test {acc_no}", acc_no, pin, "savings", opening_balance) for acc_no in account_numbers
+    ))
+    if isinstance(address, str):
+        asyncio.run(BankServer(bank).serve(path=address))
+    else:
+        asyncio.run(BankServer(bank).serve(*address))
+
+def load_test(workers=4, sessions=50, ops_per_session=5, mix=LOAD_MIX, think=0.0, account_count=100,
+              opening_balance=10000, pin="1111", seed=1, address=None, first_account=LOAD_FIRST_ACCOUNT,
+              journal_mode=JOURNAL_FSYNC, record=None, replay=None, velocity_rules=()):
+    # Simulated ATM traffic from worker processes against a BankServer, one
+    # process and connection per ATM. Without address the server runs in a
+    # child process over a scratch store, screened by velocity_rules only,
+    # that is reopened afterwards, so the check also covers recovery. record writes the traffic, with each step's
+    # outcome, as a JSONL trace; replay runs a recorded trace instead of
+    # generating one, and counts the steps whose outcome changed. Only a
+    # single-worker replay is guaranteed to see the same interleaving.
+    # Returns a report with throughput, latency per operation and the final
+    # balances checked against what the accepted steps should have left.
+    import multiprocessing
+    import socket
+    import tempfile
+    from concurrent.futures import ProcessPoolExecutor
+    recorded = None
+    if replay:
+        with open(replay) as f:
+            header = json.loads(f.readline())
+            traffic = [json.loads(line) for line in f if line.strip()]
+        settings = header['settings']
+        account_count, first_account = settings['accounts'], settings['first_account']
+        opening_balance, pin = settings['opening_balance'], settings['pin']
+        sessions_by_key = {}
+        for step in traffic:
+            sessions_by_key.setdefault((step.pop('worker'), step.pop('session')), []).append(step)
+        plans = {}
+        for (worker, _), steps in sessions_by_key.items():
+            plans.setdefault(worker, []).append(steps)
+        plans = [plans[worker] for worker in sorted(plans)]
+        recorded = [step.pop('ok') for plan in plans for step in chain.from_iterable(plan)]
+        workers = len(plans)
+    else:
+        settings = {'workers': workers, 'sessions': sessions, 'ops_per_session': ops_per_session, 'mix': mix,
+                    'think': think, 'accounts': account_count, 'first_account': first_account,
+                    'opening_balance': opening_balance, 'pin': pin, 'seed': seed}
+        rng = random.Random(seed)
+        numbers = [str(first_account + i) for i in range(account_count)]
+        plans = [plan_sessions(numbers, pin, sessions, ops_per_session, mix, think, rng) for _ in range(workers)]
+    account_numbers = [str(first_account + i) for i in range(account_count)]
+    # Everything the server and worker processes are given pickles, so they
+    # can be spawned where fork is not available, as on Windows
+    context = multiprocessing.get_context('fork' if 'fork' in multiprocessing.get_all_start_methods() else 'spawn')
+    server = None
+    with tempfile.TemporaryDirectory() as tmp:
+        paths = [os.path.join(tmp, name) for name in (DATA_FILE, JOURNAL_FILE, INDEX_FILE)]
+        if address is None:
+            address = os.path.join(tmp, 'server.sock') if hasattr(socket, 'AF_UNIX') else (SERVER_HOST, SERVER_PORT)
+            server = context.Process(
+                target=run_scratch_server,
+                args=(paths, address, account_numbers, opening_balance, pin, journal_mode, velocity_rules),
+                daemon=True
+            )
+            server.start()
+            deadline = time.monotonic() + 60
+            while True:
+                try:
+                    connect(address, timeout=1).close()
+                    break
+                except OSError:
+                    if not server.is_alive() or time.monotonic() > deadline:
+                        raise RuntimeError("The load-test server did not start")
+                    time.sleep(0.05)
+        try:
+            before = fetch_balances(address, account_numbers, pin)
+            stats_before = fetch_stats(address)
+            started = time.perf_counter()
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+                outcomes = list(pool.map(run_load_worker, [address] * workers, plans))
+            elapsed = time.perf_counter() - started
+            after = fetch_balances(address, account_numbers, pin)
+            stats_after = fetch_stats(address)
+        finally:
+            if server is not None:
+                server.terminate()  # as abrupt as a crash; only committed work was acknowledged
+                server.join()
+        recovered = None
+        if server is not None:
+            reopened = FileStorage(*paths, journal_mode=journal_mode)
+            try:
+                bank = AccountMap(reopened)
+                recovered = {acc_no: round(bank[acc_no].balance * 100) for acc_no in account_numbers}
+            finally:
+                reopened.close()
+
+    latencies = {}
+    errors = {}
+    for plan, results in zip(plans, outcomes):
+        for step, (ok, seconds) in zip(chain.from_iterable(plan), results):
+            latencies.setdefault(step['op'], []).append(seconds)
+            if not ok:
+                errors[step['op']] = errors.get(step['op'], 0) + 1
+    requests = sum(len(results) for results in outcomes)
+    changes = {}
+    for plan, results in zip(plans, outcomes):
+        for acc_no, paise in expected_changes(plan, results).items():
+            changes[acc_no] = changes.get(acc_no, 0) + paise
+    expected = {acc_no: before[acc_no] + changes.get(acc_no, 0) for acc_no in account_numbers}
+    mismatched = [acc_no for acc_no in account_numbers if after[acc_no] != expected[acc_no]]
+    consistency = {
+        'accounts': len(account_numbers),
+        'total_before': sum(before.values()) / 100,
+        'total_after': sum(after.values()) / 100,
+        'expected_total': sum(expected.values()) / 100,
+        'mismatched_accounts': mismatched[:20],
+        'mismatched_count': len(mismatched)
+    }
+    if recovered is not None:
+        lost = [acc_no for acc_no in account_numbers if recovered[acc_no] != after[acc_no]]
+        consistency['not_recovered'] = lost[:20]
+        consistency['not_recovered_count'] = len(lost)
+    consistency['ok'] = not mismatched and not consistency.get('not_recovered_count')
+    report = {
+        'settings': settings,
+        'results': {
+            'requests': requests,
+            'sessions': sum(len(plan) for plan in plans),
+            'seconds': round(elapsed, 3),
+            'requests_per_second': round(requests / elapsed) if elapsed else None,
+            'errors': errors,
+            'velocity_blocked': stats_after['velocity_blocked'] - stats_before['velocity_blocked'],
+            'velocity_flagged': stats_after['velocity_flagged'] - stats_before['velocity_flagged'],
+            'latency': {op: latency_summary(samples) for op, samples in sorted(latencies.items())}
+        },
+        'consistency': consistency
+    }
+    if recorded is not None:
+        outcomes_now = [ok for results in outcomes for ok, _ in results]
+        report['replay'] = {
+            'trace': replay,
+            'steps': len(recorded),
+            'changed_outcomes': sum(old != new for old, new in zip(recorded, outcomes_now))
+        }
+    if record:
+        with open(record, 'w') as f:
+            f.write(json.dumps({'trace': 'smartbank-load', 'version': 1, 'settings': settings}) + "\n")
+            for worker, (plan, results) in enumerate(zip(plans, outcomes)):
+                steps = ((session, step) for session, steps in enumerate(plan) for step in steps)
+                for (session, step), (ok, _) in zip(steps, results):
+                    f.write(json.dumps({'worker': worker, 'session': session, **step, 'ok': ok},
+                                       separators=(',', ':')) + "\n")
+    return report
+
+@instrumented('load_accounts')
+def load_accounts():
+    return AccountMap(storage)
+
+@instrumented('save_accounts')
+def save_accounts(accounts):
+    with store_lock:
+        if isinstance(accounts, AccountMap):
+            # Everything in a live map is already journaled; fold it into the snapshot
+            accounts.storage.checkpoint(force=True)
+        else:
+            storage.save(accounts)
+
+@instrumented('checkpoint_if_needed')
+def checkpoint_if_needed(accounts):
+    with store_lock:
+        storage.checkpoint()
+
+storage = None  # the bank's store, opened by open_bank()
+accounts = None
+bank_lock = None  # the open LOCK_FILE, for as long as this process has the bank
+
+def lock_bank(path=LOCK_FILE):
+    # Takes the bank's lock file for this process and returns it open; the
+    # lock lasts until it is closed or the process ends. Only one process may
+    # have the bank's files: a checkpoint in one would truncate the journal
+    # under the other and lose its changes. Raises RuntimeError if another
+    # process (or another open of the file) holds the lock.
+    f = open(path, 'a+')
+    try:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        try:
+            f.seek(0)
+            holder = f.read().strip()
+        except OSError:
+            holder = ""
+        f.close()
+        raise RuntimeError(
+            f"The bank is open in another process{f' (pid {holder})' if holder else ''}; "
+            "close it first, or make changes through its server"
+        ) from None
+    f.seek(0)
+    f.truncate()
+    f.write(str(os.getpid()))
+    f.flush()
+    return f
+
+def open_bank(backend=STORAGE_BACKEND):
+    # Opens the bank's files on first use and returns its accounts, which are
+    # read from storage one at a time as they are asked for. Importing this
+    # module touches no data. Raises RuntimeError if another process has the
+    # bank open (see lock_bank).
+    global storage, accounts, bank_lock
+    with store_lock:
+        if storage is None:
+            bank_lock = bank_lock or lock_bank()
+            storage = create_storage(backend)
+            accounts = load_accounts()
+    return accounts
@@ -0,0 +1,369 @@
+# Checks for smartbank_core; run with python -m unittest (or pytest) from the repository root
+import io
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import smartbank_core as core
+
+
+class ScratchBankTest(unittest.TestCase):
+    # Each test gets an empty FileStorage in a temporary directory
+    def setUp(self):
+        self.scratch = core.scratch_storage()
+        self.paths = self.scratch.__enter__()
+        self.accounts = core.AccountMap(core.storage)
+
+    def tearDown(self):
+        self.scratch.__exit__(None, None, None)
+
+    def open(self, acc_no, balance=100.0):
+        core.open_account(self.accounts, core.BankAccount(f"Test {acc_no}", acc_no, "1111", "savings", balance))
+
+    def reopen(self):
+        # Closes the store and opens it again from its files, as after a restart
+        core.storage.close()
+        core.storage = core.FileStorage(*self.paths)
+        self.accounts = core.AccountMap(core.storage)
+
+
+class ImportOperationsTest(ScratchBankTest):
+    def test_bad_row_leaves_storage_unchanged(self):
+        self.open("1001")
+        journal_size = os.path.getsize(self.paths[1])
+        rows = [
+            (1, '{"type": "deposit", "account": "1001", "amount": 5, "description": 5}'),
+            (2, '{"type": "withdraw", "account": "1001", "amount": 5, "description": ["x"]}'),
+            (3, '[1, 2]'),
+        ]
+        report = core.import_operations(self.accounts, rows)
+        self.assertEqual((report['applied'], report['failed']), (0, 3))
+        self.assertEqual(os.path.getsize(self.paths[1]), journal_size)
+        self.reopen()
+        account = self.accounts["1001"]
+        self.assertEqual(account.balance, 100.0)
+        self.assertEqual(len(account.transactions), 0)
+
+    def test_good_rows_survive_a_bad_one(self):
+        self.open("1001")
+        self.open("1002")
+        rows = [
+            (1, '{"type": "deposit", "account": "1001", "amount": 5}'),
+            (2, '{"type": "transfer", "account": "1001", "target": "1002", "amount": 1, "description": 7}'),
+            (3, '{"type": "transfer", "account": "1001", "target": "1002", "amount": 2, "description": "rent"}'),
+        ]
+        report = core.import_operations(self.accounts, rows)
+        self.assertEqual((report['applied'], report['failed']), (2, 1))
+        self.assertEqual(report['errors'][0][0], 2)
+        self.reopen()
+        self.assertEqual(self.accounts["1001"].balance, 103.0)
+        self.assertEqual(self.accounts["1002"].balance, 102.0)
+
+    def test_stats_match_a_rebuild(self):
+        self.open("1001")
+        self.open("1002")
+        rows = [(1, '{"type": "deposit", "account": "1001", "amount": 5}'),
+                (2, '{"type": "withdraw", "account": "1002", "amount": 3}'),
+                (3, '{"type": "transfer", "account": "1001", "target": "1002", "amount": 2}'),
+                (4, '{"type": "deposit", "account": "1002", "amount": 1.5}')]
+        core.import_operations(self.accounts, rows)
+        rebuilt = core.BankStats.rebuild(self.accounts.values())
+        self.assertEqual(core.storage.stats.to_dict(), rebuilt.to_dict())
+
+    def test_imported_withdrawals_count_towards_later_limits(self):
+        saved = core.velocity
+        core.velocity = core.VelocityGuard()
+        self.addCleanup(setattr, core, 'velocity', saved)
+        self.open("1001")
+        account = self.accounts["1001"]
+        account.withdraw(1)
+        rows = [(n, '{"type": "withdraw", "account": "1001", "amount": 1}') for n in range(1, 6)]
+        self.assertEqual(core.import_operations(self.accounts, rows)['applied'], 5)
+        with self.assertRaisesRegex(ValueError, "Withdrawals per minute"):
+            account.withdraw(1)
+
+
+class ChangeBatchTest(ScratchBankTest):
+    def test_waiting_for_a_busy_account_keeps_the_lock_order(self):
+        # Row 1 deposits to A, row 2 transfers A -> C while C is busy. While the
+        # batch waits for C, another thread takes A and then wants store_lock.
+        for acc_no in ("A", "B", "C"):
+            self.open(acc_no)
+        a, c = self.accounts["A"], self.accounts["C"]
+        c_taken, let_c_go, a_deposited = threading.Event(), threading.Event(), threading.Event()
+        done = []
+
+        def busy_c():
+            with c.lock:
+                c_taken.set()
+                let_c_go.wait()
+
+        def batch():
+            with core.batch_changes() as changes:
+                changes.hold(a)
+                a.deposit(1)
+                a_deposited.set()
+                changes.hold(a, c)
+                a.transfer(c, 1)
+            done.append("batch")
+
+        def takes_a_then_store_lock():
+            with a.lock:
+                let_c_go.set()
+                time.sleep(0.2)
+                with core.store_lock:
+                    done.append("other")
+
+        threads = [threading.Thread(target=busy_c, daemon=True)]
+        threads[0].start()
+        c_taken.wait()
+        threads.append(threading.Thread(target=batch, daemon=True))
+        threads[1].start()
+        a_deposited.wait()
+        threads.append(threading.Thread(target=takes_a_then_store_lock, daemon=True))
+        threads[2].start()
+        for thread in threads:
+            thread.join(timeout=10)
+        self.assertEqual(sorted(done), ["batch", "other"], "deadlocked")
+        self.assertEqual((a.balance, c.balance), (100.0, 101.0))
+
+
+class AccountHeadersTest(ScratchBankTest):
+    def test_headers_carry_the_dates(self):
+        self.open("1001")
+        self.open("1002")
+        core.storage.checkpoint(force=True)
+        self.reopen()
+        self.open("1003")  # only in the journal
+        headers = list(core.storage.account_headers())
+        self.assertEqual([h['account_number'] for h in headers], ["1001", "1002", "1003"])
+        for header in headers:
+            self.assertEqual(header['creation_date'], core.now_text()[:10])
+            self.assertIn('last_accessed', header)
+
+
+class ReconcileTest(ScratchBankTest):
+    def corrupt_journal(self, old, new):
+        core.storage.close()
+        with open(self.paths[1]) as f:
+            journal = f.read()
+        self.assertEqual(journal.count(old), 1)
+        with open(self.paths[1], 'w') as f:
+            f.write(journal.replace(old, new))
+        core.storage = core.FileStorage(*self.paths)
+        self.accounts = core.AccountMap(core.storage)
+
+    def reconcile(self):
+        return core.reconcile(core.storage, full=True, state_file=os.path.join(os.path.dirname(self.paths[0]), "r.json"))
+
+    def test_a_changed_journal_leg_fails_its_checksum(self):
+        self.open("1001")
+        self.open("1002")
+        core.storage.checkpoint(force=True)
+        self.accounts["1001"].deposit(5, "salary")
+        self.accounts["1002"].deposit(5, "refund")  # opened in the snapshot, changed in the journal
+        self.accounts["1001"].deposit(7, "bonus")
+        self.assertTrue(self.reconcile()['ok'])
+        self.corrupt_journal('"description":"salary"', '"description":"salery"')
+        report = self.reconcile()
+        self.assertEqual(report['problems'],
+                         [{'account': "1001", 'problem': "transactions do not match their checksum"}])
+
+    def test_interest_legs_are_rolled_into_the_checksum(self):
+        self.open("1001")
+        self.accounts["1001"].deposit(5, "salary")
+        core.apply_interest_to_all(self.accounts, rate=0.01)
+        self.accounts["1001"].deposit(1, "gift")
+        self.reopen()
+        self.assertTrue(self.reconcile()['ok'])
+        self.corrupt_journal('"description":"salary"', '"description":"salery"')
+        self.assertFalse(self.reconcile()['ok'])
+
+
+class AmountTest(ScratchBankTest):
+    def test_amounts_under_half_a_paise_are_refused(self):
+        self.open("1001")
+        self.open("1002")
+        account = self.accounts["1001"]
+        with self.assertRaisesRegex(ValueError, "Deposit amount must be positive"):
+            account.deposit(0.004)
+        with self.assertRaisesRegex(ValueError, "Withdrawal amount must be positive"):
+            account.withdraw(0.001)
+        with self.assertRaisesRegex(ValueError, "Transfer amount must be positive"):
+            account.transfer(self.accounts["1002"], 0.0049)
+        self.assertEqual(len(account.transactions), 0)
+        account.deposit(0.005)  # rounds to a paisa
+        self.assertEqual(account.balance, 100.01)
+
+
+class BackgroundSnapshotTest(ScratchBankTest):
+    def test_a_failed_snapshot_is_logged_and_folded_in_later(self):
+        self.open("1001")
+        self.accounts["1001"].deposit(5)
+        with mock.patch.object(core.SnapshotShard, '_write_files', side_effect=OSError("disk full")):
+            with core.store_lock:
+                core.storage._start_compaction()
+                with self.assertLogs(core.log, 'ERROR') as logged:
+                    core.storage._finish_compaction(wait=True)
+        self.assertIn("Background snapshot failed: disk full", logged.output[0])
+        with core.store_lock:
+            core.storage.checkpoint()
+        self.reopen()
+        self.assertEqual(self.accounts["1001"].balance, 105.0)
+
+
+class StressTest(unittest.TestCase):
+    def test_concurrent_transfers_keep_the_books(self):
+        report = core.stress_test(workers=4, operations=8000, account_count=20)
+        self.assertTrue(report['conserved'], report)
+        self.assertTrue(report['ok'], report)
+
+
+class AccountSearchIndexTest(unittest.TestCase):
+    def test_short_queries_match_inside_words(self):
+        index = core.AccountSearchIndex([("1001", "Karan Mehta"), ("1002", "Arjun Das"), ("2001", "Meera Iyer")])
+        self.assertEqual(index.search("ar"), ["1002", "1001"])
+        self.assertEqual(index.search("01"), ["1001", "2001"])
+        self.assertEqual(index.search("y"), ["2001"])
+
+    def test_prefix_matches_fill_the_limit_first(self):
+        index = core.AccountSearchIndex([(str(1000 + i), f"Arun {i}") for i in range(5)] + [("2000", "Karan")])
+        self.assertEqual(len(index.search("ar", limit=3)), 3)
+        self.assertNotIn("2000", index.search("ar", limit=5))
+        self.assertIn("2000", index.search("ar", limit=6))
+
+    def test_short_queries_do_not_scan(self):
+        index = core.AccountSearchIndex([(str(10000 + i), f"Name {i}") for i in range(2000)] + [("20000", "Zara")])
+        index.keys = CountingList(index.keys)
+        self.assertEqual(index.search("ra"), ["20000"])
+        self.assertLess(index.keys.reads, 10)
+
+
+class CountingList(list):
+    reads = 0
+
+    def __getitem__(self, i):
+        self.reads += 1
+        return super().__getitem__(i)
+
+
+class BankLockTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "bank.lock")
+
+    def test_a_second_holder_is_refused(self):
+        held = core.lock_bank(self.path)
+        with self.assertRaisesRegex(RuntimeError, f"another process \\(pid {os.getpid()}\\)"):
+            core.lock_bank(self.path)
+        held.close()
+        core.lock_bank(self.path).close()
+
+    def test_another_process_cannot_open_the_bank(self):
+        held = core.lock_bank(self.path)
+        self.addCleanup(held.close)
+        script = ("import sys, smartbank_core as core\n"
+                  "try:\n    core.lock_bank(sys.argv[1])\nexcept RuntimeError:\n    sys.exit(3)\n")
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        result = subprocess.run([sys.executable, "-c", script, self.path], cwd=root)
+        self.assertEqual(result.returncode, 3)
+
+
+class IterJsonObjectTest(unittest.TestCase):
+    DOCUMENT = {"a": 1.5, "b": 2, "c": -30e-2, "d": 12345678901234, "e": "x \\\" \u00e9 y", "f": True,
+                "g": None, "h": False, "i": [1, 2.25, {"j": "k"}], "l": {}, "m": [], "n": -0.5, "o": 7}
+
+    def test_every_chunk_size(self):
+        for text in (json.dumps(self.DOCUMENT), json.dumps(self.DOCUMENT, indent=4)):
+            for chunk_size in range(1, 17):
+                with self.subTest(chunk_size=chunk_size, indent='\n' in text):
+                    members = core.iter_json_object(io.StringIO(text), chunk_size=chunk_size)
+                    self.assertEqual(dict(members), self.DOCUMENT)
+
+    def test_a_truncated_number_at_the_end_is_an_error(self):
+        with self.assertRaises(json.JSONDecodeError):
+            dict(core.iter_json_object(io.StringIO('{"a": 1.'), chunk_size=1))
+
+
+class LegacyDataFileTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.paths = [os.path.join(tmp.name, name) for name in (core.DATA_FILE, core.JOURNAL_FILE, core.INDEX_FILE)]
+
+    def write_legacy(self, count):
+        accounts = {str(1000 + i): core.BankAccount(f"Test {i}", str(1000 + i), "1111", "savings", 100.0 + i).to_dict()
+                    for i in range(count)}
+        with open(self.paths[0], 'w') as f:
+            json.dump(accounts, f, indent=4)
+        with open(self.paths[0], 'rb') as f:
+            return f.read()
+
+    def test_a_truncated_file_is_kept_and_refused(self):
+        original = self.write_legacy(30)[:-400]
+        with open(self.paths[0], 'wb') as f:
+            f.write(original)
+        with self.assertRaisesRegex(RuntimeError, "damaged"):
+            core.FileStorage(*self.paths)
+        with open(self.paths[0], 'rb') as f:
+            self.assertEqual(f.read(), original)
+        self.assertEqual(sorted(os.listdir(self.dir)), [core.DATA_FILE])
+
+    def test_an_intact_file_is_converted(self):
+        self.write_legacy(30)
+        storage = core.FileStorage(*self.paths)
+        self.addCleanup(storage.close)
+        self.assertEqual(storage.count(), 30)
+
+
+class SqliteStatsTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, "bank.db")
+        self.saved = core.storage
+        core.storage = core.SqliteStorage(self.path)
+        self.addCleanup(self.restore)
+
+    def restore(self):
+        core.storage.close()
+        core.storage = self.saved
+
+    def test_rollups_survive_a_restart(self):
+        accounts = core.AccountMap(core.storage)
+        core.open_account(accounts, core.BankAccount("Test", "1001", "1111", "savings", 100.0))
+        accounts["1001"].deposit(5)
+        accounts["1001"].withdraw(2)
+        written = core.storage.stats.to_dict()
+        core.storage.close()
+        core.storage = core.SqliteStorage(self.path)
+        self.assertEqual(core.storage.stats.to_dict(), written)
+        core.storage.rebuild_stats()
+        self.assertEqual(core.storage.stats.to_dict(), written)
+
+    def test_a_migrated_legacy_bank_reconciles(self):
+        # Legacy balances can carry fractions of a paise
+        folder = os.path.dirname(self.path)
+        paths = [os.path.join(folder, name) for name in (core.DATA_FILE, core.JOURNAL_FILE, core.INDEX_FILE)]
+        with open(paths[0], 'w') as f:
+            json.dump({str(1000 + i): core.BankAccount(f"Test {i}", str(1000 + i), "1111", "savings",
+                                                       100.005 + i).to_dict() for i in range(10)}, f)
+        legacy = core.FileStorage(*paths)
+        self.addCleanup(legacy.close)
+        core.storage.save(legacy.load())
+        report = core.reconcile(core.storage, full=True, state_file=os.path.join(folder, "reconcile.json"))
+        self.assertTrue(report['ok'], report)
+
+
+if __name__ == "__main__":
+    unittest.main()